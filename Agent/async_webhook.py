@@ -0,0 +1,428 @@
+"""
+Edición ASGI/asyncio del webhook de WhatsApp.
+
+Mantiene el mismo contrato GET/POST de /webhook y la verificación de firma de
+simple_webhook.py, pero cada conversación en curso espera a OpenAI, Supabase y
+Graph como una corrutina en lugar de ocupar un hilo del sistema operativo.
+
+Las consultas del webhook (ingesta, historial y mensajes del asistente) son las
+corrutinas de `db_operations.aio` sobre el cliente asíncrono de Supabase, y las
+consultas independientes se solapan con `asyncio.gather`. Siguen ejecutándose en
+hilos auxiliares:
+
+- Las herramientas del agente (main.py): son funciones síncronas que usan
+  `db_operations` y Outlook, y `ainvoke` las ejecuta en el pool de hilos del loop.
+- La actualización del resumen de conversación, en el pool de un hilo de
+  conversation_summary (fuera del turno).
+
+Uso:
+    uvicorn async_webhook:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import contextlib
+import hmac
+import hashlib
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+# Importar el agente de main.py
+from main import create_lead_qualification_agent
+# Importar operaciones de base de datos
+from db_operations.aio import (
+    add_message,
+    ingest_inbound_message,
+    merge_consecutive_user_messages,
+    context_cache
+)
+# Importar el cliente asíncrono de WhatsApp
+from whatsapp_client import AsyncWhatsAppClient
+# Importar el resumen acumulado de conversaciones
+from conversation_summary import get_conversation_summarizer, history_since_summary_async, with_summary
+# Importar la instrumentación de consultas por turno
+from supabase_instrumentation import db_turn
+# Importar la invalidación de cachés entre procesos
+from cache_invalidation import start_cache_invalidation, stop_cache_invalidation, get_cache_invalidation_stats
+# Importar utilidades de normalización de teléfonos
+from utils.phone_utils import normalize_phone_number
+# Importar la caché TTL y el registro de métricas
+from utils.ttl_cache import TTLCache
+from utils import metrics
+# Importar el pipeline de logging (cola + hilo de fondo, payloads muestreados)
+from utils.logging_setup import configure_logging, log_payload
+
+# Configurar logging (niveles por módulo con LOG_LEVELS, p. ej. "db_operations=DEBUG")
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configuración de WhatsApp
+WHATSAPP_WEBHOOK_TOKEN = os.getenv("WHATSAPP_WEBHOOK_TOKEN")
+WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
+
+# Número máximo de turnos del agente ejecutándose a la vez
+ASYNC_MAX_CONCURRENT_TURNS = int(os.getenv("ASYNC_MAX_CONCURRENT_TURNS", 500))
+
+# Ventana (en segundos) para agrupar ráfagas de mensajes de un mismo remitente (0 = desactivado)
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", 2.0))
+
+# IDs de mensajes ya recibidos: WhatsApp reintenta entregas y no deben procesarse dos veces
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 86400))
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", 100000))
+
+# Inicializar el agente
+lead_agent = create_lead_qualification_agent()
+
+# Conjunto de IDs de mensajes ya vistos (TTL + LRU) para descartar entregas repetidas
+seen_message_ids = TTLCache(maxsize=WEBHOOK_DEDUP_MAX_ENTRIES, ttl=WEBHOOK_DEDUP_TTL)
+
+# Mensajes pendientes y tarea activa por remitente: una sola tarea por remitente
+# garantiza el orden, y todo lo que llega mientras espera se procesa en un solo turno
+pending_messages = {}
+sender_tasks = {}
+
+# Cliente asíncrono de WhatsApp compartido (se crea al iniciar la aplicación)
+whatsapp_client = None
+turn_semaphore = None
+
+# ---- CLIENTE DE WHATSAPP ----
+
+async def send_whatsapp_message(to, message_type, content, caption=None):
+    """
+    Envía un mensaje a WhatsApp usando la Cloud API.
+
+    Args:
+        to: Número de teléfono del destinatario
+        message_type: Tipo de mensaje (text, image, audio, video)
+        content: Contenido del mensaje (texto o URL)
+        caption: Pie de foto/video (opcional)
+
+    Returns:
+        Respuesta de la API
+    """
+    start_time = time.time()
+    result = await whatsapp_client.send_message(to, message_type, content, caption)
+    elapsed_time = time.time() - start_time
+    logger.info(f"Respuesta recibida en {elapsed_time:.2f}s (enviado: {result is not None})")
+    return result
+
+async def mark_message_as_read(message_id):
+    """Marca un mensaje como leído"""
+    return await whatsapp_client.mark_message_as_read(message_id)
+
+# ---- PROCESAMIENTO DE MENSAJES ----
+
+@db_turn("whatsapp")
+async def process_incoming_messages(sender, incoming_messages):
+    """
+    Procesa una ráfaga de mensajes entrantes de un mismo remitente como un solo turno del agente.
+
+    Las operaciones de base de datos (db_operations.aio), el agente y las llamadas
+    a Graph se esperan de forma asíncrona en el bucle de eventos.
+
+    Args:
+        sender: Número de teléfono del remitente
+        incoming_messages: Lista de mensajes {type, content, message_id} en orden de llegada
+    """
+    start_time = time.time()
+    content = "\n".join(str(item.get("content") or "") for item in incoming_messages)
+    logger.info(f"Procesando {len(incoming_messages)} mensaje(s) de {sender}")
+
+    try:
+        # Normalizar el número de teléfono del remitente
+        sender = normalize_phone_number(sender) or sender
+
+        # Registrar usuario, conversación y mensajes y obtener el historial en un solo viaje a la BD
+        ingest_result = await ingest_inbound_message(
+            sender,
+            [
+                {
+                    "content": item.get("content"),
+                    "message_type": item.get("type", "text"),
+                    "external_id": item.get("message_id")
+                }
+                for item in incoming_messages
+            ],
+            platform="whatsapp"
+        )
+        if ingest_result.get("is_new_conversation"):
+            logger.info("Iniciando nueva conversación con mensajes de sistema y bienvenida")
+
+        for external_id in ingest_result.get("duplicates") or []:
+            # Entrega repetida que no estaba en la caché de este proceso (p. ej. tras un reinicio)
+            metrics.increment("webhook.duplicates.database")
+            logger.info(f"Mensaje duplicado descartado por la BD: {external_id}")
+
+        stored_messages = ingest_result.get("stored") or []
+        if not stored_messages:
+            logger.info("Todos los mensajes eran duplicados; no se invoca al agente")
+            return True
+
+        # Marcar como leídos los mensajes que quedaron registrados
+        read_receipts = [
+            mark_message_as_read(stored_message["external_id"])
+            for stored_message in stored_messages
+            if stored_message.get("external_id")
+        ]
+        if read_receipts:
+            await asyncio.gather(*read_receipts)
+
+        conversation = ingest_result["conversation"]
+        messages_history = ingest_result["history"]
+
+        # Añadir el resumen de los mensajes anteriores (con todos los mensajes que aún no
+        # cubre) y combinar los mensajes consecutivos del usuario en un solo turno
+        messages_history = with_summary(await history_since_summary_async(messages_history, conversation), conversation)
+        messages_history = merge_consecutive_user_messages(messages_history)
+
+        # Configuración para la ejecución del agente
+        config = {
+            "configurable": {
+                "thread_id": sender
+            }
+        }
+
+        # Invocar al agente con el historial de mensajes
+        response = await lead_agent.ainvoke(
+            {"messages": messages_history},
+            config
+        )
+
+        # Obtener la respuesta del agente
+        assistant_message = response["messages"][-1]
+        if hasattr(assistant_message, "content"):
+            # Si es un objeto de mensaje de LangChain
+            agent_response = assistant_message.content
+        elif isinstance(assistant_message, dict) and "content" in assistant_message:
+            # Si es un diccionario
+            agent_response = assistant_message["content"]
+        else:
+            # Fallback
+            agent_response = str(assistant_message)
+
+        # Enviar la respuesta al usuario
+        send_result = await send_whatsapp_message(sender, "text", agent_response)
+        logger.info(f"Respuesta enviada al usuario: {send_result is not None}")
+
+        # Guardar respuesta del asistente en la base de datos
+        try:
+            await add_message(
+                conversation_id=conversation["id"],
+                role="assistant",
+                content=agent_response,
+                message_type="text"
+            )
+        except Exception as save_error:
+            logger.error(f"Error al guardar respuesta del asistente: {str(save_error)}")
+
+        # Mensajes entrantes y respuesta: el resumen se actualiza cada K mensajes en segundo plano
+        get_conversation_summarizer().record_messages(conversation, len(stored_messages) + 1)
+
+        elapsed_time = time.time() - start_time
+        logger.info(f"Mensaje procesado en {elapsed_time:.2f}s")
+        return True
+
+    except Exception as e:
+        elapsed_time = time.time() - start_time
+        logger.error(f"Error al procesar mensaje después de {elapsed_time:.2f}s: {str(e)}")
+        import traceback
+        error_trace = traceback.format_exc()
+        logger.error(f"Traza completa del error: {error_trace}")
+
+        # Verificar si es un error relacionado con la cancelación de reuniones
+        if "cancel_meeting" in content.lower() and "exitosamente" in error_trace:
+            await send_whatsapp_message(sender, "text", "La reunión ha sido cancelada exitosamente.")
+            return True
+
+        # Enviar mensaje de error genérico para otros casos
+        error_message = "Lo siento, estamos experimentando dificultades técnicas. Por favor, intenta nuevamente más tarde."
+        await send_whatsapp_message(sender, "text", error_message)
+        return False
+
+async def drain_sender_messages(sender_key):
+    """
+    Procesa en orden los mensajes pendientes de un remitente hasta vaciar su cola.
+    """
+    try:
+        while True:
+            # Esperar la ventana de agrupación para juntar la ráfaga en curso
+            if WEBHOOK_COALESCE_WINDOW > 0:
+                await asyncio.sleep(WEBHOOK_COALESCE_WINDOW)
+
+            batch = pending_messages.pop(sender_key, None)
+            if not batch:
+                return
+
+            async with turn_semaphore:
+                await process_incoming_messages(batch[0].get("sender") or sender_key, batch)
+    finally:
+        sender_tasks.pop(sender_key, None)
+        # Si llegó algo justo al terminar, iniciar una nueva tarea para ese remitente
+        if pending_messages.get(sender_key):
+            schedule_sender(sender_key)
+
+def schedule_sender(sender_key):
+    """Inicia la tarea de un remitente si no tiene una activa"""
+    if sender_key not in sender_tasks:
+        sender_tasks[sender_key] = asyncio.create_task(drain_sender_messages(sender_key))
+
+def build_incoming_message(message):
+    """
+    Convierte un mensaje del webhook al formato {sender, type, content, message_id}.
+
+    Returns:
+        Mensaje preparado o None si el tipo no está soportado
+    """
+    message_type = message.get('type')
+    sender = message.get('from')
+    message_id = message.get('id')
+
+    if message_type == 'text':
+        text = message.get('text', {}).get('body', '')
+        return {"sender": sender, "type": "text", "content": text, "message_id": message_id}
+
+    elif message_type in ["image", "audio", "video"]:
+        # Para mensajes multimedia, informamos al agente del tipo de contenido
+        media_type_names = {
+            "image": "imagen",
+            "audio": "audio",
+            "video": "video"
+        }
+        media_message = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
+        return {"sender": sender, "type": "text", "content": media_message, "message_id": message_id}
+
+    logger.warning(f"Tipo de mensaje no soportado: {message_type}")
+    return None
+
+def process_webhook_messages(message_data):
+    """
+    Encola los mensajes recibidos en el webhook en la cola de su remitente.
+    """
+    for message in message_data.get('messages', []):
+        sender = message.get('from')
+        message_id = message.get('id')
+
+        # Descartar entregas repetidas antes de hacer cualquier trabajo
+        if message_id and not seen_message_ids.add(message_id):
+            metrics.increment("webhook.duplicates.memory")
+            logger.info(f"Mensaje duplicado descartado: {message_id}")
+            continue
+
+        incoming_message = build_incoming_message(message)
+        if not incoming_message:
+            continue
+
+        sender_key = normalize_phone_number(sender) or sender
+        pending_messages.setdefault(sender_key, []).append(incoming_message)
+        schedule_sender(sender_key)
+
+# ---- RUTAS DEL WEBHOOK ----
+
+async def verify_webhook(request: Request):
+    """
+    Maneja la verificación del webhook por parte de WhatsApp.
+    """
+    mode = request.query_params.get('hub.mode')
+    token = request.query_params.get('hub.verify_token')
+    challenge = request.query_params.get('hub.challenge')
+
+    if mode == 'subscribe' and token == WHATSAPP_WEBHOOK_TOKEN:
+        logger.info("Webhook verificado!")
+        return PlainTextResponse(challenge, status_code=200)
+    else:
+        logger.warning(f"Verificación fallida. Mode: {mode}")
+        return PlainTextResponse("Verification failed", status_code=403)
+
+async def receive_webhook(request: Request):
+    """
+    Recibe notificaciones de mensajes y eventos de WhatsApp.
+    """
+    payload = await request.body()
+
+    # Verificar firma X-Hub-Signature-256
+    signature = request.headers.get('X-Hub-Signature-256', '')
+
+    if WHATSAPP_APP_SECRET:
+        expected_signature = 'sha256=' + hmac.new(
+            WHATSAPP_APP_SECRET.encode('utf-8'),
+            payload,
+            hashlib.sha256
+        ).hexdigest()
+
+        if not hmac.compare_digest(signature, expected_signature):
+            logger.warning("Firma inválida en webhook")
+            return PlainTextResponse("Invalid signature", status_code=403)
+
+    # Procesar datos del webhook
+    data = json.loads(payload or b"{}")
+    # Payload para diagnóstico (todos en DEBUG, una muestra en INFO)
+    log_payload(logger, "Webhook recibido", data)
+
+    # Verificar si es un mensaje entrante
+    if data.get('object') == 'whatsapp_business_account':
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                if change.get('field') == 'messages':
+                    process_webhook_messages(change.get('value', {}))
+
+    # Responder rápidamente para cumplir con el requisito de WhatsApp
+    return PlainTextResponse("OK", status_code=200)
+
+async def stats(request: Request):
+    """
+    Retorna los turnos en curso, las estadísticas del cliente de WhatsApp y las métricas del proceso.
+    """
+    return JSONResponse({
+        "active_senders": len(sender_tasks),
+        "pending_senders": len(pending_messages),
+        "whatsapp_client": whatsapp_client.get_stats(),
+        "conversation_summary": get_conversation_summarizer().get_stats(),
+        "cache_invalidation": get_cache_invalidation_stats(),
+        "metrics": metrics.snapshot()
+    })
+
+async def index(request: Request):
+    return PlainTextResponse("WhatsApp Webhook (ASGI) está funcionando. Usa /webhook para recibir mensajes.")
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """
+    Crea el cliente de WhatsApp compartido, el semáforo de turnos y la escucha de
+    invalidaciones de caché, y los libera al apagar
+    """
+    global whatsapp_client, turn_semaphore
+    whatsapp_client = AsyncWhatsAppClient()
+    turn_semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_TURNS)
+    start_cache_invalidation(context_cache)
+    logger.info(f"Webhook ASGI iniciado (máximo {ASYNC_MAX_CONCURRENT_TURNS} turnos concurrentes)")
+    try:
+        yield
+    finally:
+        await whatsapp_client.aclose()
+        stop_cache_invalidation()
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/webhook', verify_webhook, methods=['GET']),
+        Route('/webhook', receive_webhook, methods=['POST']),
+        Route('/stats', stats, methods=['GET'])
+    ],
+    lifespan=lifespan
+)
+
+# Ejecutar servidor local si se ejecuta directamente
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.getenv("PORT", 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,412 @@
+"""
+Invalidación de cachés entre procesos a partir de los cambios de filas.
+
+Cada proceso del webhook (y cada proceso del pool del agente) tiene su propia
+caché de contexto (usuario, conversación activa y calificación de lead). Una
+escritura en un proceso deja datos viejos en los demás; para evitarlo, los
+triggers de `notify_cache_invalidation` (ver supabase_schema.sql y la migración
+005) publican con `pg_notify` cada INSERT, UPDATE o DELETE de users,
+conversations, lead_qualification y meetings, y cada proceso escucha el canal y
+desaloja exactamente las filas afectadas por su ID.
+
+Transportes (CACHE_INVALIDATION_TRANSPORT):
+    auto:     LISTEN/NOTIFY si hay CACHE_INVALIDATION_DATABASE_URL; si no, desactivado
+    postgres: LISTEN/NOTIFY sobre una conexión directa a Postgres (psycopg2)
+    local:    LocalBroker en memoria, para pruebas sin base de datos; los backends
+              memory y sqlite publican en él sus escrituras (un solo proceso)
+    off:      desactivado
+
+LISTEN necesita una conexión de sesión: con Supabase hay que usar la conexión
+directa (puerto 5432) o el pooler en modo sesión, no el modo transacción. Si la
+conexión se pierde se pueden haber perdido notificaciones, así que al reconectar
+se vacían las cachés. Con el bus activo la caché de contexto usa un TTL largo
+(CONTEXT_CACHE_TTL, ver db_operations).
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+CACHE_INVALIDATION_TRANSPORT = os.getenv("CACHE_INVALIDATION_TRANSPORT", "auto").lower()
+CACHE_INVALIDATION_DATABASE_URL = os.getenv("CACHE_INVALIDATION_DATABASE_URL")
+# Debe coincidir con el canal de notify_cache_invalidation en la base de datos
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache_invalidation")
+
+# Espera entre reintentos de conexión (se duplica hasta el máximo)
+CACHE_INVALIDATION_RETRY_DELAY = float(os.getenv("CACHE_INVALIDATION_RETRY_DELAY", 1.0))
+CACHE_INVALIDATION_MAX_RETRY_DELAY = float(os.getenv("CACHE_INVALIDATION_MAX_RETRY_DELAY", 30.0))
+
+# Tablas con notificaciones y el campo de la caché de contexto que les corresponde
+# (meetings no tiene caché propia; sus eventos llegan a los manejadores registrados)
+TABLE_CONTEXT_FIELDS = {
+    "users": "user",
+    "conversations": "conversation",
+    "lead_qualification": "lead_qualification",
+    "meetings": None
+}
+
+
+def parse_notification(payload: str) -> Optional[Dict]:
+    """
+    Convierte el payload de una notificación en un evento {table, op, id}.
+
+    Args:
+        payload: JSON publicado por notify_cache_invalidation
+
+    Returns:
+        Evento o None si el payload no es válido
+    """
+    try:
+        event = json.loads(payload)
+    except (TypeError, ValueError):
+        logger.warning(f"Notificación de invalidación inválida: {payload!r}")
+        return None
+    if not isinstance(event, dict) or not event.get("table") or not event.get("id"):
+        logger.warning(f"Notificación de invalidación incompleta: {payload!r}")
+        return None
+    return event
+
+
+class CacheInvalidator:
+    """
+    Aplica los eventos de cambio de filas a las cachés del proceso.
+    Por defecto desaloja las filas de la caché de contexto; se pueden registrar
+    manejadores adicionales por tabla con `register`.
+    """
+
+    def __init__(self, context_cache=None):
+        """
+        Args:
+            context_cache: Caché de contexto (ConversationContextCache) a mantener coherente
+        """
+        self.context_cache = context_cache
+        self._handlers: Dict[str, List[Callable[[Dict], None]]] = {}
+        self._resync_handlers: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._stats = {"events": 0, "evictions": 0, "resyncs": 0, "errors": 0}
+
+    def register(self, table: str, handler: Callable[[Dict], None]):
+        """
+        Registra un manejador para los eventos de una tabla.
+
+        Args:
+            table: Nombre de la tabla
+            handler: Función que recibe el evento {table, op, id}
+        """
+        with self._lock:
+            self._handlers.setdefault(table, []).append(handler)
+
+    def register_resync(self, handler: Callable[[], None]):
+        """Registra una función que vacía una caché cuando se pudieron perder eventos"""
+        with self._lock:
+            self._resync_handlers.append(handler)
+
+    def handle(self, event: Optional[Dict]):
+        """
+        Desaloja de las cachés la fila del evento.
+
+        Args:
+            event: Evento {table, op, id}
+        """
+        if not event:
+            return
+        table = event.get("table")
+        with self._lock:
+            self._stats["events"] += 1
+            handlers = list(self._handlers.get(table, []))
+
+        field = TABLE_CONTEXT_FIELDS.get(table)
+        if field and self.context_cache is not None:
+            if self.context_cache.key_for(field, event["id"]) is not None:
+                with self._lock:
+                    self._stats["evictions"] += 1
+            self.context_cache.discard(field, event["id"])
+
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                logger.warning(f"Error en el manejador de invalidación de {table}: {str(e)}")
+
+    def resync(self):
+        """Vacía las cachés (tras una desconexión en la que se pudieron perder eventos)"""
+        with self._lock:
+            self._stats["resyncs"] += 1
+            handlers = list(self._resync_handlers)
+        if self.context_cache is not None:
+            self.context_cache.clear()
+        for handler in handlers:
+            try:
+                handler()
+            except Exception as e:
+                logger.warning(f"Error al vaciar una caché tras reconectar: {str(e)}")
+        logger.info("Cachés vaciadas para resincronizar la invalidación")
+
+    def get_stats(self):
+        """Retorna eventos recibidos, filas desalojadas, resincronizaciones y errores"""
+        with self._lock:
+            return dict(self._stats)
+
+
+class LocalBroker:
+    """
+    Bus de invalidación en memoria con la misma interfaz que PostgresNotifyListener.
+    Sirve para pruebas sin base de datos y para varias cachés dentro de un proceso.
+    """
+
+    transport = "local"
+
+    def __init__(self):
+        self._subscribers: List[Callable[[Dict], None]] = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, callback: Callable[[Dict], None], on_resync: Optional[Callable[[], None]] = None):
+        """
+        Suscribe una función a los eventos del bus.
+
+        Args:
+            callback: Función que recibe cada evento {table, op, id}
+            on_resync: Ignorado (el bus local no pierde eventos)
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def publish(self, table: str, op: str, row_id: str):
+        """
+        Publica el cambio de una fila, como lo haría el trigger de la base de datos.
+
+        Args:
+            table: Nombre de la tabla
+            op: INSERT, UPDATE o DELETE
+            row_id: ID de la fila
+        """
+        event = {"table": table, "op": op, "id": row_id}
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for callback in subscribers:
+            callback(event)
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def get_stats(self):
+        with self._lock:
+            return {"transport": self.transport, "connected": True,
+                    "subscribers": len(self._subscribers), "published": self.published}
+
+
+class PostgresNotifyListener:
+    """
+    Escucha un canal de Postgres (LISTEN) en un hilo de fondo y entrega cada
+    notificación a los suscriptores. Reconecta con espera exponencial y, al
+    reconectar, pide a los suscriptores que vacíen sus cachés.
+    """
+
+    transport = "postgres"
+
+    def __init__(self, dsn: str, channel: str = CACHE_INVALIDATION_CHANNEL):
+        """
+        Args:
+            dsn: Cadena de conexión directa a Postgres
+            channel: Canal de las notificaciones
+        """
+        self.dsn = dsn
+        self.channel = channel
+        self._subscribers: List[Callable[[Dict], None]] = []
+        self._resync_subscribers: List[Callable[[], None]] = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._connection = None
+        self._stats = {"notifications": 0, "connections": 0, "disconnections": 0}
+        self.connected = False
+
+    def subscribe(self, callback: Callable[[Dict], None], on_resync: Optional[Callable[[], None]] = None):
+        """
+        Suscribe una función a los eventos del canal.
+
+        Args:
+            callback: Función que recibe cada evento {table, op, id}
+            on_resync: Función a llamar al reconectar (se pudieron perder eventos)
+        """
+        self._subscribers.append(callback)
+        if on_resync:
+            self._resync_subscribers.append(on_resync)
+
+    def start(self):
+        """Inicia el hilo de escucha"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el hilo de escucha y cierra la conexión"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._close()
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        connection = psycopg2.connect(self.dsn, application_name="cache-invalidation")
+        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        self.connected = False
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, event):
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning(f"Error al aplicar una invalidación: {str(e)}")
+
+    def _resync(self):
+        for callback in self._resync_subscribers:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Error al resincronizar las cachés: {str(e)}")
+
+    def _run(self):
+        delay = CACHE_INVALIDATION_RETRY_DELAY
+        while not self._stop.is_set():
+            try:
+                self._connection = self._connect()
+                self.connected = True
+                self._stats["connections"] += 1
+                logger.info(f"Escuchando invalidaciones de caché en el canal '{self.channel}'")
+                if self._stats["connections"] > 1:
+                    # Los cambios ocurridos mientras no había conexión no se notificaron
+                    self._resync()
+                delay = CACHE_INVALIDATION_RETRY_DELAY
+
+                while not self._stop.is_set():
+                    readable, _, _ = select.select([self._connection], [], [], 1.0)
+                    if not readable:
+                        continue
+                    self._connection.poll()
+                    while self._connection.notifies:
+                        notification = self._connection.notifies.pop(0)
+                        self._stats["notifications"] += 1
+                        event = parse_notification(notification.payload)
+                        if event:
+                            self._dispatch(event)
+            except ImportError:
+                logger.error("psycopg2 no está instalado: la invalidación de cachés por LISTEN/NOTIFY queda desactivada")
+                return
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                was_connected = self.connected
+                self._close()
+                if was_connected:
+                    self._stats["disconnections"] += 1
+                    # Hasta reconectar, las cachés no reciben invalidaciones
+                    self._resync()
+                logger.warning(f"Error en la conexión de invalidación de caché ({str(e).strip()}); reintentando en {delay:.1f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, CACHE_INVALIDATION_MAX_RETRY_DELAY)
+        self._close()
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats.update({"transport": self.transport, "connected": self.connected, "channel": self.channel})
+        return stats
+
+
+_bus = None
+_invalidator = None
+_bus_lock = threading.Lock()
+
+
+def is_cache_invalidation_configured() -> bool:
+    """Indica si la configuración activa algún transporte de invalidación"""
+    if CACHE_INVALIDATION_TRANSPORT == "local":
+        return True
+    if CACHE_INVALIDATION_TRANSPORT in ("auto", "postgres"):
+        return bool(CACHE_INVALIDATION_DATABASE_URL)
+    return False
+
+
+def start_cache_invalidation(context_cache=None, bus=None) -> Optional[CacheInvalidator]:
+    """
+    Conecta la caché de contexto del proceso al bus de invalidación (una vez por proceso).
+
+    Args:
+        context_cache: Caché de contexto a mantener coherente
+        bus: Bus a usar (LocalBroker o PostgresNotifyListener); por defecto según la configuración
+
+    Returns:
+        El invalidador del proceso, o None si la invalidación está desactivada
+    """
+    global _bus, _invalidator
+    with _bus_lock:
+        if _invalidator is not None:
+            return _invalidator
+
+        if bus is None:
+            if CACHE_INVALIDATION_TRANSPORT == "local":
+                bus = LocalBroker()
+            elif CACHE_INVALIDATION_TRANSPORT in ("auto", "postgres") and CACHE_INVALIDATION_DATABASE_URL:
+                bus = PostgresNotifyListener(CACHE_INVALIDATION_DATABASE_URL)
+            else:
+                if CACHE_INVALIDATION_TRANSPORT == "postgres":
+                    logger.warning("CACHE_INVALIDATION_DATABASE_URL no configurada: invalidación de cachés desactivada")
+                return None
+
+        invalidator = CacheInvalidator(context_cache)
+        bus.subscribe(invalidator.handle, on_resync=invalidator.resync)
+        bus.start()
+        _bus, _invalidator = bus, invalidator
+        logger.info(f"Invalidación de cachés activa (transporte: {bus.transport})")
+        return invalidator
+
+
+def stop_cache_invalidation():
+    """Detiene el bus de invalidación del proceso"""
+    global _bus, _invalidator
+    with _bus_lock:
+        bus, _bus, _invalidator = _bus, None, None
+    if bus is not None:
+        bus.stop()
+
+
+def get_invalidation_bus():
+    """Retorna el bus de invalidación del proceso (None si está desactivado)"""
+    return _bus
+
+
+def get_cache_invalidation_stats() -> Dict:
+    """Retorna las estadísticas del bus y del invalidador del proceso"""
+    bus, invalidator = _bus, _invalidator
+    if bus is None or invalidator is None:
+        return {"enabled": False}
+    stats = {"enabled": True}
+    stats.update(bus.get_stats())
+    stats.update(invalidator.get_stats())
+    return stats
@@ -0,0 +1,256 @@
+"""
+Resumen acumulado de las conversaciones.
+
+El agente recibe solo los últimos mensajes de la conversación; los datos que el
+cliente dio antes (correo, presupuesto, plazos) se conservan en un resumen que se
+guarda en `conversations.summary` y se inyecta como mensaje de sistema.
+
+El resumen se actualiza cada SUMMARY_EVERY_MESSAGES mensajes, en segundo plano
+y de forma incremental: el modelo recibe el resumen anterior y solo los mensajes
+nuevos que ya salieron del historial reciente, y `summary_until` marca hasta qué
+mensaje llega. Así el prompt y el costo de leer el historial quedan acotados
+aunque la conversación siga creciendo.
+
+Como el resumen se actualiza cada cierto número de mensajes y en segundo plano,
+entre `summary_until` y el historial reciente puede haber mensajes que aún no
+están en ninguno de los dos: con resumen, el historial del agente se arma con
+todos los mensajes posteriores a `summary_until` (ver history_since_summary).
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from db_operations import HISTORY_MAX_MESSAGES, get_messages_since, get_recent_messages, update_conversation_summary
+from db_operations import aio as db_aio
+from utils.ttl_cache import TTLCache
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Cada cuántos mensajes nuevos se revisa el resumen (0 = desactivado)
+SUMMARY_EVERY_MESSAGES = int(os.getenv("SUMMARY_EVERY_MESSAGES", 10))
+
+# Mensajes recientes que el agente ya recibe completos (no se resumen todavía):
+# los mismos que trae el historial de la ingesta
+SUMMARY_TAIL_MESSAGES = HISTORY_MAX_MESSAGES
+
+# Máximo de mensajes que se incorporan al resumen en una actualización
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", 50))
+
+# Modelo y longitud máxima del resumen
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", 1500))
+SUMMARY_REQUEST_TIMEOUT = int(os.getenv("SUMMARY_REQUEST_TIMEOUT", 60))
+
+SUMMARY_PROMPT = (
+    "Eres el encargado de mantener el resumen de una conversación entre un asistente "
+    "virtual de desarrollo de software y un potencial cliente. Actualiza el resumen "
+    "anterior con los mensajes nuevos. Conserva los datos concretos que el cliente ya "
+    "dio (nombre, empresa, correo, teléfono, consentimiento, presupuesto, autoridad, "
+    "necesidad, plazos, tipo de aplicación, características, integraciones y reuniones) "
+    "y el paso del proceso en que se encuentra. Escribe en español, en viñetas breves, "
+    f"sin superar {SUMMARY_MAX_CHARS} caracteres."
+)
+
+# Encabezado del mensaje de sistema con el resumen
+SUMMARY_HEADER = "Resumen de la conversación hasta ahora:"
+
+
+def with_summary(history: List[Dict], conversation: Optional[Dict]) -> List[Dict]:
+    """
+    Inserta el resumen de la conversación en el historial, después de los mensajes de sistema.
+
+    Args:
+        history: Historial en formato {role, content}
+        conversation: Fila de la conversación (con `summary` si existe)
+
+    Returns:
+        Historial con el resumen como mensaje de sistema (o el mismo historial si no hay resumen)
+    """
+    summary = (conversation or {}).get("summary")
+    if not summary or not history:
+        return history
+
+    position = 0
+    while position < len(history) and history[position]["role"] == "system":
+        position += 1
+    summary_message = {"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"}
+    return history[:position] + [summary_message] + history[position:]
+
+
+def _summary_window(conversation: Optional[Dict]) -> Optional[str]:
+    """Retorna el `summary_until` de la conversación si su historial debe ampliarse"""
+    if SUMMARY_EVERY_MESSAGES <= 0 or not conversation or not conversation.get("id"):
+        return None
+    return conversation.get("summary_until")
+
+
+def _extend_history(history: List[Dict], recent_messages: List[Dict]) -> List[Dict]:
+    """Reemplaza los mensajes no-sistema del historial por `recent_messages` si son más"""
+    system_messages = [message for message in history if message["role"] == "system"]
+    if len(recent_messages) <= len(history) - len(system_messages):
+        return history
+    return system_messages + [
+        {"role": message["role"], "content": message["content"]} for message in recent_messages
+    ]
+
+
+def history_since_summary(history: List[Dict], conversation: Optional[Dict]) -> List[Dict]:
+    """
+    Amplía el historial con todos los mensajes posteriores a `summary_until`, para que
+    ninguno quede fuera del resumen y del historial reciente a la vez.
+
+    Args:
+        history: Historial en formato {role, content} (mensajes de sistema y recientes)
+        conversation: Fila de la conversación (con `summary_until` si tiene resumen)
+
+    Returns:
+        Historial con los mensajes desde `summary_until` (a lo sumo tail + every) o el mismo historial
+    """
+    summary_until = _summary_window(conversation)
+    if not summary_until or not history:
+        return history
+    recent_messages = get_recent_messages(
+        conversation["id"], SUMMARY_TAIL_MESSAGES + SUMMARY_EVERY_MESSAGES, since=summary_until
+    )
+    return _extend_history(history, recent_messages)
+
+
+async def history_since_summary_async(history: List[Dict], conversation: Optional[Dict]) -> List[Dict]:
+    """Versión de history_since_summary para db_operations.aio"""
+    summary_until = _summary_window(conversation)
+    if not summary_until or not history:
+        return history
+    recent_messages = await db_aio.get_recent_messages(
+        conversation["id"], SUMMARY_TAIL_MESSAGES + SUMMARY_EVERY_MESSAGES, since=summary_until
+    )
+    return _extend_history(history, recent_messages)
+
+
+class ConversationSummarizer:
+    """
+    Cuenta los mensajes de cada conversación y, cada `every` mensajes, actualiza
+    su resumen en un hilo de fondo (una actualización a la vez por conversación).
+    """
+
+    def __init__(self, every=SUMMARY_EVERY_MESSAGES, tail=SUMMARY_TAIL_MESSAGES,
+                 max_batch=SUMMARY_MAX_BATCH, summarize=None):
+        """
+        Args:
+            every: Mensajes nuevos entre revisiones del resumen (0 = desactivado)
+            tail: Mensajes recientes que no se resumen (el agente ya los recibe)
+            max_batch: Máximo de mensajes incorporados por actualización
+            summarize: Función (resumen_anterior, mensajes) -> resumen; por defecto usa el LLM
+        """
+        self.every = every
+        self.tail = tail
+        self.max_batch = max(max_batch, every)
+        self._summarize = summarize or self._summarize_with_llm
+        self._model = None
+        # Mensajes pendientes por conversación (las inactivas se olvidan tras un día)
+        self._counters = TTLCache(maxsize=10000, ttl=86400)
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+        self._stats = {"checks": 0, "updates": 0, "messages_summarized": 0, "errors": 0}
+
+    def record_messages(self, conversation: Optional[Dict], count: int):
+        """
+        Registra mensajes nuevos de una conversación y programa la actualización del
+        resumen cuando se acumulan `every` mensajes. No bloquea.
+
+        Args:
+            conversation: Fila de la conversación ({id, summary, summary_until})
+            count: Número de mensajes nuevos (entrantes y respuesta del asistente)
+        """
+        if self.every <= 0 or not conversation or not conversation.get("id"):
+            return
+        conversation_id = conversation["id"]
+        with self._lock:
+            pending = self._counters.get(conversation_id, 0) + count
+            if pending < self.every or conversation_id in self._inflight:
+                self._counters.set(conversation_id, pending)
+                return
+            self._counters.delete(conversation_id)
+            self._inflight.add(conversation_id)
+        self._executor.submit(
+            self._update,
+            conversation_id,
+            conversation.get("summary"),
+            conversation.get("summary_until")
+        )
+
+    def _update(self, conversation_id, summary, summary_until):
+        """Incorpora al resumen los mensajes que ya salieron del historial reciente"""
+        try:
+            with self._lock:
+                self._stats["checks"] += 1
+            messages = get_messages_since(conversation_id, summary_until, limit=self.tail + self.max_batch)
+            folded = messages[:-self.tail] if self.tail else messages
+            if len(folded) < self.every:
+                return
+
+            new_summary = (self._summarize(summary, folded) or "").strip()[:SUMMARY_MAX_CHARS]
+            if not new_summary:
+                return
+            update_conversation_summary(conversation_id, new_summary, folded[-1]["created_at"])
+            with self._lock:
+                self._stats["updates"] += 1
+                self._stats["messages_summarized"] += len(folded)
+            logger.debug("Resumen de la conversación %s actualizado con %d mensajes", conversation_id, len(folded))
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.warning(f"No se pudo actualizar el resumen de la conversación {conversation_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._inflight.discard(conversation_id)
+
+    def _summarize_with_llm(self, summary: Optional[str], messages: List[Dict]) -> str:
+        """Genera el nuevo resumen a partir del anterior y los mensajes nuevos"""
+        if self._model is None:
+            from langchain_openai import ChatOpenAI
+            self._model = ChatOpenAI(
+                model=SUMMARY_MODEL,
+                temperature=0,
+                request_timeout=SUMMARY_REQUEST_TIMEOUT,
+                max_retries=2
+            )
+        speakers = {"user": "Cliente", "assistant": "Asistente"}
+        transcript = "\n".join(
+            f"{speakers.get(message['role'], message['role'])}: {message['content']}"
+            for message in messages
+        )
+        response = self._model.invoke([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Resumen anterior:\n{summary or '(sin resumen)'}\n\nMensajes nuevos:\n{transcript}"}
+        ])
+        return response.content
+
+    def get_stats(self):
+        """
+        Retorna revisiones, actualizaciones, mensajes resumidos, errores y
+        conversaciones con mensajes pendientes de revisar.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked_conversations"] = len(self._counters)
+            stats["inflight"] = len(self._inflight)
+        stats["enabled"] = self.every > 0
+        return stats
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_conversation_summarizer() -> ConversationSummarizer:
+    """Retorna el actualizador de resúmenes compartido por el proceso"""
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            _summarizer = ConversationSummarizer()
+        return _summarizer
@@ -0,0 +1,1487 @@
+"""
+Operaciones de base de datos para interactuar con Supabase.
+Este archivo proporciona funciones para realizar operaciones CRUD en la base de datos.
+
+Cada operación se escribe como un generador de consultas (ver queries.py) que aquí
+se ejecuta con el cliente síncrono y en db_operations.aio con el asíncrono.
+"""
+
+from supabase_client import get_supabase_client, is_remote_backend
+from typing import Dict, List, Optional, Any, Union
+import os
+import uuid
+import base64
+import inspect
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from db_operations.queries import Background, Parallel, Query, Rpc, operation, resume
+from utils.phone_utils import normalize_phone_number, find_duplicate_phone_formats
+from utils.context_cache import ConversationContextCache
+from cache_invalidation import is_cache_invalidation_configured
+from utils import metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Obtener cliente de Supabase
+supabase = get_supabase_client()
+
+# Caché de usuario, conversación activa y calificación de lead por teléfono (TTL 0 = desactivada).
+# Con el bus de invalidación entre procesos (cache_invalidation.py) las entradas pueden vivir más.
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", 3600 if is_cache_invalidation_configured() else 300))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", 10000))
+context_cache = ConversationContextCache(maxsize=CONTEXT_CACHE_MAX_ENTRIES, ttl=CONTEXT_CACHE_TTL)
+
+# Escrituras oportunistas que no deben bloquear el turno (p. ej. normalizar teléfonos)
+_background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-background")
+
+# Consultas independientes de una operación que se lanzan a la vez (pasos Parallel).
+# Solo con Supabase: con un backend del proceso no hay red que esperar y el salto de
+# hilo cuesta más que la consulta.
+_parallel_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DB_PARALLEL_WORKERS", 8)), thread_name_prefix="db-parallel"
+)
+_parallel_queries = is_remote_backend()
+
+# Código de Postgres para violaciones de restricciones UNIQUE
+UNIQUE_VIOLATION_CODE = "23505"
+
+# Código de PostgREST cuando la función RPC no existe en la base de datos
+MISSING_FUNCTION_CODE = "PGRST202"
+
+# Mensajes con los que se inicia una conversación nueva
+SYSTEM_MESSAGE = "Iniciando conversación con un potencial cliente."
+WELCOME_MESSAGE = "¡Hola! Soy el asistente virtual de nuestra empresa de desarrollo de software. ¿En qué puedo ayudarte hoy?"
+
+# Se desactiva si la función ingest_inbound_message no está desplegada
+_ingest_rpc_available = True
+
+# Mensajes no-sistema del historial reciente que recibe el agente en cada turno
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", 10))
+
+# Tamaño de página por defecto de las consultas paginadas por cursor
+DB_PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", 100))
+DB_MAX_PAGE_SIZE = int(os.getenv("DB_MAX_PAGE_SIZE", 1000))
+
+class DuplicateMessageError(Exception):
+    """Se lanza cuando ya existe un mensaje con el mismo ID externo (entrega repetida)"""
+    pass
+
+def _is_unique_violation(error: Exception) -> bool:
+    """Indica si una excepción de PostgREST corresponde a una violación de UNIQUE"""
+    return getattr(error, "code", None) == UNIQUE_VIOLATION_CODE or UNIQUE_VIOLATION_CODE in str(error)
+
+def _first(response) -> Optional[Dict]:
+    """Retorna la primera fila de una respuesta o None"""
+    return response.data[0] if response.data else None
+
+# ----- EJECUCIÓN CON EL CLIENTE SÍNCRONO -----
+
+def _run(steps):
+    """Ejecuta una operación con el cliente síncrono y retorna su resultado"""
+    done, value = resume(steps)
+    while not done:
+        try:
+            result, error = _execute(value), None
+        except Exception as e:
+            result, error = None, e
+        done, value = resume(steps, result, error)
+    return value
+
+def _execute(step):
+    """Ejecuta un paso de una operación (ver queries.py)"""
+    if isinstance(step, Parallel):
+        return _execute_parallel(step.steps)
+    if isinstance(step, Background):
+        _background_executor.submit(_run, step.steps)
+        return None
+    if inspect.isgenerator(step):
+        return _run(step)
+    query = step.build(supabase)
+    return query.execute() if query is not None else None
+
+def _execute_parallel(steps) -> List:
+    """
+    Ejecuta pasos independientes: con Supabase, el primero en el hilo actual y el resto
+    en _parallel_executor; con un backend local o dentro de ese pool, en orden.
+    """
+    if not _parallel_queries or len(steps) < 2 or threading.current_thread().name.startswith("db-parallel"):
+        return [_execute(step) for step in steps]
+    # Cada paso con una copia del contexto para conservar el turno de la instrumentación
+    futures = [
+        _parallel_executor.submit(contextvars.copy_context().run, _execute, step)
+        for step in steps[1:]
+    ]
+    results = [_execute(steps[0])]
+    results.extend(future.result() for future in futures)
+    return results
+
+_operation = operation(_run)
+
+# ----- PAGINACIÓN POR CURSOR -----
+
+def encode_cursor(row: Dict) -> str:
+    """
+    Genera el cursor opaco que apunta a una fila, a partir de su (created_at, id).
+    
+    Args:
+        row: Fila con created_at e id
+        
+    Returns:
+        Cursor para pedir la página siguiente a esa fila
+    """
+    raw = f"{row['created_at']}|{row['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Obtiene el par (created_at, id) de un cursor generado por encode_cursor.
+    
+    Args:
+        cursor: Cursor opaco
+        
+    Returns:
+        Tupla (created_at, id)
+        
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    except Exception:
+        raise ValueError(f"Cursor inválido: {cursor!r}")
+    if not created_at or not row_id:
+        raise ValueError(f"Cursor inválido: {cursor!r}")
+    return created_at, row_id
+
+def _page_size(limit: Optional[int]) -> int:
+    """Acota el tamaño de página pedido entre 1 y DB_MAX_PAGE_SIZE"""
+    return max(1, min(limit or DB_PAGE_SIZE, DB_MAX_PAGE_SIZE))
+
+def _keyset_query(query, cursor: Optional[str], limit: int):
+    """
+    Aplica a una consulta el orden (created_at, id), la condición de la página
+    siguiente al cursor y el límite (una fila extra para saber si hay más).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # (created_at, id) > (cursor): comparación de tuplas expresada con or/and de PostgREST
+        query = query.or_(
+            f'created_at.gt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.gt."{row_id}")'
+        )
+    return query.order("created_at").order("id").limit(limit + 1)
+
+def _keyset_page(rows: Optional[List[Dict]], limit: int) -> Dict:
+    """
+    Construye la página a partir de las filas de _keyset_query.
+    
+    Returns:
+        Diccionario con items (como mucho `limit` filas) y next_cursor (None en la última página)
+    """
+    rows = rows or []
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def iterate_pages(fetch_page, *args, page_size: Optional[int] = None, **kwargs):
+    """
+    Recorre todas las filas de una consulta paginada pidiendo las páginas a medida
+    que se consumen, sin cargar el resultado completo en memoria.
+    
+    Args:
+        fetch_page: Función de página (p. ej. get_conversation_messages_page)
+        *args: Argumentos de la función de página
+        page_size: Filas por página
+        **kwargs: Argumentos con nombre de la función de página
+        
+    Returns:
+        Generador de filas en orden (created_at, id)
+    """
+    cursor = None
+    while True:
+        page = fetch_page(*args, cursor=cursor, limit=page_size, **kwargs)
+        yield from page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+# ----- OPERACIONES DE USUARIOS -----
+
+def _phone_candidates(phone: str, normalized_phone: Optional[str]) -> List[str]:
+    """
+    Retorna los formatos con los que puede estar guardado un teléfono, en orden de
+    preferencia: normalizado, original y formatos alternativos.
+    """
+    candidates = []
+    alternative_formats = find_duplicate_phone_formats(normalized_phone) if normalized_phone else []
+    for candidate in [normalized_phone, phone] + alternative_formats:
+        if candidate and candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+@_operation
+def _rewrite_user_phone(user_id: str, old_phone: str, normalized_phone: str):
+    """Actualiza el teléfono de un usuario al formato normalizado (en segundo plano)"""
+    try:
+        yield from update_user.steps(user_id, {"phone": normalized_phone})
+        logger.info(f"Teléfono del usuario {user_id} actualizado: {old_phone} -> {normalized_phone}")
+    except Exception as e:
+        # Puede existir otro usuario con el número normalizado (duplicado pendiente de fusionar)
+        logger.warning(f"No se pudo normalizar el teléfono del usuario {user_id}: {str(e)}")
+
+@_operation
+def get_user_by_phone(phone: str) -> Optional[Dict]:
+    """
+    Obtiene un usuario por su número de teléfono.
+    Busca el formato normalizado, el original y los formatos alternativos en una
+    sola consulta y elige la coincidencia en ese orden de preferencia.
+    
+    Args:
+        phone: Número de teléfono del usuario
+        
+    Returns:
+        Datos del usuario o None si no existe
+    """
+    # Normalizar el número de teléfono
+    normalized_phone = normalize_phone_number(phone)
+    cache_key = normalized_phone or phone
+    
+    # Consultar primero la caché de contexto
+    cached_user = context_cache.get(cache_key, "user")
+    if cached_user:
+        logger.debug("get_user_by_phone(%s): 0 consultas (caché)", cache_key)
+        return cached_user
+    
+    candidates = _phone_candidates(phone, normalized_phone)
+    response = yield Query("users").select("*").in_("phone", candidates)
+    metrics.increment("db.get_user_by_phone.queries")
+    logger.debug("get_user_by_phone(%s): 1 consulta sobre %d formatos", cache_key, len(candidates))
+    
+    users_by_phone = {}
+    for row in response.data or []:
+        users_by_phone.setdefault(row.get("phone"), row)
+    user = next((users_by_phone[candidate] for candidate in candidates if candidate in users_by_phone), None)
+    if not user:
+        return None
+    
+    if normalized_phone and user.get("phone") not in (normalized_phone, phone):
+        # Encontramos un usuario con un formato alternativo: normalizarlo sin bloquear el turno
+        logger.info(f"Usuario encontrado con formato alternativo: {user.get('phone')} -> {normalized_phone}")
+        yield Background(_rewrite_user_phone.steps(user["id"], user.get("phone"), normalized_phone))
+    
+    context_cache.set(cache_key, "user", user)
+    return user
+
+@_operation
+def get_user_by_email(email: str) -> Optional[Dict]:
+    """
+    Obtiene un usuario por su correo electrónico.
+    
+    Args:
+        email: Correo electrónico del usuario
+        
+    Returns:
+        Datos del usuario o None si no existe
+    """
+    response = yield Query("users").select("*").eq("email", email)
+    return _first(response)
+
+@_operation
+def get_user_by_id(user_id: str) -> Optional[Dict]:
+    """
+    Obtiene un usuario por su ID.
+    
+    Args:
+        user_id: ID del usuario
+        
+    Returns:
+        Datos del usuario o None si no existe
+    """
+    cached_user = context_cache.get_by_id("user", user_id)
+    if cached_user:
+        return cached_user
+    
+    response = yield Query("users").select("*").eq("id", user_id)
+    return _first(response)
+
+@_operation
+def create_user(user_data: Dict) -> Dict:
+    """
+    Crea un nuevo usuario.
+    
+    Args:
+        user_data: Datos del usuario (full_name, email, phone, company)
+        
+    Returns:
+        Datos del usuario creado
+    """
+    response = yield Query("users").insert(user_data)
+    user = _first(response) or {}
+    if user.get("phone"):
+        context_cache.set(normalize_phone_number(user["phone"]) or user["phone"], "user", user)
+    return user
+
+@_operation
+def update_user(user_id: str, user_data: Dict) -> Dict:
+    """
+    Actualiza los datos de un usuario.
+    
+    Args:
+        user_id: ID del usuario
+        user_data: Datos a actualizar
+        
+    Returns:
+        Datos del usuario actualizado
+    """
+    # Asegurar que updated_at se actualice
+    if "updated_at" not in user_data:
+        user_data["updated_at"] = "now()"
+        
+    response = yield Query("users").update(user_data).eq("id", user_id)
+    user = _first(response) or {}
+    
+    # Mantener la caché de contexto al día (si cambió el teléfono, cambia la clave)
+    if "phone" in user_data or not user:
+        context_cache.discard("user", user_id)
+        if user.get("phone"):
+            context_cache.set(normalize_phone_number(user["phone"]) or user["phone"], "user", user)
+    else:
+        context_cache.replace("user", user)
+    return user
+
+@_operation
+def get_or_create_user(phone: str, email: Optional[str] = None, full_name: Optional[str] = None, company: Optional[str] = None) -> Dict:
+    """
+    Obtiene un usuario existente o crea uno nuevo si no existe.
+    Normaliza el número de teléfono antes de buscar o crear.
+    
+    Args:
+        phone: Número de teléfono del usuario
+        email: Correo electrónico (opcional)
+        full_name: Nombre completo (opcional)
+        company: Empresa (opcional)
+        
+    Returns:
+        Datos del usuario
+    """
+    # Normalizar el número de teléfono
+    normalized_phone = normalize_phone_number(phone)
+    
+    # Usar el número normalizado si está disponible, de lo contrario usar el original
+    search_phone = normalized_phone if normalized_phone else phone
+    
+    # Buscar por teléfono (la función get_user_by_phone ya busca en diferentes formatos)
+    user = yield from get_user_by_phone.steps(search_phone)
+    
+    # Si no existe y tenemos email, buscar por email
+    if not user and email:
+        user = yield from get_user_by_email.steps(email)
+    
+    # Si no existe, crear nuevo usuario con el número normalizado. El upsert ignora el
+    # conflicto con UNIQUE(phone) si otro proceso lo creó en paralelo; en ese caso se relee.
+    if not user:
+        user_data = {
+            "phone": search_phone,
+            "email": email,
+            "full_name": full_name or f"Usuario {search_phone}",
+            "company": company
+        }
+        response = yield Query("users") \
+            .upsert(user_data, on_conflict="phone", ignore_duplicates=True)
+        if response.data:
+            user = response.data[0]
+            logger.info(f"Usuario creado con número normalizado: {search_phone}")
+        else:
+            response = yield Query("users").select("*").eq("phone", search_phone)
+            user = _first(response) or {}
+        if user:
+            context_cache.set(normalize_phone_number(search_phone) or search_phone, "user", user)
+    
+    return user
+
+@_operation
+def get_users_page(cursor: Optional[str] = None, limit: Optional[int] = None) -> Dict:
+    """
+    Obtiene una página de todos los usuarios, en orden (created_at, id).
+    
+    Args:
+        cursor: Cursor de la página anterior (None para la primera página)
+        limit: Usuarios por página (por defecto DB_PAGE_SIZE)
+        
+    Returns:
+        Diccionario con items y next_cursor
+    """
+    limit = _page_size(limit)
+    query = Query("users").select("*")
+    response = yield _keyset_query(query, cursor, limit)
+    return _keyset_page(response.data, limit)
+
+# ----- OPERACIONES DE CONVERSACIONES -----
+
+@_operation
+def get_active_conversation(external_id: str, platform: str = "whatsapp") -> Optional[Dict]:
+    """
+    Obtiene una conversación activa por su ID externo y plataforma.
+    
+    Args:
+        external_id: ID externo (número de teléfono para WhatsApp)
+        platform: Plataforma (whatsapp, web, etc.)
+        
+    Returns:
+        Datos de la conversación o None si no existe
+    """
+    cache_key = normalize_phone_number(external_id) or external_id
+    cached_conversation = context_cache.get(cache_key, "conversation")
+    if cached_conversation and cached_conversation.get("platform") == platform and cached_conversation.get("status") == "active":
+        return cached_conversation
+    
+    response = yield Query("conversations") \
+        .select("*") \
+        .eq("external_id", external_id) \
+        .eq("platform", platform) \
+        .eq("status", "active")
+    
+    conversation = _first(response)
+    context_cache.set(cache_key, "conversation", conversation)
+    return conversation
+
+@_operation
+def create_conversation(user_id: str, external_id: str, platform: str = "whatsapp") -> Dict:
+    """
+    Crea una nueva conversación.
+    
+    Args:
+        user_id: ID del usuario
+        external_id: ID externo (número de teléfono para WhatsApp)
+        platform: Plataforma (whatsapp, web, etc.)
+        
+    Returns:
+        Datos de la conversación creada
+    """
+    conversation_data = {
+        "user_id": user_id,
+        "external_id": external_id,
+        "platform": platform,
+        "status": "active"
+    }
+    
+    response = yield Query("conversations").insert(conversation_data)
+    conversation = _first(response) or {}
+    context_cache.set(normalize_phone_number(external_id) or external_id, "conversation", conversation)
+    return conversation
+
+@_operation
+def close_conversation(conversation_id: str) -> Dict:
+    """
+    Cierra una conversación.
+    
+    Args:
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Datos de la conversación actualizada
+    """
+    update_data = {
+        "status": "closed",
+        "updated_at": "now()"
+    }
+    
+    response = yield Query("conversations").update(update_data).eq("id", conversation_id)
+    context_cache.discard("conversation", conversation_id)
+    return _first(response) or {}
+
+@_operation
+def get_or_create_conversation(user_id: str, external_id: str, platform: str = "whatsapp") -> Dict:
+    """
+    Obtiene una conversación activa o crea una nueva si no existe.
+    
+    Args:
+        user_id: ID del usuario
+        external_id: ID externo (número de teléfono para WhatsApp)
+        platform: Plataforma (whatsapp, web, etc.)
+        
+    Returns:
+        Datos de la conversación
+    """
+    cache_key = normalize_phone_number(external_id) or external_id
+    cached_conversation = context_cache.get(cache_key, "conversation")
+    if cached_conversation and cached_conversation.get("platform") == platform and cached_conversation.get("status") == "active":
+        return cached_conversation
+    
+    # UNIQUE(platform, external_id): hay como mucho una fila por teléfono, activa o cerrada
+    response = yield Query("conversations") \
+        .select("*") \
+        .eq("external_id", external_id) \
+        .eq("platform", platform)
+    conversation = _first(response)
+    
+    if not conversation:
+        # El upsert ignora el conflicto si otro webhook la creó en paralelo; en ese caso se relee
+        conversation_data = {
+            "user_id": user_id,
+            "external_id": external_id,
+            "platform": platform,
+            "status": "active"
+        }
+        response = yield Query("conversations") \
+            .upsert(conversation_data, on_conflict="platform,external_id", ignore_duplicates=True)
+        if not response.data:
+            response = yield Query("conversations") \
+                .select("*") \
+                .eq("external_id", external_id) \
+                .eq("platform", platform)
+        conversation = _first(response) or {}
+    
+    # Solo se escribe (y se notifica a las cachés) al reactivar una conversación cerrada
+    if conversation and conversation.get("status") != "active":
+        update_data = {
+            "status": "active",
+            "updated_at": "now()"
+        }
+        response = yield Query("conversations").update(update_data).eq("id", conversation["id"])
+        conversation = _first(response) or {}
+    
+    context_cache.set(cache_key, "conversation", conversation)
+    return conversation
+
+@_operation
+def update_conversation_summary(conversation_id: str, summary: str, summary_until: str) -> Dict:
+    """
+    Guarda el resumen acumulado de una conversación.
+    
+    Args:
+        conversation_id: ID de la conversación
+        summary: Resumen de los mensajes anteriores al historial reciente
+        summary_until: Fecha (created_at) del último mensaje incluido en el resumen
+        
+    Returns:
+        Datos de la conversación actualizada
+    """
+    update_data = {
+        "summary": summary,
+        "summary_until": summary_until
+    }
+    
+    response = yield Query("conversations").update(update_data).eq("id", conversation_id)
+    conversation = _first(response) or {}
+    context_cache.replace("conversation", conversation)
+    return conversation
+
+# ----- OPERACIONES DE MENSAJES -----
+
+@_operation
+def get_conversation_messages(conversation_id: str) -> List[Dict]:
+    """
+    Obtiene todos los mensajes de una conversación.
+    
+    Args:
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Lista de mensajes
+    """
+    response = yield Query("messages") \
+        .select("*") \
+        .eq("conversation_id", conversation_id) \
+        .order("created_at")
+    
+    return response.data
+
+@_operation
+def get_conversation_messages_page(conversation_id: str, cursor: Optional[str] = None,
+                                   limit: Optional[int] = None) -> Dict:
+    """
+    Obtiene una página de los mensajes de una conversación, en orden (created_at, id).
+    
+    Args:
+        conversation_id: ID de la conversación
+        cursor: Cursor de la página anterior (None para la primera página)
+        limit: Mensajes por página (por defecto DB_PAGE_SIZE)
+        
+    Returns:
+        Diccionario con items y next_cursor
+    """
+    limit = _page_size(limit)
+    query = Query("messages") \
+        .select("*") \
+        .eq("conversation_id", conversation_id)
+    response = yield _keyset_query(query, cursor, limit)
+    return _keyset_page(response.data, limit)
+
+@_operation
+def add_message(conversation_id: str, role: str, content: str, message_type: str = "text", 
+                media_url: Optional[str] = None, external_id: Optional[str] = None,
+                delivery_status: Optional[str] = None) -> Dict:
+    """
+    Añade un mensaje a una conversación.
+    
+    Args:
+        conversation_id: ID de la conversación
+        role: Rol del mensaje (user, assistant, system)
+        content: Contenido del mensaje
+        message_type: Tipo de mensaje (text, image, audio, video)
+        media_url: URL del archivo multimedia (opcional)
+        external_id: ID externo del mensaje (opcional)
+        delivery_status: Estado de entrega para mensajes salientes (queued, sent, failed)
+        
+    Returns:
+        Datos del mensaje creado
+        
+    Raises:
+        DuplicateMessageError: Si ya existe un mensaje con el mismo external_id
+    """
+    message_data = {
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "message_type": message_type,
+        "media_url": media_url,
+        "external_id": external_id
+    }
+    if delivery_status:
+        message_data["delivery_status"] = delivery_status
+    
+    try:
+        response = yield Query("messages").insert(message_data)
+    except Exception as e:
+        # messages.external_id es UNIQUE: una entrega repetida de WhatsApp no se vuelve a guardar
+        if external_id and _is_unique_violation(e):
+            raise DuplicateMessageError(f"Mensaje duplicado: {external_id}") from e
+        raise
+    return _first(response) or {}
+
+@_operation
+def update_message_delivery(message_id: str, status: str, external_id: Optional[str] = None,
+                            error: Optional[str] = None) -> Dict:
+    """
+    Registra el resultado de la entrega de un mensaje saliente.
+    
+    Args:
+        message_id: ID del mensaje en la base de datos
+        status: Estado de entrega (queued, sent, failed)
+        external_id: ID asignado por WhatsApp al mensaje enviado (opcional)
+        error: Descripción del error si la entrega falló (opcional)
+        
+    Returns:
+        Datos del mensaje actualizado
+    """
+    update_data = {
+        "delivery_status": status,
+        "delivery_error": error
+    }
+    if external_id:
+        update_data["external_id"] = external_id
+    
+    response = yield Query("messages").update(update_data).eq("id", message_id)
+    return _first(response) or {}
+
+@_operation
+def get_system_messages(conversation_id: str) -> List[Dict]:
+    """
+    Obtiene los mensajes de sistema de una conversación (solo rol y contenido).
+    
+    Args:
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Lista de mensajes {role, content} en orden cronológico
+    """
+    response = yield Query("messages") \
+        .select("role, content") \
+        .eq("conversation_id", conversation_id) \
+        .eq("role", "system") \
+        .order("created_at")
+    
+    return response.data or []
+
+@_operation
+def get_recent_messages(conversation_id: str, limit: int = 10, since: Optional[str] = None) -> List[Dict]:
+    """
+    Obtiene los últimos mensajes no-sistema de una conversación (solo rol y contenido).
+    
+    Usa orden descendente con límite sobre el índice (conversation_id, created_at),
+    así el costo no depende del tamaño de la conversación.
+    
+    Args:
+        conversation_id: ID de la conversación
+        limit: Número máximo de mensajes
+        since: Fecha (created_at) a partir de la cual buscar, sin incluirla (opcional)
+        
+    Returns:
+        Lista de mensajes {role, content} en orden cronológico
+    """
+    if limit <= 0:
+        return []
+    
+    query = Query("messages") \
+        .select("role, content") \
+        .eq("conversation_id", conversation_id) \
+        .neq("role", "system")
+    if since:
+        query = query.gt("created_at", since)
+    response = yield query.order("created_at", desc=True).limit(limit)
+    
+    return list(reversed(response.data or []))
+
+@_operation
+def get_messages_since(conversation_id: str, since: Optional[str] = None, limit: int = 50) -> List[Dict]:
+    """
+    Obtiene los mensajes no-sistema de una conversación posteriores a una fecha.
+    
+    Args:
+        conversation_id: ID de la conversación
+        since: Fecha (created_at) a partir de la cual buscar; None = desde el inicio
+        limit: Número máximo de mensajes
+        
+    Returns:
+        Lista de mensajes {role, content, created_at} en orden cronológico
+    """
+    query = Query("messages") \
+        .select("role, content, created_at") \
+        .eq("conversation_id", conversation_id) \
+        .neq("role", "system")
+    if since:
+        query = query.gt("created_at", since)
+    response = yield query.order("created_at").limit(limit)
+    
+    return response.data or []
+
+@_operation
+def get_conversation_history(conversation_id: str, max_messages: int = HISTORY_MAX_MESSAGES) -> List[Dict]:
+    """
+    Obtiene el historial de mensajes de una conversación en formato para el agente,
+    limitando la cantidad de mensajes para reducir el consumo de tokens.
+    
+    Args:
+        conversation_id: ID de la conversación
+        max_messages: Número máximo de mensajes a recuperar (por defecto HISTORY_MAX_MESSAGES)
+        
+    Returns:
+        Lista de mensajes en formato {role, content}
+    """
+    # Consultar solo los mensajes de sistema y los últimos `max_messages` mensajes:
+    # el costo no crece con la longitud de la conversación
+    system_messages, recent_messages = yield Parallel(
+        get_system_messages.steps(conversation_id),
+        get_recent_messages.steps(conversation_id, max_messages)
+    )
+    
+    # Combinar mensajes de sistema con los mensajes recientes
+    messages = system_messages + recent_messages
+    
+    # Convertir al formato que espera el agente
+    history = []
+    
+    # Asegurar que siempre haya un mensaje de sistema al inicio
+    system_message_exists = False
+    
+    for msg in messages:
+        # Verificar si ya existe un mensaje de sistema
+        if msg["role"] == "system":
+            system_message_exists = True
+        
+        # Añadir el mensaje al historial
+        history.append({
+            "role": msg["role"],
+            "content": msg["content"]
+        })
+    
+    # Si no hay mensaje de sistema, añadir uno al inicio
+    if not system_message_exists and history:
+        history.insert(0, {
+            "role": "system",
+            "content": SYSTEM_MESSAGE
+        })
+    
+    # Imprimir el historial para depuración (solo en DEBUG: recorrerlo tiene costo en cada turno)
+    logger.debug("Historial de conversación recuperado: %d mensajes (limitado a %d mensajes no-sistema)", len(history), max_messages)
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, msg in enumerate(history):
+            logger.debug("Mensaje %d: %s - %s...", i + 1, msg['role'], msg['content'][:50])
+    
+    return history
+
+def merge_consecutive_user_messages(history: List[Dict]) -> List[Dict]:
+    """
+    Combina los mensajes consecutivos del usuario en un solo mensaje.
+    
+    Args:
+        history: Historial en formato {role, content}
+        
+    Returns:
+        Historial con las ráfagas del usuario combinadas en un solo turno
+    """
+    merged = []
+    for msg in history:
+        if merged and msg["role"] == "user" and merged[-1]["role"] == "user":
+            merged[-1] = {
+                "role": "user",
+                "content": f"{merged[-1]['content']}\n{msg['content']}"
+            }
+        else:
+            merged.append(msg)
+    return merged
+
+@_operation
+def ingest_inbound_message(phone: str, messages: List[Dict], platform: str = "whatsapp",
+                           max_messages: int = HISTORY_MAX_MESSAGES) -> Dict:
+    """
+    Registra mensajes entrantes en un solo viaje a la base de datos.
+    
+    Llama a la función `ingest_inbound_message` de Postgres, que en una transacción
+    resuelve el usuario y la conversación activa, siembra los mensajes de sistema y
+    bienvenida si la conversación es nueva, guarda los mensajes y retorna el historial.
+    Si la función no está disponible (cliente mock o esquema sin desplegar) se usa
+    el camino equivalente con varias consultas.
+    
+    Args:
+        phone: Número de teléfono del remitente
+        messages: Lista de mensajes {content, message_type, external_id}
+        platform: Plataforma (whatsapp, web, etc.)
+        max_messages: Número máximo de mensajes no-sistema en el historial
+        
+    Returns:
+        Diccionario {user, conversation, is_new_conversation, stored, duplicates, history};
+        `stored` lista los mensajes guardados {id, external_id}, `duplicates` los
+        external_id descartados y `history` está vacío si no se guardó ningún mensaje
+    """
+    global _ingest_rpc_available
+    normalized_phone = normalize_phone_number(phone) or phone
+    
+    if _ingest_rpc_available:
+        # Candidatos en orden de preferencia: normalizado, original y formatos alternativos
+        candidates = _phone_candidates(phone, normalized_phone)
+        try:
+            # None si el cliente no admite RPC (backends locales)
+            response = yield Rpc("ingest_inbound_message", {
+                "p_phone": normalized_phone,
+                "p_phone_candidates": candidates,
+                "p_messages": messages,
+                "p_platform": platform,
+                "p_max_messages": max_messages,
+                "p_system_message": SYSTEM_MESSAGE,
+                "p_welcome_message": WELCOME_MESSAGE
+            })
+            if response is not None:
+                result = response.data
+                context_cache.set(normalized_phone, "user", result.get("user"))
+                context_cache.set(normalized_phone, "conversation", result.get("conversation"))
+                return result
+        except Exception as e:
+            if getattr(e, "code", None) != MISSING_FUNCTION_CODE and MISSING_FUNCTION_CODE not in str(e):
+                raise
+            logger.warning("La función ingest_inbound_message no existe en la base de datos; usando consultas individuales")
+            _ingest_rpc_available = False
+    
+    return (yield from _ingest_inbound_message_fallback.steps(normalized_phone, messages, platform, max_messages))
+
+@_operation
+def _ingest_inbound_message_fallback(phone: str, messages: List[Dict], platform: str, max_messages: int) -> Dict:
+    """Versión de ingest_inbound_message con consultas individuales"""
+    user, conversation = yield Parallel(
+        get_or_create_user.steps(phone=phone),
+        get_active_conversation.steps(phone, platform)
+    )
+    if not conversation:
+        # UNIQUE(platform, external_id): una conversación cerrada se reactiva, como en la RPC
+        conversation = yield from get_or_create_conversation.steps(user["id"], phone, platform)
+    
+    # Nueva mientras no tenga mensajes (incluida una creada en un intento que falló a medias)
+    response = yield Query("messages").select("id").eq("conversation_id", conversation["id"]).limit(1)
+    is_new_conversation = not response.data
+    if is_new_conversation:
+        yield from add_message.steps(conversation_id=conversation["id"], role="system", content=SYSTEM_MESSAGE)
+        yield from add_message.steps(conversation_id=conversation["id"], role="assistant", content=WELCOME_MESSAGE)
+    
+    stored = []
+    duplicates = []
+    for message in messages:
+        try:
+            row = yield from add_message.steps(
+                conversation_id=conversation["id"],
+                role="user",
+                content=message.get("content"),
+                message_type=message.get("message_type") or "text",
+                external_id=message.get("external_id")
+            )
+            stored.append({"id": row.get("id"), "external_id": message.get("external_id")})
+        except DuplicateMessageError:
+            duplicates.append(message.get("external_id"))
+    
+    history = (yield from get_conversation_history.steps(conversation["id"], max_messages)) if stored else []
+    
+    return {
+        "user": user,
+        "conversation": conversation,
+        "is_new_conversation": is_new_conversation,
+        "stored": stored,
+        "duplicates": duplicates,
+        "history": history
+    }
+
+# ----- OPERACIONES DE CALIFICACIÓN DE LEADS -----
+
+@_operation
+def get_lead_qualification(user_id: str, conversation_id: str) -> Optional[Dict]:
+    """
+    Obtiene la calificación de lead para un usuario y conversación.
+    
+    Args:
+        user_id: ID del usuario
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Datos de la calificación o None si no existe
+    """
+    # La calificación se guarda en el contexto del teléfono dueño de la conversación
+    cache_key = context_cache.key_for("conversation", conversation_id)
+    cached_qualification = context_cache.get(cache_key, "lead_qualification")
+    if (cached_qualification and cached_qualification.get("user_id") == user_id
+            and cached_qualification.get("conversation_id") == conversation_id):
+        return cached_qualification
+    
+    response = yield Query("lead_qualification") \
+        .select("*") \
+        .eq("user_id", user_id) \
+        .eq("conversation_id", conversation_id)
+    
+    qualification = _first(response)
+    context_cache.set(cache_key, "lead_qualification", qualification)
+    return qualification
+
+@_operation
+def create_lead_qualification(user_id: str, conversation_id: str) -> Dict:
+    """
+    Crea una nueva calificación de lead.
+    
+    Args:
+        user_id: ID del usuario
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Datos de la calificación creada
+    """
+    qualification_data = {
+        "user_id": user_id,
+        "conversation_id": conversation_id,
+        "consent": False,
+        "current_step": "start"
+    }
+    
+    response = yield Query("lead_qualification").insert(qualification_data)
+    qualification = _first(response) or {}
+    context_cache.set(context_cache.key_for("conversation", conversation_id), "lead_qualification", qualification)
+    return qualification
+
+@_operation
+def update_lead_qualification(qualification_id: str, data: Dict) -> Dict:
+    """
+    Actualiza los datos de una calificación de lead.
+    
+    Args:
+        qualification_id: ID de la calificación
+        data: Datos a actualizar
+        
+    Returns:
+        Datos de la calificación actualizada
+    """
+    # Asegurar que updated_at se actualice
+    if "updated_at" not in data:
+        data["updated_at"] = "now()"
+        
+    response = yield Query("lead_qualification").update(data).eq("id", qualification_id)
+    qualification = _first(response) or {}
+    if qualification:
+        context_cache.replace("lead_qualification", qualification)
+    else:
+        context_cache.discard("lead_qualification", qualification_id)
+    return qualification
+
+@_operation
+def get_or_create_lead_qualification(user_id: str, conversation_id: str) -> Dict:
+    """
+    Obtiene una calificación de lead existente o crea una nueva si no existe.
+    
+    Args:
+        user_id: ID del usuario
+        conversation_id: ID de la conversación
+        
+    Returns:
+        Datos de la calificación
+    """
+    cache_key = context_cache.key_for("conversation", conversation_id)
+    cached_qualification = context_cache.get(cache_key, "lead_qualification")
+    if (cached_qualification and cached_qualification.get("user_id") == user_id
+            and cached_qualification.get("conversation_id") == conversation_id):
+        return cached_qualification
+    
+    # UNIQUE(user_id, conversation_id): solo se envían las columnas de la clave, así que
+    # el upsert retorna la fila existente sin modificarla o crea una con los valores por defecto
+    response = yield Query("lead_qualification") \
+        .upsert({"user_id": user_id, "conversation_id": conversation_id}, on_conflict="user_id,conversation_id")
+    qualification = _first(response) or {}
+    context_cache.set(cache_key, "lead_qualification", qualification)
+    return qualification
+
+@_operation
+def resolve_turn_context(phone: str, platform: str = "whatsapp") -> Dict:
+    """
+    Resuelve el contexto de un turno: el usuario y la conversación activa se
+    consultan en paralelo y después la calificación de lead. Las filas en caché no
+    generan consultas.
+    
+    Args:
+        phone: Número de teléfono del usuario
+        platform: Plataforma (whatsapp, web, etc.)
+        
+    Returns:
+        Diccionario {user, conversation, lead_qualification}; cada valor puede ser None
+    """
+    user, conversation = yield Parallel(
+        get_user_by_phone.steps(phone),
+        get_active_conversation.steps(phone, platform)
+    )
+    qualification = None
+    if user and conversation:
+        qualification = yield from get_lead_qualification.steps(user["id"], conversation["id"])
+    
+    return {
+        "user": user,
+        "conversation": conversation,
+        "lead_qualification": qualification
+    }
+
+# ----- OPERACIONES DE DATOS BANT -----
+
+@_operation
+def get_bant_data(lead_qualification_id: str) -> Optional[Dict]:
+    """
+    Obtiene los datos BANT para una calificación de lead.
+    
+    Args:
+        lead_qualification_id: ID de la calificación de lead
+        
+    Returns:
+        Datos BANT o None si no existen
+    """
+    response = yield Query("bant_data") \
+        .select("*") \
+        .eq("lead_qualification_id", lead_qualification_id)
+    
+    return _first(response)
+
+@_operation
+def create_or_update_bant_data(lead_qualification_id: str, budget: str, authority: str, need: str, timeline: str) -> Dict:
+    """
+    Crea o actualiza los datos BANT para una calificación de lead.
+    
+    Args:
+        lead_qualification_id: ID de la calificación de lead
+        budget: Presupuesto
+        authority: Nivel de autoridad
+        need: Necesidad
+        timeline: Plazo
+        
+    Returns:
+        Datos BANT creados o actualizados
+    """
+    data = {
+        "lead_qualification_id": lead_qualification_id,
+        "budget": budget,
+        "authority": authority,
+        "need": need,
+        "timeline": timeline,
+        "updated_at": "now()"
+    }
+    
+    # UNIQUE(lead_qualification_id): inserta o actualiza en una sola petición
+    response = yield Query("bant_data") \
+        .upsert(data, on_conflict="lead_qualification_id")
+    
+    return _first(response) or {}
+
+# ----- OPERACIONES DE REQUERIMIENTOS -----
+
+@_operation
+def get_requirements(lead_qualification_id: str) -> Optional[Dict]:
+    """
+    Obtiene los requerimientos para una calificación de lead.
+    
+    Args:
+        lead_qualification_id: ID de la calificación de lead
+        
+    Returns:
+        Datos de requerimientos o None si no existen
+    """
+    response = yield Query("requirements") \
+        .select("*") \
+        .eq("lead_qualification_id", lead_qualification_id)
+    
+    return _first(response)
+
+@_operation
+def create_requirements(lead_qualification_id: str, app_type: str, deadline: str) -> Dict:
+    """
+    Crea nuevos requerimientos para una calificación de lead.
+    
+    Args:
+        lead_qualification_id: ID de la calificación de lead
+        app_type: Tipo de aplicación
+        deadline: Fecha límite
+        
+    Returns:
+        Datos de requerimientos creados
+    """
+    requirements_data = {
+        "lead_qualification_id": lead_qualification_id,
+        "app_type": app_type,
+        "deadline": deadline
+    }
+    
+    response = yield Query("requirements").insert(requirements_data)
+    return _first(response) or {}
+
+@_operation
+def update_requirements(requirements_id: str, data: Dict) -> Dict:
+    """
+    Actualiza los requerimientos.
+    
+    Args:
+        requirements_id: ID de los requerimientos
+        data: Datos a actualizar
+        
+    Returns:
+        Datos de requerimientos actualizados
+    """
+    # Asegurar que updated_at se actualice
+    if "updated_at" not in data:
+        data["updated_at"] = "now()"
+        
+    response = yield Query("requirements").update(data).eq("id", requirements_id)
+    return _first(response) or {}
+
+@_operation
+def get_or_create_requirements(lead_qualification_id: str, app_type: str, deadline: str) -> Dict:
+    """
+    Obtiene los requerimientos de una calificación de lead, creándolos si no existen.
+    Si ya existían se retornan sin cambios.
+    
+    Args:
+        lead_qualification_id: ID de la calificación de lead
+        app_type: Tipo de aplicación
+        deadline: Fecha límite
+        
+    Returns:
+        Datos de requerimientos
+    """
+    requirements_data = {
+        "lead_qualification_id": lead_qualification_id,
+        "app_type": app_type,
+        "deadline": deadline
+    }
+    
+    # UNIQUE(lead_qualification_id): el upsert ignora el conflicto si ya existen (o si otro
+    # proceso los creó en paralelo); en ese caso se releen
+    response = yield Query("requirements") \
+        .upsert(requirements_data, on_conflict="lead_qualification_id", ignore_duplicates=True)
+    if response.data:
+        return response.data[0]
+    return (yield from get_requirements.steps(lead_qualification_id)) or {}
+
+# ----- OPERACIONES DE CARACTERÍSTICAS -----
+
+def _named_item_rows(requirement_id: str, names: List[str]) -> List[Dict]:
+    """
+    Prepara las filas de características o integraciones sin nombres vacíos ni repetidos.
+    
+    Un nombre repetido es uno exactamente igual (tras quitar espacios), la misma regla
+    que UNIQUE(requirement_id, name) en la base de datos.
+    """
+    rows = []
+    seen = set()
+    for name in names:
+        name = (name or "").strip()
+        if name and name not in seen:
+            seen.add(name)
+            rows.append({"requirement_id": requirement_id, "name": name, "description": None})
+    return rows
+
+@_operation
+def _insert_named_items(table: str, requirement_id: str, names: List[str]) -> List[Dict]:
+    """
+    Inserta en una sola petición varios elementos con nombre (características o
+    integraciones) de unos requerimientos, ignorando los nombres ya existentes.
+    
+    Args:
+        table: "features" o "integrations"
+        requirement_id: ID de los requerimientos
+        names: Nombres a insertar
+        
+    Returns:
+        Lista de filas insertadas (sin las que ya existían)
+    """
+    rows = _named_item_rows(requirement_id, names)
+    if not rows:
+        return []
+    
+    # UNIQUE(requirement_id, name): los nombres ya guardados se ignoran en el servidor
+    response = yield Query(table) \
+        .upsert(rows, on_conflict="requirement_id,name", ignore_duplicates=True)
+    return response.data or []
+
+@_operation
+def add_feature(requirement_id: str, name: str, description: Optional[str] = None) -> Dict:
+    """
+    Añade una característica a los requerimientos.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        name: Nombre de la característica
+        description: Descripción (opcional)
+        
+    Returns:
+        Datos de la característica creada
+    """
+    feature_data = {
+        "requirement_id": requirement_id,
+        "name": name,
+        "description": description
+    }
+    
+    response = yield Query("features").insert(feature_data)
+    return _first(response) or {}
+
+@_operation
+def add_features(requirement_id: str, names: List[str]) -> List[Dict]:
+    """
+    Añade varias características a los requerimientos en una sola petición.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        names: Nombres de las características (se descartan vacíos y repetidos)
+        
+    Returns:
+        Lista de características creadas
+    """
+    return (yield from _insert_named_items.steps("features", requirement_id, names))
+
+@_operation
+def get_features(requirement_id: str) -> List[Dict]:
+    """
+    Obtiene todas las características de unos requerimientos.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        
+    Returns:
+        Lista de características
+    """
+    response = yield Query("features") \
+        .select("*") \
+        .eq("requirement_id", requirement_id)
+    
+    return response.data
+
+# ----- OPERACIONES DE INTEGRACIONES -----
+
+@_operation
+def add_integration(requirement_id: str, name: str, description: Optional[str] = None) -> Dict:
+    """
+    Añade una integración a los requerimientos.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        name: Nombre de la integración
+        description: Descripción (opcional)
+        
+    Returns:
+        Datos de la integración creada
+    """
+    integration_data = {
+        "requirement_id": requirement_id,
+        "name": name,
+        "description": description
+    }
+    
+    response = yield Query("integrations").insert(integration_data)
+    return _first(response) or {}
+
+@_operation
+def add_integrations(requirement_id: str, names: List[str]) -> List[Dict]:
+    """
+    Añade varias integraciones a los requerimientos en una sola petición.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        names: Nombres de las integraciones (se descartan vacíos y repetidos)
+        
+    Returns:
+        Lista de integraciones creadas
+    """
+    return (yield from _insert_named_items.steps("integrations", requirement_id, names))
+
+@_operation
+def get_integrations(requirement_id: str) -> List[Dict]:
+    """
+    Obtiene todas las integraciones de unos requerimientos.
+    
+    Args:
+        requirement_id: ID de los requerimientos
+        
+    Returns:
+        Lista de integraciones
+    """
+    response = yield Query("integrations") \
+        .select("*") \
+        .eq("requirement_id", requirement_id)
+    
+    return response.data
+
+@_operation
+def save_lead_requirements(qualification_id: str, app_type: str, deadline: str,
+                           features: List[str], integrations: List[str],
+                           next_step: Optional[str] = None) -> Dict:
+    """
+    Guarda los requerimientos de una calificación con sus características e integraciones.
+    
+    Los requerimientos se crean primero (las demás filas necesitan su ID); después las
+    características, las integraciones y el cambio de paso de la calificación se envían
+    a la vez, así que el turno espera dos peticiones en lugar de cuatro.
+    
+    Args:
+        qualification_id: ID de la calificación de lead
+        app_type: Tipo de aplicación
+        deadline: Fecha límite
+        features: Nombres de las características
+        integrations: Nombres de las integraciones
+        next_step: Paso al que pasa la calificación (None para no cambiarlo)
+        
+    Returns:
+        Datos de los requerimientos guardados
+    """
+    requirements = yield from get_or_create_requirements.steps(qualification_id, app_type=app_type, deadline=deadline)
+    if not requirements:
+        return {}
+    
+    writes = [
+        add_features.steps(requirements["id"], features),
+        add_integrations.steps(requirements["id"], integrations),
+    ]
+    if next_step:
+        writes.append(update_lead_qualification.steps(qualification_id, {"current_step": next_step}))
+    yield Parallel(*writes)
+    return requirements
+
+# ----- OPERACIONES DE REUNIONES -----
+
+@_operation
+def create_meeting(user_id: str, lead_qualification_id: str, outlook_meeting_id: str, 
+                  subject: str, start_time: str, end_time: str, 
+                  online_meeting_url: Optional[str] = None) -> Dict:
+    """
+    Crea una nueva reunión.
+    
+    Args:
+        user_id: ID del usuario
+        lead_qualification_id: ID de la calificación de lead
+        outlook_meeting_id: ID de la reunión en Outlook
+        subject: Asunto
+        start_time: Fecha y hora de inicio
+        end_time: Fecha y hora de fin
+        online_meeting_url: URL de la reunión online (opcional)
+        
+    Returns:
+        Datos de la reunión creada
+    """
+    meeting_data = {
+        "user_id": user_id,
+        "lead_qualification_id": lead_qualification_id,
+        "outlook_meeting_id": outlook_meeting_id,
+        "subject": subject,
+        "start_time": start_time,
+        "end_time": end_time,
+        "status": "scheduled",
+        "online_meeting_url": online_meeting_url
+    }
+    
+    response = yield Query("meetings").insert(meeting_data)
+    return _first(response) or {}
+
+@_operation
+def update_meeting_status(meeting_id: str, status: str) -> Dict:
+    """
+    Actualiza el estado de una reunión.
+    
+    Args:
+        meeting_id: ID de la reunión
+        status: Nuevo estado (scheduled, completed, cancelled, rescheduled)
+        
+    Returns:
+        Datos de la reunión actualizada
+    """
+    update_data = {
+        "status": status,
+        "updated_at": "now()"
+    }
+    
+    response = yield Query("meetings").update(update_data).eq("id", meeting_id)
+    return _first(response) or {}
+
+@_operation
+def get_user_meetings(user_id: str) -> List[Dict]:
+    """
+    Obtiene todas las reuniones de un usuario.
+    
+    Args:
+        user_id: ID del usuario
+        
+    Returns:
+        Lista de reuniones
+    """
+    response = yield Query("meetings") \
+        .select("*") \
+        .eq("user_id", user_id) \
+        .order("start_time")
+    
+    return response.data
+
+@_operation
+def get_user_meetings_page(user_id: str, cursor: Optional[str] = None,
+                           limit: Optional[int] = None) -> Dict:
+    """
+    Obtiene una página de las reuniones de un usuario, en orden (created_at, id).
+    
+    Args:
+        user_id: ID del usuario
+        cursor: Cursor de la página anterior (None para la primera página)
+        limit: Reuniones por página (por defecto DB_PAGE_SIZE)
+        
+    Returns:
+        Diccionario con items y next_cursor
+    """
+    limit = _page_size(limit)
+    query = Query("meetings") \
+        .select("*") \
+        .eq("user_id", user_id)
+    response = yield _keyset_query(query, cursor, limit)
+    return _keyset_page(response.data, limit)
+
+@_operation
+def get_meeting_by_outlook_id(outlook_meeting_id: str) -> Optional[Dict]:
+    """
+    Obtiene una reunión por su ID de Outlook.
+    
+    Args:
+        outlook_meeting_id: ID de la reunión en Outlook
+        
+    Returns:
+        Datos de la reunión o None si no existe
+    """
+    response = yield Query("meetings") \
+        .select("*") \
+        .eq("outlook_meeting_id", outlook_meeting_id)
+    
+    return _first(response)
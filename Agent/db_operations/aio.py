@@ -0,0 +1,168 @@
+"""
+Versión asíncrona de las operaciones de base de datos.
+
+Expone las mismas funciones que `db_operations` como corrutinas sobre el cliente
+asíncrono compartido de Supabase, para que un servidor asyncio no tenga que
+delegar cada consulta a un hilo y pueda solapar consultas independientes con
+`asyncio.gather` (ver `resolve_turn_context`).
+
+Las operaciones no se repiten aquí: se ejecutan los mismos generadores de consultas
+de `db_operations` (ver queries.py) y solo cambia cómo se ejecuta cada paso. Comparte
+con la API síncrona la caché de contexto, las constantes y las excepciones.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+from typing import Optional
+
+import db_operations
+from supabase_client import get_async_supabase_client
+from db_operations.queries import Background, Parallel, resume
+from db_operations import (
+    context_cache,
+    DuplicateMessageError,
+    HISTORY_MAX_MESSAGES,
+    merge_consecutive_user_messages,
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tareas en segundo plano (se guarda la referencia para que no las recolecte el GC)
+_background_tasks = set()
+
+def _spawn(coroutine):
+    """Lanza una corrutina en segundo plano sin bloquear el turno"""
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+# ----- EJECUCIÓN CON EL CLIENTE ASÍNCRONO -----
+
+async def _run(steps):
+    """Ejecuta una operación con el cliente asíncrono y retorna su resultado"""
+    done, value = resume(steps)
+    while not done:
+        try:
+            result, error = await _execute(value), None
+        except Exception as e:
+            result, error = None, e
+        done, value = resume(steps, result, error)
+    return value
+
+async def _execute(step):
+    """Ejecuta un paso de una operación (ver queries.py)"""
+    if isinstance(step, Parallel):
+        return list(await asyncio.gather(*(_execute(item) for item in step.steps)))
+    if isinstance(step, Background):
+        _spawn(_run(step.steps))
+        return None
+    if inspect.isgenerator(step):
+        return await _run(step)
+    query = step.build(await get_async_supabase_client())
+    return await query.execute() if query is not None else None
+
+def _coroutine(function):
+    """Versión asíncrona de una operación de db_operations"""
+    steps = function.steps
+
+    @functools.wraps(steps)
+    async def execute(*args, **kwargs):
+        return await _run(steps(*args, **kwargs))
+    return execute
+
+# ----- PAGINACIÓN POR CURSOR -----
+
+async def iterate_pages(fetch_page, *args, page_size: Optional[int] = None, **kwargs):
+    """
+    Recorre todas las filas de una consulta paginada pidiendo las páginas a medida
+    que se consumen (versión asíncrona de `db_operations.iterate_pages`).
+
+    Args:
+        fetch_page: Corrutina de página (p. ej. get_conversation_messages_page)
+        *args: Argumentos de la función de página
+        page_size: Filas por página
+        **kwargs: Argumentos con nombre de la función de página
+
+    Returns:
+        Generador asíncrono de filas en orden (created_at, id)
+    """
+    cursor = None
+    while True:
+        page = await fetch_page(*args, cursor=cursor, limit=page_size, **kwargs)
+        for row in page["items"]:
+            yield row
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+# ----- OPERACIONES DE USUARIOS -----
+
+get_user_by_phone = _coroutine(db_operations.get_user_by_phone)
+get_user_by_email = _coroutine(db_operations.get_user_by_email)
+get_user_by_id = _coroutine(db_operations.get_user_by_id)
+create_user = _coroutine(db_operations.create_user)
+update_user = _coroutine(db_operations.update_user)
+get_or_create_user = _coroutine(db_operations.get_or_create_user)
+get_users_page = _coroutine(db_operations.get_users_page)
+
+# ----- OPERACIONES DE CONVERSACIONES -----
+
+get_active_conversation = _coroutine(db_operations.get_active_conversation)
+create_conversation = _coroutine(db_operations.create_conversation)
+close_conversation = _coroutine(db_operations.close_conversation)
+get_or_create_conversation = _coroutine(db_operations.get_or_create_conversation)
+update_conversation_summary = _coroutine(db_operations.update_conversation_summary)
+
+# ----- OPERACIONES DE MENSAJES -----
+
+get_conversation_messages = _coroutine(db_operations.get_conversation_messages)
+get_conversation_messages_page = _coroutine(db_operations.get_conversation_messages_page)
+add_message = _coroutine(db_operations.add_message)
+update_message_delivery = _coroutine(db_operations.update_message_delivery)
+get_system_messages = _coroutine(db_operations.get_system_messages)
+get_recent_messages = _coroutine(db_operations.get_recent_messages)
+get_messages_since = _coroutine(db_operations.get_messages_since)
+get_conversation_history = _coroutine(db_operations.get_conversation_history)
+ingest_inbound_message = _coroutine(db_operations.ingest_inbound_message)
+
+# ----- OPERACIONES DE CALIFICACIÓN DE LEADS -----
+
+get_lead_qualification = _coroutine(db_operations.get_lead_qualification)
+create_lead_qualification = _coroutine(db_operations.create_lead_qualification)
+update_lead_qualification = _coroutine(db_operations.update_lead_qualification)
+get_or_create_lead_qualification = _coroutine(db_operations.get_or_create_lead_qualification)
+resolve_turn_context = _coroutine(db_operations.resolve_turn_context)
+
+# ----- OPERACIONES DE DATOS BANT -----
+
+get_bant_data = _coroutine(db_operations.get_bant_data)
+create_or_update_bant_data = _coroutine(db_operations.create_or_update_bant_data)
+
+# ----- OPERACIONES DE REQUERIMIENTOS -----
+
+get_requirements = _coroutine(db_operations.get_requirements)
+create_requirements = _coroutine(db_operations.create_requirements)
+update_requirements = _coroutine(db_operations.update_requirements)
+get_or_create_requirements = _coroutine(db_operations.get_or_create_requirements)
+save_lead_requirements = _coroutine(db_operations.save_lead_requirements)
+
+# ----- OPERACIONES DE CARACTERÍSTICAS E INTEGRACIONES -----
+
+add_feature = _coroutine(db_operations.add_feature)
+add_features = _coroutine(db_operations.add_features)
+get_features = _coroutine(db_operations.get_features)
+add_integration = _coroutine(db_operations.add_integration)
+add_integrations = _coroutine(db_operations.add_integrations)
+get_integrations = _coroutine(db_operations.get_integrations)
+
+# ----- OPERACIONES DE REUNIONES -----
+
+create_meeting = _coroutine(db_operations.create_meeting)
+update_meeting_status = _coroutine(db_operations.update_meeting_status)
+get_user_meetings = _coroutine(db_operations.get_user_meetings)
+get_user_meetings_page = _coroutine(db_operations.get_user_meetings_page)
+get_meeting_by_outlook_id = _coroutine(db_operations.get_meeting_by_outlook_id)
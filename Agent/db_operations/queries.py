@@ -0,0 +1,114 @@
+"""
+Consultas que se construyen sin cliente, para compartir las operaciones entre
+`db_operations` (cliente síncrono) y `db_operations.aio` (cliente asíncrono).
+
+Cada operación se escribe una sola vez como un generador que produce (`yield`) los
+pasos que necesita y recibe su resultado:
+
+    response = yield Query("users").select("*").eq("id", user_id)
+
+Cada módulo solo implementa cómo se ejecuta un paso con su cliente:
+
+- Query: consulta sobre una tabla; se reproduce sobre `client.table(...)` y se ejecuta.
+- Rpc: llamada a una función de Postgres; el resultado es None si el cliente no tiene `rpc`.
+- Parallel: varios pasos u operaciones a la vez; el resultado es la lista de resultados.
+- Background: operación que se lanza sin esperarla; el resultado es None.
+
+Una excepción de la consulta se relanza dentro del generador en el `yield`, así
+las operaciones la tratan con try/except como cualquier llamada.
+"""
+
+import functools
+from typing import Any, Dict, Tuple
+
+
+class Query:
+    """
+    Consulta de PostgREST pendiente: guarda la cadena de llamadas (select, eq, order...)
+    para repetirla sobre la consulta de un cliente real.
+    """
+
+    def __init__(self, table: str, calls: Tuple = ()):
+        self.table = table
+        self.calls = calls
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def record(*args, **kwargs):
+            return Query(self.table, self.calls + ((method, args, kwargs),))
+        return record
+
+    def build(self, client):
+        """Retorna la consulta equivalente del cliente, lista para execute()"""
+        query = client.table(self.table)
+        for method, args, kwargs in self.calls:
+            query = getattr(query, method)(*args, **kwargs)
+        return query
+
+    def __repr__(self):
+        chain = "".join(f".{method}(...)" for method, _, _ in self.calls)
+        return f"Query({self.table!r}){chain}"
+
+
+class Rpc:
+    """Llamada pendiente a una función de Postgres"""
+
+    def __init__(self, function: str, params: Dict[str, Any]):
+        self.function = function
+        self.params = params
+
+    def build(self, client):
+        """Retorna la llamada del cliente, o None si el cliente no admite RPC (backends locales)"""
+        if not hasattr(client, "rpc"):
+            return None
+        return client.rpc(self.function, self.params)
+
+
+class Parallel:
+    """Pasos independientes que se pueden ejecutar a la vez"""
+
+    def __init__(self, *steps):
+        self.steps = steps
+
+
+class Background:
+    """Operación que se lanza en segundo plano sin bloquear la que la produce"""
+
+    def __init__(self, steps):
+        self.steps = steps
+
+
+def resume(steps, result=None, error=None):
+    """
+    Avanza una operación hasta su siguiente paso.
+
+    Args:
+        steps: Generador de la operación
+        result: Resultado del paso anterior
+        error: Excepción del paso anterior (se relanza dentro del generador)
+
+    Returns:
+        Tupla (terminado, valor): el resultado de la operación o el siguiente paso
+    """
+    try:
+        step = steps.throw(error) if error is not None else steps.send(result)
+    except StopIteration as stop:
+        return True, stop.value
+    return False, step
+
+
+def operation(run):
+    """
+    Decorador que convierte el generador de una operación en una función que la
+    ejecuta con `run`. El generador queda en el atributo `steps` para que otras
+    operaciones lo compongan (`yield from get_user_by_phone.steps(phone)`).
+    """
+    def decorator(steps_function):
+        @functools.wraps(steps_function)
+        def execute(*args, **kwargs):
+            return run(steps_function(*args, **kwargs))
+        execute.steps = steps_function
+        return execute
+    return decorator
@@ -0,0 +1,199 @@
+"""
+Modo degradado del webhook cuando Supabase no está disponible.
+
+Si la ingesta de una ráfaga falla porque la base de datos no responde (timeout,
+error de red o 5xx, o el circuit breaker de supabase_client está abierto), la
+ráfaga no recibe el mensaje de error genérico:
+
+1. Se difiere en memoria; su entrada del journal local (inbound_journal.py) no se
+   marca como terminada, así que un reinicio también la reprocesa.
+2. El remitente recibe de inmediato un acuse de recibo (una vez por episodio).
+3. Un hilo de reconciliación espera a que el circuito deje de estar abierto y
+   vuelve a encolar las ráfagas diferidas, una por remitente con todos sus
+   mensajes. En estado semiabierto reencola una sola, que hace de prueba; con el
+   circuito cerrado, todas.
+
+En modo "process" (AGENT_EXECUTION_MODE) la ráfaga se difiere en el proceso del
+pool que la recibió; el journal lo gestiona el proceso de entrada, así que en ese
+modo la protección ante reinicios cubre solo a los mensajes aún no entregados al pool.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from supabase_client import get_supabase_breaker, is_database_unavailable
+from utils.circuit_breaker import OPEN, HALF_OPEN
+from utils.ttl_cache import TTLCache
+from utils import metrics
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+DEGRADED_MODE_ENABLED = os.getenv("DEGRADED_MODE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Segundos entre intentos de reconciliación
+DEGRADED_RECONCILE_INTERVAL = float(os.getenv("DEGRADED_RECONCILE_INTERVAL", 5))
+
+# Un remitente no recibe otro acuse de recibo hasta pasado este tiempo
+DEGRADED_ACK_TTL = int(os.getenv("DEGRADED_ACK_TTL", 3600))
+
+DEGRADED_ACK_MESSAGE = os.getenv(
+    "DEGRADED_ACK_MESSAGE",
+    "¡Gracias por tu mensaje! Lo recibimos, pero en este momento tenemos una demora en "
+    "nuestros sistemas. Te responderemos en unos minutos."
+)
+
+# Valor que retorna process_incoming_messages cuando la ráfaga quedó diferida
+DEFERRED = "deferred"
+
+
+class DegradedMode:
+    """
+    Ráfagas diferidas por remitente y el hilo que las reconcilia.
+    """
+
+    def __init__(self, resubmit: Callable[[str, List[Dict]], bool], acknowledge: Callable[[str], None],
+                 breaker=None, interval=DEGRADED_RECONCILE_INTERVAL, ack_ttl=DEGRADED_ACK_TTL,
+                 enabled=DEGRADED_MODE_ENABLED):
+        """
+        Args:
+            resubmit: Función (sender_key, mensajes) que vuelve a encolar una ráfaga; retorna False si no pudo
+            acknowledge: Función (sender) que envía el acuse de recibo al usuario
+            breaker: Circuit breaker de Supabase (por defecto el de supabase_client)
+            interval: Segundos entre intentos de reconciliación
+            ack_ttl: Segundos durante los que no se repite el acuse a un remitente
+            enabled: Activar el modo degradado
+        """
+        self.resubmit = resubmit
+        self.acknowledge = acknowledge
+        self.breaker = breaker if breaker is not None else get_supabase_breaker()
+        self.interval = interval
+        self.enabled = enabled
+        # sender_key -> lista de mensajes en orden de llegada
+        self._deferred: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._acknowledged = TTLCache(maxsize=100000, ttl=ack_ttl)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = {"deferred_batches": 0, "deferred_messages": 0, "acks": 0, "resubmitted": 0}
+
+    def defer(self, sender_key: str, sender: str, incoming_messages: List[Dict], error: Exception) -> bool:
+        """
+        Difiere una ráfaga si el error indica que la base de datos no está disponible.
+
+        Args:
+            sender_key: Clave del remitente (teléfono normalizado)
+            sender: Teléfono al que enviar el acuse de recibo
+            incoming_messages: Mensajes de la ráfaga
+            error: Excepción de la ingesta
+
+        Returns:
+            True si la ráfaga quedó diferida, False si el error debe tratarse como siempre
+        """
+        if not self.enabled or not is_database_unavailable(error):
+            return False
+
+        with self._lock:
+            self._deferred.setdefault(sender_key, []).extend(incoming_messages)
+            self._stats["deferred_batches"] += 1
+            self._stats["deferred_messages"] += len(incoming_messages)
+            send_ack = self._acknowledged.add(sender_key)
+            if send_ack:
+                self._stats["acks"] += 1
+            self._ensure_thread()
+        metrics.increment("webhook.degraded.deferred", len(incoming_messages))
+        logger.warning(
+            f"Base de datos no disponible ({type(error).__name__}): {len(incoming_messages)} "
+            f"mensaje(s) de {sender} diferidos hasta que se recupere"
+        )
+
+        if send_ack:
+            try:
+                self.acknowledge(sender)
+            except Exception as e:
+                logger.error(f"No se pudo enviar el acuse de recibo a {sender}: {str(e)}")
+        return True
+
+    def _ensure_thread(self):
+        """Inicia el hilo de reconciliación si no está corriendo (con el lock tomado)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._reconcile_loop, name="degraded-reconcile", daemon=True)
+            self._thread.start()
+
+    def _reconcile_loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Error al reconciliar los mensajes diferidos: {str(e)}")
+            with self._lock:
+                if not self._deferred:
+                    self._thread = None
+                    return
+
+    def reconcile(self) -> int:
+        """
+        Vuelve a encolar las ráfagas diferidas si el circuito lo permite.
+
+        Returns:
+            Número de remitentes cuyas ráfagas se reencolaron
+        """
+        state = self.breaker.state if self.breaker is not None else None
+        if state == OPEN:
+            return 0
+
+        with self._lock:
+            if not self._deferred:
+                return 0
+            # En semiabierto basta una ráfaga para probar la base de datos
+            count = 1 if state == HALF_OPEN else len(self._deferred)
+            batches = [self._deferred.popitem(last=False) for _ in range(count)]
+
+        resubmitted = 0
+        for index, (sender_key, messages) in enumerate(batches):
+            if self.resubmit(sender_key, messages):
+                resubmitted += 1
+                continue
+            # La cola está llena: devolver esta ráfaga y las restantes para el próximo intento
+            with self._lock:
+                for pending_key, pending_messages in reversed(batches[index:]):
+                    pending_messages.extend(self._deferred.pop(pending_key, []))
+                    self._deferred[pending_key] = pending_messages
+                    self._deferred.move_to_end(pending_key, last=False)
+            break
+
+        if resubmitted:
+            with self._lock:
+                self._stats["resubmitted"] += resubmitted
+                if not self._deferred and state != HALF_OPEN:
+                    # Episodio terminado: el próximo corte vuelve a avisar a los usuarios
+                    self._acknowledged.clear()
+            metrics.increment("webhook.degraded.resubmitted", resubmitted)
+            logger.info(f"Reconciliación: {resubmitted} ráfaga(s) diferidas reencoladas")
+        return resubmitted
+
+    @property
+    def active(self) -> bool:
+        """Indica si hay ráfagas diferidas o el circuito de Supabase está abierto"""
+        with self._lock:
+            if self._deferred:
+                return True
+        return self.breaker is not None and self.breaker.state == OPEN
+
+    def get_stats(self):
+        """
+        Retorna las ráfagas y mensajes diferidos, acuses enviados, ráfagas reencoladas,
+        pendientes y el estado del circuito de Supabase.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_senders"] = len(self._deferred)
+            stats["pending_messages"] = sum(len(messages) for messages in self._deferred.values())
+        stats["enabled"] = self.enabled
+        stats["breaker"] = self.breaker.get_stats() if self.breaker is not None else None
+        return stats
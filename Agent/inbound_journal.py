@@ -0,0 +1,255 @@
+"""
+Journal local de mensajes entrantes (SQLite en modo WAL).
+
+Cada mensaje del webhook se escribe en disco antes de responder 200 a WhatsApp;
+los workers lo marcan como terminado al procesarlo y, si el proceso muere antes
+(deploy, OOM), las entradas pendientes se reprocesan al arrancar.
+
+Un único hilo escritor agrupa en una sola transacción todas las escrituras que
+llegan mientras confirma la anterior (group commit), de modo que el costo
+de durabilidad se reparte entre las peticiones concurrentes.
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Modo de sincronización de SQLite: NORMAL sobrevive a la caída del proceso,
+# FULL también a un corte de energía (a costa de un fsync por commit)
+INBOUND_JOURNAL_SYNC = os.getenv("INBOUND_JOURNAL_SYNC", "NORMAL").upper()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbound_journal (
+    id TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    owner_pid INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inbound_journal_created_at ON inbound_journal(created_at);
+"""
+
+
+def _process_alive(pid):
+    """Indica si existe un proceso con el PID indicado"""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class InboundJournal:
+    """
+    Journal append-only de mensajes entrantes con group commit.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Ruta del archivo SQLite del journal
+        """
+        self.path = path
+        self._ops = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {"appended": 0, "done": 0, "commits": 0, "commit_time": 0.0, "max_batch": 0}
+
+        # Crear el esquema con una conexión temporal
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        connection.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="inbound-journal", daemon=True)
+        self._writer.start()
+        logger.info(f"Journal de entrada abierto en {path} (synchronous={INBOUND_JOURNAL_SYNC})")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={INBOUND_JOURNAL_SYNC}")
+        connection.execute("PRAGMA busy_timeout=5000")
+        return connection
+
+    # ---- API PÚBLICA ----
+
+    def append_many(self, records: List[Dict]) -> List[str]:
+        """
+        Escribe varias entradas y espera a que queden confirmadas en disco.
+
+        Args:
+            records: Lista de entradas {sender, payload}
+
+        Returns:
+            IDs asignados a las entradas, en el mismo orden
+        """
+        if not records:
+            return []
+        now = time.time()
+        pid = os.getpid()
+        rows = [
+            (uuid.uuid4().hex, record["sender"], json.dumps(record["payload"], ensure_ascii=False), pid, now)
+            for record in records
+        ]
+        done = threading.Event()
+        result = {}
+        self._ops.put(("append", rows, done, result))
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+        return [row[0] for row in rows]
+
+    def append(self, sender: str, payload: Dict) -> str:
+        """Escribe una entrada y espera a que quede confirmada en disco"""
+        return self.append_many([{"sender": sender, "payload": payload}])[0]
+
+    def mark_done(self, entry_ids: List[str]):
+        """
+        Marca entradas como procesadas (se eliminan del journal).
+        No espera a la confirmación: si el proceso muere antes, la entrada
+        se reprocesa y la unicidad de messages.external_id la descarta.
+        """
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id]
+        if entry_ids:
+            self._ops.put(("done", entry_ids, None, None))
+
+    def claim_orphaned(self) -> List[Dict]:
+        """
+        Toma las entradas pendientes cuyo proceso dueño ya no existe.
+
+        Returns:
+            Lista de entradas {id, sender, payload} en orden de llegada
+        """
+        done = threading.Event()
+        result = {}
+        self._ops.put(("claim", None, done, result))
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+        return result["entries"]
+
+    def pending_count(self) -> int:
+        """Retorna el número de entradas pendientes"""
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM inbound_journal").fetchone()[0]
+        finally:
+            connection.close()
+
+    def get_stats(self):
+        """
+        Retorna contadores de escrituras, commits agrupados y latencia de commit.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        commits = stats.pop("commits")
+        commit_time = stats.pop("commit_time")
+        stats["group_commits"] = commits
+        stats["avg_commit_ms"] = round(commit_time / commits * 1000, 3) if commits else 0.0
+        stats["avg_batch_size"] = round(stats["appended"] / commits, 2) if commits else 0.0
+        stats["queued_ops"] = self._ops.qsize()
+        return stats
+
+    # ---- HILO ESCRITOR ----
+
+    def _writer_loop(self):
+        connection = self._connect()
+        while True:
+            ops = [self._ops.get()]
+            # Agrupar todo lo que llegó mientras se confirmaba la transacción anterior
+            while True:
+                try:
+                    ops.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+
+            start_time = time.perf_counter()
+            appended = 0
+            done_count = 0
+            claim_results = []
+            try:
+                connection.execute("BEGIN")
+                for kind, data, event, result in ops:
+                    if kind == "append":
+                        connection.executemany(
+                            "INSERT INTO inbound_journal (id, sender, payload, owner_pid, created_at) VALUES (?, ?, ?, ?, ?)",
+                            data
+                        )
+                        appended += len(data)
+                    elif kind == "done":
+                        connection.executemany("DELETE FROM inbound_journal WHERE id = ?", [(entry_id,) for entry_id in data])
+                        done_count += len(data)
+                    elif kind == "claim":
+                        claim_results.append((result, self._claim(connection)))
+                connection.execute("COMMIT")
+                for result, entries in claim_results:
+                    result["entries"] = entries
+            except Exception as e:
+                logger.error(f"Error al escribir en el journal de entrada: {str(e)}")
+                try:
+                    connection.execute("ROLLBACK")
+                except Exception:
+                    pass
+                for kind, data, event, result in ops:
+                    if result is not None:
+                        result["error"] = e
+            finally:
+                for kind, data, event, result in ops:
+                    if event is not None:
+                        event.set()
+
+            elapsed = time.perf_counter() - start_time
+            with self._stats_lock:
+                self._stats["appended"] += appended
+                self._stats["done"] += done_count
+                self._stats["commits"] += 1
+                self._stats["commit_time"] += elapsed
+                self._stats["max_batch"] = max(self._stats["max_batch"], appended)
+
+    def _claim(self, connection) -> List[Dict]:
+        """Reasigna al proceso actual las entradas de procesos que ya no existen"""
+        rows = connection.execute(
+            "SELECT id, sender, payload, owner_pid FROM inbound_journal ORDER BY created_at"
+        ).fetchall()
+        pid = os.getpid()
+        entries = []
+        for entry_id, sender, payload, owner_pid in rows:
+            # Las entradas con nuestro PID son de una ejecución anterior (PID reutilizado)
+            if owner_pid != pid and _process_alive(owner_pid):
+                continue
+            entries.append({"id": entry_id, "sender": sender, "payload": json.loads(payload)})
+        if entries:
+            connection.executemany(
+                "UPDATE inbound_journal SET owner_pid = ? WHERE id = ?",
+                [(pid, entry["id"]) for entry in entries]
+            )
+        return entries
+
+
+def open_inbound_journal(path: Optional[str]) -> Optional[InboundJournal]:
+    """
+    Abre el journal de entrada si hay una ruta configurada.
+
+    Returns:
+        Instancia del journal o None si está desactivado o no se pudo abrir
+    """
+    if not path:
+        logger.warning("Journal de entrada desactivado (INBOUND_JOURNAL_PATH vacío)")
+        return None
+    try:
+        return InboundJournal(path)
+    except Exception as e:
+        logger.error(f"No se pudo abrir el journal de entrada en {path}: {str(e)}")
+        return None
@@ -0,0 +1,624 @@
+"""
+API fluida de consultas para los backends locales de la base de datos.
+
+Reproduce la parte de la API de postgrest-py que usa el proyecto
+(`table().select().eq().order().limit().execute()`, insert, upsert, update,
+delete, filtros `or_` con la sintaxis de PostgREST) sobre un backend local, de
+modo que `db_operations` funciona igual contra Supabase o sin él.
+
+Este módulo construye la consulta (`LocalQuery`), ofrece los clientes con la API
+de supabase-py (`LocalClient`, `AsyncLocalClient`) y define lo que comparten
+los backends: el esquema de las tablas (restricciones UNIQUE, índices, valores
+por defecto y columnas de fecha), la normalización de valores y los errores con
+los mismos códigos que Postgres. Cada backend implementa `execute(query)` y
+publica sus escrituras con `publish_row_changes`, como los triggers de
+notify_cache_invalidation en Postgres.
+"""
+
+import datetime
+import re
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+from postgrest.exceptions import APIError
+
+from cache_invalidation import TABLE_CONTEXT_FIELDS, get_invalidation_bus
+
+# Código de Postgres para violaciones de restricciones UNIQUE
+UNIQUE_VIOLATION_CODE = "23505"
+
+
+class TableSchema:
+    """Restricciones, índices y valores por defecto de una tabla"""
+
+    def __init__(self, unique=(), indexes=(), defaults=None, timestamps=("created_at", "updated_at"),
+                 primary_key="id"):
+        """
+        Args:
+            unique: Restricciones UNIQUE (tuplas de columnas)
+            indexes: Columnas con índice hash para búsquedas por igualdad
+            defaults: Valores por defecto de las columnas (además de id y fechas)
+            timestamps: Columnas de fecha (se normalizan y se completan con la hora actual)
+            primary_key: Columna de la clave primaria
+        """
+        self.primary_key = primary_key
+        self.unique = [tuple(columns) for columns in unique]
+        self.indexes = list(indexes)
+        self.defaults = dict(defaults or {})
+        self.timestamps = tuple(timestamps)
+
+
+# Esquema equivalente a supabase_schema.sql
+TABLE_SCHEMAS = {
+    "users": TableSchema(
+        unique=[("phone",), ("email",)]
+    ),
+    "conversations": TableSchema(
+        unique=[("platform", "external_id")],
+        indexes=["user_id", "status"],
+        defaults={"status": "active", "summary": None},
+        timestamps=("created_at", "updated_at", "summary_until")
+    ),
+    "messages": TableSchema(
+        # La unicidad de external_id se lleva en message_external_ids en Postgres
+        unique=[("external_id",)],
+        indexes=["conversation_id"],
+        defaults={"message_type": "text", "media_url": None, "external_id": None,
+                  "delivery_status": None, "delivery_error": None},
+        timestamps=("created_at",)
+    ),
+    "message_external_ids": TableSchema(
+        primary_key="external_id",
+        timestamps=("created_at",)
+    ),
+    "lead_qualification": TableSchema(
+        unique=[("user_id", "conversation_id")],
+        indexes=["conversation_id"],
+        defaults={"consent": False, "current_step": "start"}
+    ),
+    "bant_data": TableSchema(
+        unique=[("lead_qualification_id",)]
+    ),
+    "requirements": TableSchema(
+        unique=[("lead_qualification_id",)]
+    ),
+    "features": TableSchema(
+        unique=[("requirement_id", "name")],
+        indexes=["requirement_id"],
+        timestamps=("created_at",)
+    ),
+    "integrations": TableSchema(
+        unique=[("requirement_id", "name")],
+        indexes=["requirement_id"],
+        timestamps=("created_at",)
+    ),
+    "meetings": TableSchema(
+        indexes=["user_id", "outlook_meeting_id", "lead_qualification_id"],
+        defaults={"status": "scheduled"},
+        timestamps=("created_at", "updated_at", "start_time", "end_time")
+    )
+}
+
+# Esquema de las tablas que no están en TABLE_SCHEMAS
+DEFAULT_SCHEMA = TableSchema()
+
+
+def get_table_schema(table_name: str) -> TableSchema:
+    """Retorna el esquema de una tabla (o uno genérico con id y fechas)"""
+    return TABLE_SCHEMAS.get(table_name, DEFAULT_SCHEMA)
+
+
+# ----- VALORES -----
+
+_clock_lock = threading.Lock()
+_last_timestamp = None
+
+
+def utc_now() -> str:
+    """
+    Retorna la hora actual en ISO 8601 UTC con microsegundos. Es estrictamente
+    creciente dentro del proceso, así el orden por created_at es el de inserción.
+    """
+    global _last_timestamp
+    now = datetime.datetime.now(datetime.timezone.utc)
+    with _clock_lock:
+        if _last_timestamp is not None and now <= _last_timestamp:
+            now = _last_timestamp + datetime.timedelta(microseconds=1)
+        _last_timestamp = now
+    return now.isoformat(timespec="microseconds")
+
+
+def normalize_timestamp(value):
+    """
+    Convierte una fecha a ISO 8601 UTC con microsegundos, para que el orden de las
+    cadenas sea el cronológico. Acepta "now()" como en las escrituras a PostgREST.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str) and value.strip().lower() in ("now()", "now"):
+        return utc_now()
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    elif isinstance(value, datetime.date):
+        parsed = datetime.datetime(value.year, value.month, value.day)
+    else:
+        try:
+            parsed = datetime.datetime.fromisoformat(str(value).strip().replace(" ", "T", 1))
+        except ValueError:
+            return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc).isoformat(timespec="microseconds")
+
+
+def normalize_row(schema: TableSchema, row: Dict) -> Dict:
+    """Normaliza las columnas de fecha de una fila a escribir"""
+    row = dict(row)
+    for column in schema.timestamps:
+        if column in row:
+            row[column] = normalize_timestamp(row[column])
+    return row
+
+
+def new_row(schema: TableSchema, values: Dict) -> Dict:
+    """Completa una fila nueva con el ID, las fechas y los valores por defecto"""
+    row = dict(schema.defaults)
+    if schema.primary_key == "id":
+        row["id"] = str(uuid.uuid4())
+    now = utc_now()
+    for column in schema.timestamps:
+        if column in ("created_at", "updated_at"):
+            row[column] = now
+    row.update(normalize_row(schema, values))
+    return row
+
+
+def unique_violation(table_name: str, columns, values=None) -> APIError:
+    """Error con el mismo código y formato que una violación de UNIQUE en PostgREST"""
+    key = ", ".join(columns)
+    details = None
+    if values is not None:
+        details = f"Key ({key})=({', '.join(str(item) for item in values)}) already exists."
+    return APIError({
+        "code": UNIQUE_VIOLATION_CODE,
+        "message": f'duplicate key value violates unique constraint "{table_name}_{"_".join(columns)}_key"',
+        "details": details,
+        "hint": None
+    })
+
+
+def query_error(message: str, code: str = "PGRST100") -> APIError:
+    """Error de consulta mal formada (mismo código que PostgREST)"""
+    return APIError({"code": code, "message": message, "details": None, "hint": None})
+
+
+def publish_row_changes(table_name: str, changes: List[tuple]):
+    """
+    Publica los cambios de filas de una escritura confirmada en el bus de invalidación
+    del proceso (LocalBroker), en las mismas tablas que notify_cache_invalidation.
+
+    Args:
+        table_name: Nombre de la tabla
+        changes: Lista de (operación, ID de la fila) con operación INSERT, UPDATE o DELETE
+    """
+    if table_name not in TABLE_CONTEXT_FIELDS or not changes:
+        return
+    bus = get_invalidation_bus()
+    # Con LISTEN/NOTIFY los eventos los publica la base de datos, no el proceso
+    if bus is None or not hasattr(bus, "publish"):
+        return
+    for operation, row_id in changes:
+        bus.publish(table_name, operation, row_id)
+
+
+# ----- FILTROS -----
+
+class Condition:
+    """Condición sobre una columna: (columna, operador, valor, negada)"""
+
+    __slots__ = ("column", "operator", "value", "negated")
+
+    def __init__(self, column, operator, value, negated=False):
+        self.column = column
+        self.operator = operator
+        self.value = value
+        self.negated = negated
+
+
+class BooleanGroup:
+    """Conjunción o disyunción de condiciones (filtros `or_` y `and(...)`)"""
+
+    __slots__ = ("operator", "items", "negated")
+
+    def __init__(self, operator, items, negated=False):
+        self.operator = operator
+        self.items = items
+        self.negated = negated
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Separa por comas fuera de paréntesis y de comillas"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _parse_value(operator: str, raw: str):
+    """Convierte el valor textual de un filtro de PostgREST"""
+    if operator == "in":
+        inner = raw.strip()
+        if inner.startswith("(") and inner.endswith(")"):
+            inner = inner[1:-1]
+        return [_unquote(item) for item in _split_top_level(inner)]
+    if operator == "is":
+        lowered = raw.strip().lower()
+        return {"null": None, "true": True, "false": False}.get(lowered, raw)
+    return _unquote(raw)
+
+
+def _unquote(raw: str) -> str:
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == '"' and raw[-1] == '"':
+        return raw[1:-1].replace('\\"', '"')
+    return raw
+
+
+def parse_logic_tree(operator: str, text: str) -> BooleanGroup:
+    """
+    Interpreta un filtro lógico de PostgREST, p. ej. el de `or_`:
+    `created_at.gt."2025-01-01",and(created_at.eq."2025-01-01",id.gt."abc")`
+
+    Args:
+        operator: "or" o "and"
+        text: Condiciones separadas por comas
+
+    Returns:
+        Grupo de condiciones
+    """
+    items = []
+    for part in _split_top_level(text):
+        match = re.match(r"^(not\.)?(and|or)\((.*)\)$", part, re.S)
+        if match:
+            group = parse_logic_tree(match.group(2), match.group(3))
+            group.negated = bool(match.group(1))
+            items.append(group)
+            continue
+        pieces = part.split(".", 2)
+        if len(pieces) < 3:
+            raise query_error(f"Filtro inválido: {part!r}")
+        column, op, raw = pieces
+        negated = False
+        if op == "not":
+            op, _, raw = raw.partition(".")
+            negated = True
+        items.append(Condition(column, op, _parse_value(op, raw), negated))
+    return BooleanGroup(operator, items)
+
+
+def _comparable(stored, value):
+    """Convierte el valor del filtro al tipo de la columna almacenada"""
+    if isinstance(stored, bool):
+        if isinstance(value, str):
+            return value.strip().lower() in ("true", "t", "1")
+        return bool(value)
+    if isinstance(stored, (int, float)) and isinstance(value, str):
+        try:
+            return type(stored)(value)
+        except ValueError:
+            return value
+    if isinstance(stored, str) and not isinstance(value, str) and value is not None:
+        return str(value)
+    return value
+
+
+def _like_pattern(pattern: str, flags=0):
+    regex = re.escape(pattern).replace("%", ".*").replace("_", ".").replace(r"\*", ".*")
+    return re.compile(f"^{regex}$", flags | re.S)
+
+
+def evaluate(node, row: Dict) -> bool:
+    """Evalúa una condición o un grupo de condiciones sobre una fila"""
+    if isinstance(node, BooleanGroup):
+        results = (evaluate(item, row) for item in node.items)
+        result = any(results) if node.operator == "or" else all(results)
+        return not result if node.negated else result
+
+    stored = row.get(node.column)
+    operator, value = node.operator, node.value
+    if operator == "is":
+        result = stored is value if value in (None, True, False) else stored == value
+    elif stored is None:
+        # Semántica de SQL: cualquier comparación con NULL es falsa (también negada)
+        return False
+    elif operator == "in":
+        result = stored in [_comparable(stored, item) for item in value]
+    else:
+        value = _comparable(stored, value)
+        if operator == "eq":
+            result = stored == value
+        elif operator == "neq":
+            result = stored != value
+        elif operator in ("gt", "gte", "lt", "lte"):
+            try:
+                if operator == "gt":
+                    result = stored > value
+                elif operator == "gte":
+                    result = stored >= value
+                elif operator == "lt":
+                    result = stored < value
+                else:
+                    result = stored <= value
+            except TypeError:
+                result = False
+        elif operator == "like":
+            result = bool(_like_pattern(str(value)).match(str(stored)))
+        elif operator == "ilike":
+            result = bool(_like_pattern(str(value), re.I).match(str(stored)))
+        else:
+            raise query_error(f"Operador no soportado: {operator}")
+    return not result if node.negated else result
+
+
+# ----- CONSULTA -----
+
+class LocalResponse:
+    """Respuesta con la misma forma que la de postgrest-py (data y count)"""
+
+    def __init__(self, data=None, count=None):
+        self.data = data if data is not None else []
+        self.count = count
+
+    def __repr__(self):
+        return f"LocalResponse(data={self.data!r}, count={self.count!r})"
+
+
+class LocalQuery:
+    """
+    Consulta construida con la API fluida de postgrest-py y ejecutada por un backend
+    local (`backend.execute(query)`).
+    """
+
+    def __init__(self, backend, table_name: str):
+        self.backend = backend
+        self.table_name = table_name
+        self.schema = get_table_schema(table_name)
+        self.operation = "select"
+        self.columns = None
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.conditions: List[Any] = []
+        self.orders: List[tuple] = []
+        self.row_limit: Optional[int] = None
+        self.row_offset = 0
+        self.single_row = None
+
+    # ---- OPERACIONES ----
+
+    def select(self, *columns, count=None):
+        self.operation = "select"
+        names = []
+        for column in columns:
+            names.extend(name.strip() for name in str(column).split(",") if name.strip())
+        self.columns = None if not names or "*" in names else names
+        self.count = count
+        return self
+
+    def insert(self, data, count=None, returning=None, upsert=False, default_to_null=True):
+        self.operation = "insert"
+        self.payload = data
+        self.count = count
+        return self
+
+    def upsert(self, data, on_conflict="", ignore_duplicates=False, count=None, returning=None,
+               default_to_null=True):
+        self.operation = "upsert"
+        self.payload = data
+        self.on_conflict = [column.strip() for column in (on_conflict or "").split(",") if column.strip()]
+        self.ignore_duplicates = ignore_duplicates
+        self.count = count
+        return self
+
+    def update(self, data, count=None, returning=None):
+        self.operation = "update"
+        self.payload = data
+        self.count = count
+        return self
+
+    def delete(self, count=None, returning=None):
+        self.operation = "delete"
+        self.count = count
+        return self
+
+    # ---- FILTROS ----
+
+    def _add(self, column, operator, value, negated=False):
+        self.conditions.append(Condition(column, operator, value, negated))
+        return self
+
+    def eq(self, column, value):
+        return self._add(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._add(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._add(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._add(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._add(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._add(column, "lte", value)
+
+    def like(self, column, pattern):
+        return self._add(column, "like", pattern)
+
+    def ilike(self, column, pattern):
+        return self._add(column, "ilike", pattern)
+
+    def is_(self, column, value):
+        if isinstance(value, str):
+            value = {"null": None, "true": True, "false": False}.get(value.lower(), value)
+        return self._add(column, "is", value)
+
+    def in_(self, column, values):
+        return self._add(column, "in", list(values))
+
+    def match(self, query: Dict):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    def filter(self, column, operator, criteria):
+        negated = operator.startswith("not.")
+        operator = operator[4:] if negated else operator
+        return self._add(column, operator, _parse_value(operator, str(criteria)), negated)
+
+    def or_(self, filters: str, reference_table=None):
+        self.conditions.append(parse_logic_tree("or", filters))
+        return self
+
+    # ---- MODIFICADORES ----
+
+    def order(self, column, desc=False, nullsfirst=None, foreign_table=None):
+        self.orders.append((column, desc, nullsfirst))
+        return self
+
+    def limit(self, size, foreign_table=None):
+        self.row_limit = size
+        return self
+
+    def offset(self, size):
+        self.row_offset = size
+        return self
+
+    def range(self, start, end, foreign_table=None):
+        self.row_offset = start
+        self.row_limit = end - start + 1
+        return self
+
+    def single(self):
+        self.single_row = "single"
+        return self
+
+    def maybe_single(self):
+        self.single_row = "maybe_single"
+        return self
+
+    # ---- EJECUCIÓN ----
+
+    def equality_filters(self) -> Dict[str, Any]:
+        """Columnas con filtro de igualdad en el nivel superior (para elegir un índice)"""
+        return {
+            condition.column: condition.value
+            for condition in self.conditions
+            if isinstance(condition, Condition) and condition.operator == "eq" and not condition.negated
+        }
+
+    def matches(self, row: Dict) -> bool:
+        """Indica si una fila cumple todos los filtros"""
+        return all(evaluate(condition, row) for condition in self.conditions)
+
+    def normalized_filter_values(self):
+        """Normaliza los valores de los filtros sobre columnas de fecha"""
+        def normalize(node):
+            if isinstance(node, BooleanGroup):
+                for item in node.items:
+                    normalize(item)
+            elif node.column in self.schema.timestamps and node.operator not in ("is", "like", "ilike"):
+                if node.operator == "in":
+                    node.value = [normalize_timestamp(item) for item in node.value]
+                else:
+                    node.value = normalize_timestamp(node.value)
+        for condition in self.conditions:
+            normalize(condition)
+
+    def sort(self, rows: List[Dict]) -> List[Dict]:
+        """Ordena las filas según los `order` (NULL al final en ASC y al inicio en DESC)"""
+        for column, desc, nullsfirst in reversed(self.orders):
+            nulls_first = desc if nullsfirst is None else nullsfirst
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            present.sort(key=lambda row: row[column], reverse=desc)
+            rows = missing + present if nulls_first else present + missing
+        return rows
+
+    def paginate(self, rows: List[Dict]) -> List[Dict]:
+        """Aplica offset y límite"""
+        if self.row_offset:
+            rows = rows[self.row_offset:]
+        if self.row_limit is not None:
+            rows = rows[:max(self.row_limit, 0)]
+        return rows
+
+    def project(self, rows: List[Dict]) -> List[Dict]:
+        """Copia las filas con las columnas seleccionadas"""
+        if self.columns is None or self.operation != "select":
+            return [dict(row) for row in rows]
+        return [{column: row.get(column) for column in self.columns} for row in rows]
+
+    def respond(self, rows: List[Dict], total: Optional[int] = None) -> LocalResponse:
+        """Construye la respuesta (con single/maybe_single y count)"""
+        data = self.project(rows)
+        count = (total if total is not None else len(data)) if self.count else None
+        if self.single_row:
+            if len(data) > 1 or (self.single_row == "single" and not data):
+                raise APIError({
+                    "code": "PGRST116",
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                    "details": f"The result contains {len(data)} rows",
+                    "hint": None
+                })
+            return LocalResponse(data[0] if data else None, count)
+        return LocalResponse(data, count)
+
+    def execute(self) -> LocalResponse:
+        self.normalized_filter_values()
+        return self.backend.execute(self)
+
+
+class AsyncLocalQuery(LocalQuery):
+    """Consulta local cuyo execute() es una corrutina, como en el cliente asíncrono"""
+
+    async def execute(self):
+        return LocalQuery.execute(self)
+
+
+class LocalClient:
+    """Cliente con la API de tablas de supabase-py sobre un backend local"""
+
+    query_class = LocalQuery
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def table(self, table_name: str):
+        return self.query_class(self.backend, table_name)
+
+    def from_(self, table_name: str):
+        return self.table(table_name)
+
+
+class AsyncLocalClient(LocalClient):
+    """Cliente local para db_operations.aio (execute() es una corrutina)"""
+
+    query_class = AsyncLocalQuery
@@ -16,12 +16,10 @@ from langgraph.prebuilt import create_react_agent
 from langgraph.prebuilt.chat_agent_executor import AgentState
 from langgraph.checkpoint.memory import InMemorySaver
 from langsmith import Client
+from utils.logging_setup import configure_logging
 
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Configuración de timeout (60 segundos)
@@ -43,9 +41,7 @@ from db_operations import (
     get_or_create_lead_qualification,
     update_lead_qualification,
     create_or_update_bant_data,
-    get_or_create_requirements,
-    add_feature,
-    add_integration,
+    save_lead_requirements,
     create_meeting,
     update_meeting_status,
     get_meeting_by_outlook_id,
@@ -456,27 +452,15 @@ def save_requirements(app_type: str, core_features: str, integrations: str, dead
                 # Obtener calificación de lead
                 qualification = get_lead_qualification(user["id"], conversation["id"])
                 if qualification:
-                    # Crear requerimientos
-                    requirements = get_or_create_requirements(
+                    # Crear requerimientos y, a la vez, características, integraciones y estado
+                    save_lead_requirements(
                         qualification["id"],
                         app_type=app_type,
-                        deadline=deadline
+                        deadline=deadline,
+                        features=core_features.split(','),
+                        integrations=integrations.split(','),
+                        next_step="meeting"
                     )
-                    
-                    # Procesar características
-                    features_list = [f.strip() for f in core_features.split(',') if f.strip()]
-                    for feature in features_list:
-                        add_feature(requirements["id"], feature)
-                    
-                    # Procesar integraciones
-                    integrations_list = [i.strip() for i in integrations.split(',') if i.strip()]
-                    for integration in integrations_list:
-                        add_integration(requirements["id"], integration)
-                    
-                    # Actualizar estado
-                    update_lead_qualification(qualification["id"], {
-                        "current_step": "meeting"
-                    })
     
     return format_response(f"Requerimientos guardados: Tipo: {app_type}, Características: {core_features}, Integraciones: {integrations}, Fecha límite: {deadline}", "requirements")
 
@@ -497,7 +481,7 @@ def get_available_slots(preferred_date: Optional[str] = None) -> str:
         current_year = today.year
         
         # Log para depuración
-        logger.info(f"Fecha actual: {today.strftime('%Y-%m-%d %H:%M:%S')} (Año: {current_year})")
+        logger.debug("Fecha actual: %s (Año: %s)", today.strftime('%Y-%m-%d %H:%M:%S'), current_year)
         
         # Fecha mínima para agendar (48 horas después de hoy)
         min_date = today + datetime.timedelta(days=2)
@@ -0,0 +1,363 @@
+"""
+Base de datos en memoria para el cliente mock de Supabase.
+
+Ejecuta las consultas de local_query.py sobre tablas en memoria con la semántica
+de Postgres que usa db_operations:
+
+- Restricciones UNIQUE del esquema (violaciones con el código 23505), con NULL
+  sin conflicto, y upsert con `on_conflict` / `ignore_duplicates`.
+- Índices hash sobre la clave primaria, las restricciones UNIQUE y las columnas de
+  TABLE_SCHEMAS.indexes. Una consulta con igualdad (`eq` o `in_`) sobre una columna
+  indexada solo recorre las filas de ese índice; el resto de filtros, el orden y la
+  paginación se aplican sobre esas filas.
+- Escrituras atómicas por sentencia: si una fila de un insert múltiple viola una
+  restricción no se escribe ninguna.
+- Cada escritura publica sus filas en el bus de invalidación local (ver
+  `publish_row_changes`), como los triggers de la base de datos.
+
+Cada tabla tiene su propio lock, así que se puede usar desde varios hilos (dispatcher,
+outbound_sender, pool de workers en modo "thread"). Los datos viven en el proceso.
+"""
+
+import copy
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from local_query import (
+    LocalQuery, get_table_schema, new_row, normalize_row, publish_row_changes, unique_violation, query_error
+)
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def _index_key(value):
+    """Clave de un valor en los índices hash (los filtros llegan a veces como texto)"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _copy_row(row: Dict) -> Dict:
+    """Copia una fila sin compartir listas ni diccionarios anidados"""
+    return {
+        column: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        for column, value in row.items()
+    }
+
+
+class MemoryTable:
+    """Filas de una tabla con sus índices"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.schema = get_table_schema(name)
+        self.primary_key = self.schema.primary_key
+        # Clave primaria -> fila, en orden de inserción
+        self.rows: Dict[str, Dict] = {}
+        # Restricción UNIQUE -> {valores: clave primaria}
+        self.unique = {columns: {} for columns in self.schema.unique}
+        # Columna indexada -> {valor: {claves primarias}}
+        self.indexes = {column: {} for column in self.schema.indexes}
+        # Clave primaria -> número de inserción (orden de las filas de un índice)
+        self.sequence: Dict[str, int] = {}
+        self._next_sequence = 0
+        self.lock = threading.RLock()
+        self.stats = {"index_lookups": 0, "full_scans": 0}
+
+    # ---- ÍNDICES ----
+
+    def _unique_key(self, columns, row):
+        """Valores de una restricción UNIQUE; None si alguno es NULL (no hay conflicto)"""
+        values = tuple(_index_key(row.get(column)) for column in columns)
+        return None if None in values else values
+
+    def _add_to_indexes(self, row):
+        pk = row[self.primary_key]
+        for columns, entries in self.unique.items():
+            key = self._unique_key(columns, row)
+            if key is not None:
+                entries[key] = pk
+        for column, entries in self.indexes.items():
+            entries.setdefault(_index_key(row.get(column)), set()).add(pk)
+
+    def _remove_from_indexes(self, row):
+        pk = row[self.primary_key]
+        for columns, entries in self.unique.items():
+            key = self._unique_key(columns, row)
+            if key is not None and entries.get(key) == pk:
+                del entries[key]
+        for column, entries in self.indexes.items():
+            value = _index_key(row.get(column))
+            bucket = entries.get(value)
+            if bucket is not None:
+                bucket.discard(pk)
+                if not bucket:
+                    del entries[value]
+
+    def _check_unique(self, rows: List[Dict], replaced=()):
+        """
+        Verifica que las filas a escribir no violen la clave primaria ni las UNIQUE.
+
+        Args:
+            rows: Filas tal como quedarían escritas
+            replaced: Claves primarias de las filas que estas reemplazan (update/upsert)
+
+        Raises:
+            APIError: Con el código 23505 si hay un duplicado
+        """
+        replaced = set(replaced)
+        seen_pks = set()
+        for row in rows:
+            pk = _index_key(row.get(self.primary_key))
+            if pk is None:
+                raise query_error(
+                    f'null value in column "{self.primary_key}" of relation "{self.name}"', code="23502"
+                )
+            if pk in seen_pks or (pk in self.rows and pk not in replaced):
+                raise unique_violation(self.name, (self.primary_key,), (pk,))
+            seen_pks.add(pk)
+
+        for columns, entries in self.unique.items():
+            seen = set()
+            for row in rows:
+                key = self._unique_key(columns, row)
+                if key is None:
+                    continue
+                owner = entries.get(key)
+                if key in seen or (owner is not None and owner not in replaced):
+                    raise unique_violation(self.name, columns, key)
+                seen.add(key)
+
+    # ---- LECTURA ----
+
+    def _candidates(self, query: LocalQuery) -> List[Dict]:
+        """
+        Filas que pueden cumplir los filtros: por clave primaria, por una restricción
+        UNIQUE cubierta por igualdades o por el índice más selectivo; si no, todas.
+        """
+        equalities = query.equality_filters()
+        in_filters = {
+            condition.column: condition.value for condition in query.conditions
+            if getattr(condition, "operator", None) == "in" and not condition.negated
+        }
+
+        if self.primary_key in equalities:
+            self.stats["index_lookups"] += 1
+            row = self.rows.get(_index_key(equalities[self.primary_key]))
+            return [row] if row is not None else []
+        if self.primary_key in in_filters:
+            self.stats["index_lookups"] += 1
+            keys = dict.fromkeys(_index_key(value) for value in in_filters[self.primary_key])
+            return [self.rows[key] for key in keys if key in self.rows]
+
+        for columns, entries in self.unique.items():
+            if all(column in equalities for column in columns):
+                self.stats["index_lookups"] += 1
+                key = tuple(_index_key(equalities[column]) for column in columns)
+                pk = entries.get(key)
+                return [self.rows[pk]] if pk is not None else []
+            if len(columns) == 1 and columns[0] in in_filters:
+                self.stats["index_lookups"] += 1
+                pks = dict.fromkeys(entries.get((_index_key(value),)) for value in in_filters[columns[0]])
+                return [self.rows[pk] for pk in pks if pk is not None]
+
+        best = None
+        for column, entries in self.indexes.items():
+            if column in equalities:
+                pks = entries.get(_index_key(equalities[column]), set())
+            elif column in in_filters:
+                pks = set()
+                for value in in_filters[column]:
+                    pks |= entries.get(_index_key(value), set())
+            else:
+                continue
+            if best is None or len(pks) < len(best):
+                best = pks
+        if best is not None:
+            self.stats["index_lookups"] += 1
+            # Mantener el orden de inserción, como el recorrido completo
+            if len(best) * 4 < len(self.rows):
+                return [self.rows[pk] for pk in sorted(best, key=self.sequence.__getitem__)]
+            return [row for pk, row in self.rows.items() if pk in best]
+
+        self.stats["full_scans"] += 1
+        return list(self.rows.values())
+
+    def find(self, query: LocalQuery) -> List[Dict]:
+        """Filas que cumplen los filtros (sin copiar)"""
+        return [row for row in self._candidates(query) if query.matches(row)]
+
+    # ---- OPERACIONES ----
+
+    def select(self, query: LocalQuery):
+        rows = query.sort(self.find(query))
+        total = len(rows)
+        return query.respond(query.paginate(rows), total)
+
+    def insert(self, query: LocalQuery):
+        rows = [new_row(self.schema, values) for values in _payload_rows(query)]
+        self._check_unique(rows)
+        for row in rows:
+            self._store(row)
+        return query.respond(rows), [("INSERT", row[self.primary_key]) for row in rows]
+
+    def upsert(self, query: LocalQuery):
+        conflict_columns = tuple(query.on_conflict or (self.primary_key,))
+        if conflict_columns != (self.primary_key,) and conflict_columns not in self.unique:
+            raise query_error(
+                "there is no unique or exclusion constraint matching the ON CONFLICT specification",
+                code="42P10"
+            )
+
+        inserted, updated, replaced = [], [], []
+        for values in _payload_rows(query):
+            key = tuple(_index_key(values.get(column)) for column in conflict_columns)
+            if conflict_columns == (self.primary_key,):
+                existing = self.rows.get(key[0])
+            else:
+                existing = self.rows.get(self.unique[conflict_columns].get(key))
+            if existing is None:
+                inserted.append(new_row(self.schema, values))
+            elif not query.ignore_duplicates:
+                # ON CONFLICT DO UPDATE: solo cambian las columnas enviadas
+                row = dict(existing)
+                row.update(normalize_row(self.schema, values))
+                row[self.primary_key] = existing[self.primary_key]
+                updated.append(row)
+                replaced.append(existing[self.primary_key])
+
+        self._check_unique(inserted + updated, replaced)
+        for row in updated:
+            self._replace(row)
+        for row in inserted:
+            self._store(row)
+        changes = [("UPDATE", row[self.primary_key]) for row in updated]
+        changes += [("INSERT", row[self.primary_key]) for row in inserted]
+        return query.respond(updated + inserted), changes
+
+    def update(self, query: LocalQuery):
+        if not isinstance(query.payload, dict):
+            raise query_error("update espera un diccionario con las columnas a cambiar")
+        changes = normalize_row(self.schema, query.payload)
+        matched = self.find(query)
+        rows = []
+        for existing in matched:
+            row = dict(existing)
+            row.update(changes)
+            rows.append(row)
+        self._check_unique(rows, [row[self.primary_key] for row in matched])
+        for row in rows:
+            self._replace(row)
+        return query.respond(query.sort(rows)), [("UPDATE", row[self.primary_key]) for row in rows]
+
+    def delete(self, query: LocalQuery):
+        rows = self.find(query)
+        for row in rows:
+            self._remove_from_indexes(row)
+            pk = _index_key(row[self.primary_key])
+            del self.rows[pk]
+            del self.sequence[pk]
+        return query.respond(query.sort(rows)), [("DELETE", row[self.primary_key]) for row in rows]
+
+    def _store(self, row):
+        row = _copy_row(row)
+        row[self.primary_key] = _index_key(row[self.primary_key])
+        self.rows[row[self.primary_key]] = row
+        self.sequence[row[self.primary_key]] = self._next_sequence
+        self._next_sequence += 1
+        self._add_to_indexes(row)
+
+    def _replace(self, row):
+        pk = _index_key(row[self.primary_key])
+        self._remove_from_indexes(self.rows[pk])
+        row = _copy_row(row)
+        self.rows[pk] = row
+        self._add_to_indexes(row)
+
+
+def _payload_rows(query: LocalQuery) -> List[Dict]:
+    payload = query.payload
+    if isinstance(payload, dict):
+        return [payload]
+    if isinstance(payload, list) and all(isinstance(row, dict) for row in payload):
+        return payload
+    raise query_error(f"Datos inválidos para {query.operation} en '{query.table_name}'")
+
+
+class InMemoryDatabase:
+    """
+    Conjunto de tablas en memoria; es el backend de las consultas de MockSupabaseClient.
+    """
+
+    def __init__(self):
+        self._tables: Dict[str, MemoryTable] = {}
+        self._lock = threading.Lock()
+
+    def table(self, table_name: str) -> LocalQuery:
+        """Inicia una consulta sobre una tabla (misma API que supabase.table)"""
+        return LocalQuery(self, table_name)
+
+    def _get_table(self, table_name: str) -> MemoryTable:
+        table = self._tables.get(table_name)
+        if table is None:
+            with self._lock:
+                table = self._tables.setdefault(table_name, MemoryTable(table_name))
+        return table
+
+    def execute(self, query: LocalQuery):
+        """Ejecuta una consulta construida con LocalQuery"""
+        table = self._get_table(query.table_name)
+        with table.lock:
+            if query.operation == "select":
+                return table.select(query)
+            if query.operation == "insert":
+                response, changes = table.insert(query)
+            elif query.operation == "upsert":
+                response, changes = table.upsert(query)
+            elif query.operation == "update":
+                response, changes = table.update(query)
+            elif query.operation == "delete":
+                response, changes = table.delete(query)
+            else:
+                raise query_error(f"Operación no soportada: {query.operation}")
+        # Fuera del lock: los suscriptores pueden volver a consultar la tabla
+        publish_row_changes(query.table_name, changes)
+        return response
+
+    def clear(self, table_name: Optional[str] = None):
+        """Vacía una tabla o toda la base de datos"""
+        with self._lock:
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+    def get_stats(self):
+        """Retorna por tabla el número de filas, búsquedas por índice y recorridos completos"""
+        with self._lock:
+            tables = list(self._tables.values())
+        stats = {}
+        for table in tables:
+            with table.lock:
+                stats[table.name] = dict(table.stats, rows=len(table.rows))
+        return stats
+
+
+# Base de datos compartida por todos los clientes mock del proceso
+_memory_database = None
+_memory_database_lock = threading.Lock()
+
+
+def get_memory_database() -> InMemoryDatabase:
+    """Retorna la base de datos en memoria del proceso"""
+    global _memory_database
+    if _memory_database is None:
+        with _memory_database_lock:
+            if _memory_database is None:
+                _memory_database = InMemoryDatabase()
+                logger.info("Base de datos en memoria inicializada")
+    return _memory_database
@@ -0,0 +1,39 @@
+-- Migración 001: índices para las consultas más frecuentes del bot.
+--
+-- Lleva una base existente al mismo conjunto de índices que supabase_schema.sql.
+-- Usa CREATE/DROP INDEX CONCURRENTLY para no bloquear escrituras, así que cada
+-- sentencia debe ejecutarse fuera de una transacción (psql en modo autocommit o
+-- scripts/benchmark_indexes.py, que la aplica sentencia por sentencia).
+--
+-- Rutas de acceso cubiertas (ver db_operations):
+--   get_user_by_phone          users(phone)                        UNIQUE existente
+--   get_active_conversation    conversations(platform, external_id) UNIQUE existente
+--   get_recent_messages        messages(conversation_id, created_at DESC)
+--   get_system_messages        messages(conversation_id, created_at) WHERE role = 'system'
+--   get_lead_qualification     lead_qualification(user_id, conversation_id) UNIQUE existente
+--   get_meeting_by_outlook_id  meetings(outlook_meeting_id) WHERE outlook_meeting_id IS NOT NULL
+--   get_user_meetings          meetings(user_id, start_time)
+--
+-- messages.content no se incluye en ningún índice: es TEXT sin límite y una fila
+-- larga superaría el tamaño máximo de una entrada de B-tree.
+
+-- Historial: últimos mensajes de una conversación (orden descendente con límite)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_created_at
+    ON messages(conversation_id, created_at DESC);
+
+-- Mensajes de sistema de una conversación (uno o dos por conversación)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_system
+    ON messages(conversation_id, created_at) WHERE role = 'system';
+
+-- El índice compuesto ya cubre las búsquedas solo por conversation_id
+DROP INDEX CONCURRENTLY IF EXISTS idx_messages_conversation_id;
+
+-- Reuniones por ID de Outlook (solo las que se sincronizaron con Outlook)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_meetings_outlook_meeting_id
+    ON meetings(outlook_meeting_id) WHERE outlook_meeting_id IS NOT NULL;
+
+-- Reuniones de un usuario ordenadas por fecha de inicio
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_meetings_user_start_time
+    ON meetings(user_id, start_time);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_meetings_user_id;
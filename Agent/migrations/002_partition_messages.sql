@@ -0,0 +1,287 @@
+-- Migración 002: particionado mensual de messages y registro de IDs externos.
+--
+-- Convierte una tabla messages existente (sin particionar) a la estructura de
+-- supabase_schema.sql: tabla particionada por mes de created_at, partición por
+-- defecto, message_external_ids para la unicidad de external_id (mantenida por
+-- trigger) y las funciones de mantenimiento create_message_partitions y
+-- drop_empty_message_partitions. Si messages ya está particionada solo se
+-- actualizan las funciones.
+--
+-- La conversión copia todas las filas dentro de una transacción y bloquea
+-- messages mientras dura: ejecutarla en una ventana de mantenimiento. La tabla
+-- original queda como messages_unpartitioned; eliminarla tras verificar los datos:
+--   DROP TABLE messages_unpartitioned;
+
+-- Mantiene message_external_ids: registra el ID externo de cada mensaje nuevo (o el
+-- asignado al enviar un mensaje saliente) y falla con unique_violation si ya existe.
+CREATE OR REPLACE FUNCTION register_message_external_id() RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.external_id IS NOT DISTINCT FROM OLD.external_id THEN
+            RETURN NEW;
+        END IF;
+        IF OLD.external_id IS NOT NULL THEN
+            DELETE FROM message_external_ids WHERE external_id = OLD.external_id;
+        END IF;
+    END IF;
+
+    IF NEW.external_id IS NOT NULL THEN
+        INSERT INTO message_external_ids (external_id, message_id, created_at)
+        VALUES (NEW.external_id, NEW.id, NEW.created_at);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+-- Crea las particiones mensuales de messages desde el mes de p_from hasta
+-- p_months_ahead meses después del actual. Se ejecuta periódicamente
+-- (scripts/archive_messages.py o pg_cron) para que messages_default quede vacía.
+-- Retorna el número de particiones creadas.
+CREATE OR REPLACE FUNCTION create_message_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_from TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+) RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', LEAST(p_from, NOW()))::DATE;
+    v_last DATE := (date_trunc('month', NOW()) + make_interval(months => p_months_ahead))::DATE;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= v_last LOOP
+        v_name := 'messages_' || to_char(v_month, 'YYYY_MM');
+        IF to_regclass(v_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_month, (v_month + INTERVAL '1 month')::DATE
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Elimina las particiones mensuales vacías (ya archivadas) que terminan antes de p_before.
+-- Retorna el número de particiones eliminadas.
+CREATE OR REPLACE FUNCTION drop_empty_message_partitions(p_before TIMESTAMP WITH TIME ZONE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_partition RECORD;
+    v_is_empty BOOLEAN;
+    v_dropped INTEGER := 0;
+BEGIN
+    FOR v_partition IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages' AND child.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(substr(v_partition.relname, 10), 'YYYY_MM') + INTERVAL '1 month' > p_before THEN
+            CONTINUE;
+        END IF;
+        EXECUTE format('SELECT NOT EXISTS (SELECT 1 FROM %I)', v_partition.relname) INTO v_is_empty;
+        IF v_is_empty THEN
+            EXECUTE format('DROP TABLE %I', v_partition.relname);
+            v_dropped := v_dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN v_dropped;
+END;
+$$;
+
+DO $$
+DECLARE
+    v_oldest TIMESTAMP WITH TIME ZONE;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'messages' AND relkind = 'p') THEN
+        RETURN;
+    END IF;
+
+    -- Columnas de entrega de los mensajes salientes, por si la base es anterior a ellas
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS delivery_status VARCHAR;
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS delivery_error TEXT;
+
+    ALTER TABLE messages RENAME TO messages_unpartitioned;
+    ALTER INDEX IF EXISTS idx_messages_conversation_created_at RENAME TO idx_messages_unpartitioned_conversation_created_at;
+    ALTER INDEX IF EXISTS idx_messages_conversation_system RENAME TO idx_messages_unpartitioned_conversation_system;
+    ALTER INDEX IF EXISTS idx_messages_conversation_id RENAME TO idx_messages_unpartitioned_conversation_id;
+
+    CREATE TABLE messages (
+        id UUID NOT NULL DEFAULT uuid_generate_v4(),
+        conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
+        role VARCHAR NOT NULL,
+        content TEXT NOT NULL,
+        message_type VARCHAR NOT NULL DEFAULT 'text',
+        media_url VARCHAR,
+        external_id VARCHAR,
+        delivery_status VARCHAR,
+        delivery_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+    CREATE INDEX idx_messages_conversation_created_at ON messages(conversation_id, created_at DESC);
+    CREATE INDEX idx_messages_conversation_system ON messages(conversation_id, created_at) WHERE role = 'system';
+
+    CREATE TABLE IF NOT EXISTS message_external_ids (
+        external_id VARCHAR PRIMARY KEY,
+        message_id UUID NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+    );
+    CREATE INDEX IF NOT EXISTS idx_message_external_ids_created_at ON message_external_ids(created_at);
+
+    ALTER TABLE messages ENABLE ROW LEVEL SECURITY;
+    ALTER TABLE message_external_ids ENABLE ROW LEVEL SECURITY;
+    CREATE POLICY "Acceso completo con clave de servicio" ON messages
+        USING (auth.role() = 'service_role');
+    CREATE POLICY "Acceso completo con clave de servicio" ON message_external_ids
+        USING (auth.role() = 'service_role');
+
+    -- Particiones desde el mes del mensaje más antiguo
+    SELECT COALESCE(MIN(created_at), NOW()) INTO v_oldest FROM messages_unpartitioned;
+    PERFORM create_message_partitions(3, v_oldest);
+
+    -- Copiar los mensajes y su registro de IDs externos
+    INSERT INTO message_external_ids (external_id, message_id, created_at)
+    SELECT external_id, id, COALESCE(created_at, NOW())
+    FROM messages_unpartitioned
+    WHERE external_id IS NOT NULL
+    ON CONFLICT (external_id) DO NOTHING;
+
+    INSERT INTO messages (id, conversation_id, role, content, message_type, media_url, external_id,
+                          delivery_status, delivery_error, created_at)
+    SELECT id, conversation_id, role, content, message_type, media_url, external_id,
+           delivery_status, delivery_error, COALESCE(created_at, NOW())
+    FROM messages_unpartitioned;
+END;
+$$;
+
+-- El trigger se crea después de copiar los datos (su registro ya se copió arriba)
+CREATE OR REPLACE TRIGGER messages_register_external_id
+    BEFORE INSERT OR UPDATE OF external_id ON messages
+    FOR EACH ROW EXECUTE FUNCTION register_message_external_id();
+
+-- La deduplicación de la ingesta ahora depende del trigger y no de ON CONFLICT (external_id).
+-- Función para registrar mensajes entrantes en un solo viaje a la base de datos.
+-- En una transacción: resuelve el usuario (teléfono normalizado o sus formatos
+-- alternativos), obtiene o reactiva la conversación, siembra los mensajes de
+-- sistema y bienvenida si la conversación es nueva, guarda los mensajes
+-- (descartando entregas repetidas por external_id) y retorna el historial recortado.
+CREATE OR REPLACE FUNCTION ingest_inbound_message(
+    p_phone VARCHAR,
+    p_phone_candidates VARCHAR[],
+    p_messages JSONB,
+    p_platform VARCHAR DEFAULT 'whatsapp',
+    p_max_messages INTEGER DEFAULT 10,
+    p_system_message TEXT DEFAULT 'Iniciando conversación con un potencial cliente.',
+    p_welcome_message TEXT DEFAULT '¡Hola! Soy el asistente virtual de nuestra empresa de desarrollo de software. ¿En qué puedo ayudarte hoy?'
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user users%ROWTYPE;
+    v_conversation conversations%ROWTYPE;
+    v_is_new BOOLEAN;
+    v_message JSONB;
+    v_message_id UUID;
+    v_stored JSONB := '[]'::JSONB;
+    v_duplicates JSONB := '[]'::JSONB;
+    v_history JSONB := '[]'::JSONB;
+BEGIN
+    -- Serializar las ingestas concurrentes de un mismo teléfono
+    PERFORM pg_advisory_xact_lock(hashtext(p_phone));
+
+    -- Usuario: preferir el formato normalizado y luego los alternativos, en orden
+    SELECT * INTO v_user
+    FROM users
+    WHERE phone = ANY(p_phone_candidates)
+    ORDER BY array_position(p_phone_candidates, phone)
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+        INSERT INTO users (phone, full_name)
+        VALUES (p_phone, 'Usuario ' || p_phone)
+        ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
+        RETURNING * INTO v_user;
+    END IF;
+
+    -- Conversación activa (UNIQUE(platform, external_id): una cerrada se reactiva)
+    SELECT * INTO v_conversation
+    FROM conversations
+    WHERE external_id = p_phone AND platform = p_platform AND status = 'active';
+
+    IF NOT FOUND THEN
+        INSERT INTO conversations (user_id, external_id, platform, status)
+        VALUES (v_user.id, p_phone, p_platform, 'active')
+        ON CONFLICT (platform, external_id) DO UPDATE SET status = 'active', updated_at = NOW()
+        RETURNING * INTO v_conversation;
+    END IF;
+
+    -- clock_timestamp() (y no NOW(), fijo en la transacción) conserva el orden de inserción
+    v_is_new := NOT EXISTS (SELECT 1 FROM messages WHERE conversation_id = v_conversation.id);
+    IF v_is_new THEN
+        INSERT INTO messages (conversation_id, role, content, created_at)
+        VALUES (v_conversation.id, 'system', p_system_message, clock_timestamp());
+        INSERT INTO messages (conversation_id, role, content, created_at)
+        VALUES (v_conversation.id, 'assistant', p_welcome_message, clock_timestamp());
+    END IF;
+
+    FOR v_message IN SELECT * FROM jsonb_array_elements(COALESCE(p_messages, '[]'::JSONB)) LOOP
+        -- El trigger de message_external_ids lanza unique_violation si es una entrega repetida
+        BEGIN
+            INSERT INTO messages (conversation_id, role, content, message_type, external_id, created_at)
+            VALUES (
+                v_conversation.id,
+                'user',
+                v_message->>'content',
+                COALESCE(v_message->>'message_type', 'text'),
+                v_message->>'external_id',
+                clock_timestamp()
+            )
+            RETURNING id INTO v_message_id;
+
+            v_stored := v_stored || jsonb_build_array(
+                jsonb_build_object('id', v_message_id, 'external_id', v_message->>'external_id')
+            );
+        EXCEPTION WHEN unique_violation THEN
+            v_duplicates := v_duplicates || jsonb_build_array(v_message->>'external_id');
+        END;
+    END LOOP;
+
+    -- Historial: mensajes de sistema y los últimos p_max_messages mensajes no-sistema
+    IF jsonb_array_length(v_stored) > 0 THEN
+        SELECT COALESCE(
+            jsonb_agg(jsonb_build_object('role', h.role, 'content', h.content)
+                      ORDER BY (h.role <> 'system'), h.created_at),
+            '[]'::JSONB
+        )
+        INTO v_history
+        FROM (
+            (SELECT role, content, created_at FROM messages
+             WHERE conversation_id = v_conversation.id AND role = 'system')
+            UNION ALL
+            (SELECT role, content, created_at FROM messages
+             WHERE conversation_id = v_conversation.id AND role <> 'system'
+             ORDER BY created_at DESC
+             LIMIT p_max_messages)
+        ) h;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(v_user),
+        'conversation', to_jsonb(v_conversation),
+        'is_new_conversation', v_is_new,
+        'stored', v_stored,
+        'duplicates', v_duplicates,
+        'history', v_history
+    );
+END;
+$$;
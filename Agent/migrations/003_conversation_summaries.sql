@@ -0,0 +1,7 @@
+-- Migración 003: resumen acumulado por conversación (ver conversation_summary.py).
+--
+-- El agente recibe el resumen más los últimos mensajes, así el tamaño del prompt
+-- y el costo de leer el historial no crecen con la longitud de la conversación.
+
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_until TIMESTAMP WITH TIME ZONE;
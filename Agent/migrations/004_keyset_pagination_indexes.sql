@@ -0,0 +1,21 @@
+-- Migración 004: índices para la paginación por cursor (created_at, id).
+--
+-- Igual que la migración 001, usa CREATE INDEX CONCURRENTLY: cada sentencia debe
+-- ejecutarse fuera de una transacción.
+--
+-- Rutas de acceso cubiertas (ver db_operations):
+--   get_user_meetings_page          meetings(user_id, created_at, id)
+--   get_users_page                  users(created_at, id)
+--   get_conversation_messages_page  messages(conversation_id, created_at DESC) existente;
+--                                   el desempate por id solo afecta a mensajes con la
+--                                   misma fecha, así que basta con filtrarlo. No se crea
+--                                   otro índice porque messages está particionada y
+--                                   CONCURRENTLY no se admite sobre la tabla padre.
+
+-- Reuniones de un usuario en orden (created_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_meetings_user_created_at_id
+    ON meetings(user_id, created_at, id);
+
+-- Todos los usuarios en orden (created_at, id) (scripts de mantenimiento)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_created_at_id
+    ON users(created_at, id);
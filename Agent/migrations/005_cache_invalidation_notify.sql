@@ -0,0 +1,45 @@
+-- Migración 005: notificaciones de cambios de filas para invalidar las cachés de
+-- todos los procesos (ver cache_invalidation.py).
+--
+-- Los procesos escuchan el canal con LISTEN sobre una conexión directa a Postgres
+-- (CACHE_INVALIDATION_DATABASE_URL). Los triggers son idempotentes
+-- (CREATE OR REPLACE), así que la migración se puede volver a aplicar.
+
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_id UUID;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        v_id := OLD.id;
+    ELSE
+        v_id := NEW.id;
+    END IF;
+    PERFORM pg_notify(
+        'cache_invalidation',
+        json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', v_id)::TEXT
+    );
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER users_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER conversations_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON conversations
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER lead_qualification_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON lead_qualification
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER meetings_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON meetings
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
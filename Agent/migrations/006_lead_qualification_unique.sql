@@ -0,0 +1,99 @@
+-- Migración 006: restricciones UNIQUE de la calificación de leads.
+--
+-- db_operations crea la calificación, los datos BANT y los requerimientos con
+-- upsert (on_conflict), que necesita una restricción UNIQUE sobre las mismas
+-- columnas; sin ella PostgREST responde 42P10. supabase_schema.sql ya las tiene:
+--   lead_qualification UNIQUE(user_id, conversation_id)
+--   bant_data          UNIQUE(lead_qualification_id)
+--   requirements       UNIQUE(lead_qualification_id)
+--
+-- Antes de crearlas se eliminan los duplicados que dejaron las carreras del
+-- patrón leer-y-luego-insertar: se conserva la fila actualizada más recientemente
+-- y las filas que apuntaban a las descartadas pasan a apuntar a la conservada.
+-- Los nombres repetidos de features/integrations que esto pueda dejar se
+-- resuelven en la migración 007. Ejecutar en una sola transacción.
+
+BEGIN;
+
+-- ---- lead_qualification ----
+
+CREATE TEMP TABLE lead_qualification_duplicates ON COMMIT DROP AS
+SELECT id, keep_id
+FROM (
+    SELECT id,
+           first_value(id) OVER (
+               PARTITION BY user_id, conversation_id
+               ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST, id
+           ) AS keep_id
+    FROM lead_qualification
+    WHERE user_id IS NOT NULL AND conversation_id IS NOT NULL
+) ranked
+WHERE id <> keep_id;
+
+UPDATE meetings m SET lead_qualification_id = d.keep_id
+FROM lead_qualification_duplicates d WHERE m.lead_qualification_id = d.id;
+UPDATE bant_data b SET lead_qualification_id = d.keep_id
+FROM lead_qualification_duplicates d WHERE b.lead_qualification_id = d.id;
+UPDATE requirements r SET lead_qualification_id = d.keep_id
+FROM lead_qualification_duplicates d WHERE r.lead_qualification_id = d.id;
+
+DELETE FROM lead_qualification q
+USING lead_qualification_duplicates d WHERE q.id = d.id;
+
+-- ---- bant_data ----
+
+DELETE FROM bant_data b
+USING (
+    SELECT id,
+           row_number() OVER (
+               PARTITION BY lead_qualification_id
+               ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST, id
+           ) AS position
+    FROM bant_data
+    WHERE lead_qualification_id IS NOT NULL
+) ranked
+WHERE b.id = ranked.id AND ranked.position > 1;
+
+-- ---- requirements (sus features e integraciones pasan a la fila conservada) ----
+
+CREATE TEMP TABLE requirements_duplicates ON COMMIT DROP AS
+SELECT id, keep_id
+FROM (
+    SELECT id,
+           first_value(id) OVER (
+               PARTITION BY lead_qualification_id
+               ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST, id
+           ) AS keep_id
+    FROM requirements
+    WHERE lead_qualification_id IS NOT NULL
+) ranked
+WHERE id <> keep_id;
+
+UPDATE features f SET requirement_id = d.keep_id
+FROM requirements_duplicates d WHERE f.requirement_id = d.id;
+UPDATE integrations i SET requirement_id = d.keep_id
+FROM requirements_duplicates d WHERE i.requirement_id = d.id;
+
+DELETE FROM requirements r
+USING requirements_duplicates d WHERE r.id = d.id;
+
+-- ---- Restricciones ----
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'lead_qualification_user_id_conversation_id_key') THEN
+        ALTER TABLE lead_qualification
+            ADD CONSTRAINT lead_qualification_user_id_conversation_id_key UNIQUE (user_id, conversation_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bant_data_lead_qualification_id_key') THEN
+        ALTER TABLE bant_data
+            ADD CONSTRAINT bant_data_lead_qualification_id_key UNIQUE (lead_qualification_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'requirements_lead_qualification_id_key') THEN
+        ALTER TABLE requirements
+            ADD CONSTRAINT requirements_lead_qualification_id_key UNIQUE (lead_qualification_id);
+    END IF;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,65 @@
+-- Migración 007: nombres únicos de características e integraciones.
+--
+-- add_features / add_integrations insertan en lote con
+-- upsert(on_conflict="requirement_id,name", ignore_duplicates=True), que necesita
+-- UNIQUE(requirement_id, name) en features e integrations; sin ella PostgREST
+-- responde 42P10.
+--
+-- La regla es el nombre exacto (sin espacios alrededor), igual que la deduplicación
+-- de db_operations: un índice sobre lower(name) no puede ser el árbitro de un
+-- on_conflict de PostgREST, que solo admite columnas.
+--
+-- Antes de crearlas se eliminan los nombres repetidos de cada requerimiento (los
+-- dejados por las carreras del patrón leer-y-luego-insertar y por la migración 006),
+-- conservando el más antiguo. Ejecutar en una sola transacción.
+
+BEGIN;
+
+-- ---- features ----
+
+UPDATE features SET name = btrim(name) WHERE name <> btrim(name);
+
+DELETE FROM features f
+USING (
+    SELECT id,
+           row_number() OVER (
+               PARTITION BY requirement_id, name
+               ORDER BY created_at NULLS LAST, id
+           ) AS position
+    FROM features
+    WHERE requirement_id IS NOT NULL AND name IS NOT NULL
+) ranked
+WHERE f.id = ranked.id AND ranked.position > 1;
+
+-- ---- integrations ----
+
+UPDATE integrations SET name = btrim(name) WHERE name <> btrim(name);
+
+DELETE FROM integrations i
+USING (
+    SELECT id,
+           row_number() OVER (
+               PARTITION BY requirement_id, name
+               ORDER BY created_at NULLS LAST, id
+           ) AS position
+    FROM integrations
+    WHERE requirement_id IS NOT NULL AND name IS NOT NULL
+) ranked
+WHERE i.id = ranked.id AND ranked.position > 1;
+
+-- ---- Restricciones ----
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'features_requirement_id_name_key') THEN
+        ALTER TABLE features
+            ADD CONSTRAINT features_requirement_id_name_key UNIQUE (requirement_id, name);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'integrations_requirement_id_name_key') THEN
+        ALTER TABLE integrations
+            ADD CONSTRAINT integrations_requirement_id_name_key UNIQUE (requirement_id, name);
+    END IF;
+END;
+$$;
+
+COMMIT;
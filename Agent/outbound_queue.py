@@ -0,0 +1,312 @@
+"""
+Cola de envío de mensajes salientes de WhatsApp.
+
+Los workers del agente encolan la respuesta y continúan; la entrega la hacen
+hilos dedicados que:
+- respetan el throughput del número de WhatsApp Business con un token bucket,
+- conservan el orden de los mensajes de cada destinatario (un shard por destinatario),
+- reintentan los 429/5xx y los límites de Meta con backoff exponencial y jitter
+  (el reintento se programa con un temporizador, así el hilo sigue entregando
+  a los demás destinatarios de su shard mientras tanto),
+- registran el resultado de la entrega en la fila correspondiente de `messages`.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from db_operations import update_message_delivery
+from utils.dispatcher import SenderDispatcher
+from whatsapp_client import build_message_payload, get_whatsapp_client
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Throughput del número de WhatsApp Business (mensajes por segundo según el tier)
+WHATSAPP_THROUGHPUT_MPS = float(os.getenv("WHATSAPP_THROUGHPUT_MPS", 80))
+WHATSAPP_THROUGHPUT_BURST = float(os.getenv("WHATSAPP_THROUGHPUT_BURST", WHATSAPP_THROUGHPUT_MPS))
+
+# Política de reintentos
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 5))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", 1.0))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", 60.0))
+
+# Hilos de entrega y tamaño de cola por hilo
+OUTBOUND_WORKER_SHARDS = int(os.getenv("OUTBOUND_WORKER_SHARDS", 8))
+OUTBOUND_QUEUE_MAXSIZE = int(os.getenv("OUTBOUND_QUEUE_MAXSIZE", 1000))
+
+# Códigos de error de la Cloud API que indican límite de velocidad (se reintentan)
+RETRYABLE_ERROR_CODES = {4, 80007, 130429, 131056}
+
+
+class TokenBucket:
+    """
+    Limitador de velocidad: `rate` fichas por segundo con capacidad máxima `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity or rate))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens=1.0):
+        """Bloquea hasta que haya fichas disponibles y las consume"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def available(self):
+        """Retorna las fichas disponibles en este momento"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class OutboundSender:
+    """
+    Entrega asíncrona de mensajes de WhatsApp con límite de velocidad, reintentos y orden por destinatario.
+    """
+
+    def __init__(self, client=None, rate=None, burst=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, num_shards=None, max_queue_size=None):
+        """
+        Args:
+            client: Cliente de WhatsApp (por defecto el cliente compartido)
+            rate: Mensajes por segundo permitidos
+            burst: Capacidad del token bucket
+            max_retries: Reintentos máximos por mensaje
+            backoff_base: Espera base del backoff exponencial (segundos)
+            backoff_max: Espera máxima entre reintentos (segundos)
+            num_shards: Hilos de entrega
+            max_queue_size: Tamaño máximo de la cola de cada hilo
+        """
+        self.client = client or get_whatsapp_client()
+        self.bucket = TokenBucket(rate or WHATSAPP_THROUGHPUT_MPS, burst or WHATSAPP_THROUGHPUT_BURST)
+        self.max_retries = OUTBOUND_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = OUTBOUND_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = OUTBOUND_BACKOFF_MAX if backoff_max is None else backoff_max
+        self._dispatcher = SenderDispatcher(
+            num_shards=num_shards or OUTBOUND_WORKER_SHARDS,
+            max_queue_size=max_queue_size or OUTBOUND_QUEUE_MAXSIZE,
+            name="outbound"
+        )
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued": 0, "sent": 0, "failed": 0, "retries": 0}
+        # Destinatarios con un reintento programado -> mensajes que esperan detrás de él
+        self._parked: Dict[str, deque] = {}
+        self._parked_lock = threading.Lock()
+
+    def enqueue(self, to, message_type, content, caption=None, db_message_id=None) -> bool:
+        """
+        Encola un mensaje para su entrega.
+
+        Args:
+            to: Número de teléfono del destinatario
+            message_type: Tipo de mensaje (text, image, audio, video)
+            content: Contenido del mensaje (texto o URL)
+            caption: Pie de foto/video (opcional)
+            db_message_id: ID de la fila en `messages` donde registrar el resultado (opcional)
+
+        Returns:
+            True si el mensaje fue encolado, False si la cola estaba llena
+        """
+        job = {
+            "to": to,
+            "payload": build_message_payload(to, message_type, content, caption),
+            "db_message_id": db_message_id,
+            "queued_at": time.monotonic()
+        }
+        queued = self._dispatcher.submit(to, self._deliver, job)
+        if queued:
+            self._increment("queued")
+        elif db_message_id:
+            self._record_result(job, "failed", error="Cola de salida llena")
+        return queued
+
+    def set_rate(self, rate, burst=None):
+        """
+        Cambia el límite de velocidad (p. ej. para repartir el throughput entre procesos).
+
+        Args:
+            rate: Mensajes por segundo permitidos
+            burst: Capacidad del token bucket (por defecto igual a `rate`)
+        """
+        self.bucket = TokenBucket(rate, burst or rate)
+        logger.info(f"Límite de envío ajustado a {self.bucket.rate:.2f} mensajes/s")
+
+    def _deliver(self, job: Dict):
+        """
+        Entrega un mensaje y, después, los que esperaban detrás de él.
+
+        Si el destinatario tiene un reintento programado el mensaje queda aparcado
+        hasta que ese reintento termine, para conservar el orden de entrega.
+        """
+        to = job["to"]
+        with self._parked_lock:
+            if to in self._parked and not job.get("retrying"):
+                self._parked[to].append(job)
+                return
+
+        while job is not None:
+            if self._attempt(job):
+                # Reintento programado: los siguientes siguen aparcados
+                return
+            job = self._next_parked(to)
+
+    def _attempt(self, job: Dict) -> bool:
+        """
+        Hace un intento de entrega y programa el siguiente si el error es transitorio.
+
+        Returns:
+            True si quedó un reintento programado, False si el mensaje terminó (enviado o fallido)
+        """
+        attempt = job.get("attempt", 0)
+        if attempt:
+            self._increment("retries")
+
+        self.bucket.acquire()
+        retry_after = None
+        try:
+            response = self.client.post_message(job["payload"])
+            if response.status_code == 200:
+                data = response.json()
+                wamid = (data.get("messages") or [{}])[0].get("id")
+                self._increment("sent")
+                latency = time.monotonic() - job["queued_at"]
+                logger.info(f"Mensaje entregado a {job['to']} en {latency:.2f}s (intentos: {attempt + 1})")
+                self._record_result(job, "sent", external_id=wamid)
+                return False
+
+            error = f"{response.status_code} - {response.text[:500]}"
+            if not self._is_retryable(response):
+                logger.error(f"Error permanente al enviar mensaje a {job['to']}: {error}")
+                return self._fail(job, error)
+            retry_after = self._retry_after(response)
+        except Exception as e:
+            # Errores de red y timeouts se reintentan
+            error = str(e)
+
+        if attempt >= self.max_retries:
+            return self._fail(job, error)
+
+        delay = self._backoff_delay(attempt, retry_after)
+        logger.warning(f"Envío a {job['to']} falló ({error}); reintento {attempt + 1}/{self.max_retries} en {delay:.2f}s")
+        job["attempt"] = attempt + 1
+        job["retrying"] = True
+        with self._parked_lock:
+            self._parked.setdefault(job["to"], deque())
+        self._schedule_retry(job, delay)
+        return True
+
+    def _fail(self, job: Dict, error: str) -> bool:
+        """Registra un mensaje que no se pudo entregar"""
+        self._increment("failed")
+        logger.error(f"No se pudo entregar el mensaje a {job['to']}: {error}")
+        self._record_result(job, "failed", error=error)
+        return False
+
+    def _schedule_retry(self, job: Dict, delay: float):
+        """Devuelve el mensaje al shard de su destinatario cuando pase la espera"""
+        timer = threading.Timer(delay, self._resubmit, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _resubmit(self, job: Dict):
+        if not self._dispatcher.submit(job["to"], self._deliver, job):
+            # Shard lleno: se vuelve a intentar sin consumir un reintento
+            self._schedule_retry(job, self.backoff_base)
+
+    def _next_parked(self, to: str) -> Optional[Dict]:
+        """Siguiente mensaje aparcado del destinatario; sin más, lo libera"""
+        with self._parked_lock:
+            parked = self._parked.get(to)
+            if parked is None:
+                return None
+            if parked:
+                return parked.popleft()
+            del self._parked[to]
+            return None
+
+    def _is_retryable(self, response) -> bool:
+        """Indica si una respuesta de la API corresponde a un error transitorio"""
+        if response.status_code == 429 or response.status_code >= 500:
+            return True
+        try:
+            error_code = response.json().get("error", {}).get("code")
+        except Exception:
+            return False
+        return error_code in RETRYABLE_ERROR_CODES
+
+    def _retry_after(self, response) -> Optional[float]:
+        """Lee el encabezado Retry-After si existe"""
+        value = response.headers.get("Retry-After")
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def _backoff_delay(self, attempt, retry_after=None) -> float:
+        """Backoff exponencial con jitter completo, respetando Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _record_result(self, job, status, external_id=None, error=None):
+        """Registra el resultado de la entrega en la fila del mensaje"""
+        if not job.get("db_message_id"):
+            return
+        try:
+            update_message_delivery(job["db_message_id"], status, external_id=external_id, error=error)
+        except Exception as e:
+            logger.error(f"Error al registrar el estado de entrega del mensaje {job['db_message_id']}: {str(e)}")
+
+    def _increment(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        """
+        Retorna contadores de entrega, fichas disponibles y estado de las colas.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["available_tokens"] = round(self.bucket.available(), 2)
+        stats["rate_per_second"] = self.bucket.rate
+        with self._parked_lock:
+            stats["retrying_recipients"] = len(self._parked)
+            stats["parked"] = sum(len(parked) for parked in self._parked.values())
+        stats["queues"] = self._dispatcher.get_stats()
+        return stats
+
+
+# Cola de salida compartida por todo el proceso
+_outbound_sender = None
+_outbound_sender_lock = threading.Lock()
+
+
+def get_outbound_sender() -> OutboundSender:
+    """Retorna la cola de salida compartida, creándola la primera vez"""
+    global _outbound_sender
+    if _outbound_sender is None:
+        with _outbound_sender_lock:
+            if _outbound_sender is None:
+                _outbound_sender = OutboundSender()
+    return _outbound_sender
@@ -0,0 +1,201 @@
+"""
+Mantenimiento de la tabla de mensajes particionada.
+
+1. Crea con anticipación las particiones mensuales de messages.
+2. Archiva en disco (JSONL comprimido con gzip) los mensajes de conversaciones
+   cerradas con más de MESSAGE_ARCHIVE_AGE_DAYS días y los elimina de la tabla.
+3. Poda el registro de IDs externos (message_external_ids) con la misma antigüedad.
+4. Elimina las particiones antiguas que quedaron vacías.
+
+Cada lote se escribe y se sincroniza en disco antes de borrarlo de la base, así que
+una interrupción nunca pierde mensajes (a lo sumo el último lote queda duplicado
+en el archivo). Se puede programar a diario (cron, tarea programada o pg_cron para
+la parte de particiones).
+
+Uso:
+    python archive_messages.py
+    python archive_messages.py --dry-run
+
+Variables de entorno:
+    MESSAGE_ARCHIVE_AGE_DAYS: Antigüedad mínima de los mensajes a archivar (por defecto 90)
+    MESSAGE_ARCHIVE_DIR: Carpeta de los archivos .jsonl.gz (por defecto ./message_archive)
+    MESSAGE_PARTITIONS_AHEAD: Meses de particiones a crear por adelantado (por defecto 3)
+
+Requiere que las variables de entorno de Supabase estén configuradas.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import datetime
+from dotenv import load_dotenv
+
+# Añadir el directorio padre al path para poder importar los módulos
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+# Cargar variables de entorno
+load_dotenv()
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+load_dotenv(os.path.join(parent_dir, '.env'))
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Importar después de ajustar el path y cargar variables de entorno
+from supabase_client import get_supabase_client
+
+MESSAGE_ARCHIVE_AGE_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AGE_DAYS", 90))
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "message_archive")
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", 3))
+
+# Tamaño de página de las consultas y de los lotes de borrado (los IDs van en la URL)
+PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 200
+CONVERSATION_BATCH_SIZE = 50
+
+# Obtener cliente de Supabase
+supabase = get_supabase_client()
+
+def create_partitions(months_ahead):
+    """Crea las particiones mensuales que falten hasta `months_ahead` meses adelante"""
+    response = supabase.rpc("create_message_partitions", {"p_months_ahead": months_ahead}).execute()
+    logger.info(f"Particiones de mensajes creadas: {response.data}")
+
+def get_closed_conversation_ids(cutoff):
+    """Retorna los IDs de las conversaciones cerradas sin actividad desde `cutoff`"""
+    conversation_ids = []
+    offset = 0
+    while True:
+        response = supabase.table("conversations") \
+            .select("id") \
+            .eq("status", "closed") \
+            .lt("updated_at", cutoff) \
+            .order("id") \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute()
+        rows = response.data or []
+        conversation_ids.extend(row["id"] for row in rows)
+        if len(rows) < PAGE_SIZE:
+            return conversation_ids
+        offset += PAGE_SIZE
+
+def fetch_archivable_messages(conversation_ids, cutoff):
+    """Retorna una página de mensajes anteriores a `cutoff` de las conversaciones dadas"""
+    response = supabase.table("messages") \
+        .select("*") \
+        .in_("conversation_id", conversation_ids) \
+        .lt("created_at", cutoff) \
+        .order("created_at") \
+        .limit(PAGE_SIZE) \
+        .execute()
+    return response.data or []
+
+def delete_messages(message_ids):
+    """Elimina mensajes por ID en lotes"""
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        supabase.table("messages").delete().in_("id", message_ids[start:start + DELETE_BATCH_SIZE]).execute()
+
+def archive_messages(cutoff, archive_path, dry_run=False):
+    """
+    Mueve a `archive_path` los mensajes de conversaciones cerradas anteriores a `cutoff`.
+
+    Args:
+        cutoff: Fecha límite en formato ISO 8601
+        archive_path: Ruta del archivo .jsonl.gz a escribir
+        dry_run: Solo contar los mensajes, sin escribir ni borrar
+
+    Returns:
+        Número de mensajes archivados
+    """
+    conversation_ids = get_closed_conversation_ids(cutoff)
+    logger.info(f"Conversaciones cerradas anteriores a {cutoff}: {len(conversation_ids)}")
+    if not conversation_ids:
+        return 0
+
+    archived = 0
+    archive_file = None
+    try:
+        for start in range(0, len(conversation_ids), CONVERSATION_BATCH_SIZE):
+            batch_ids = conversation_ids[start:start + CONVERSATION_BATCH_SIZE]
+            while True:
+                messages = fetch_archivable_messages(batch_ids, cutoff)
+                if not messages:
+                    break
+                if dry_run:
+                    # Sin borrar no se puede avanzar de página: se cuenta solo la primera
+                    archived += len(messages)
+                    break
+
+                if archive_file is None:
+                    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+                    archive_file = gzip.open(archive_path, "at", encoding="utf-8")
+                for message in messages:
+                    archive_file.write(json.dumps(message, ensure_ascii=False, default=str) + "\n")
+                # Asegurar que el lote esté en disco antes de borrarlo de la base
+                # (en modo texto, gzip.open envuelve un GzipFile sobre el archivo)
+                archive_file.flush()
+                os.fsync(archive_file.buffer.fileobj.fileno())
+
+                delete_messages([message["id"] for message in messages])
+                archived += len(messages)
+                logger.info(f"Mensajes archivados: {archived}")
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+
+    return archived
+
+def prune_external_ids(cutoff, dry_run=False):
+    """Elimina del registro de deduplicación los IDs externos anteriores a `cutoff`"""
+    if dry_run:
+        return
+    supabase.table("message_external_ids").delete().lt("created_at", cutoff).execute()
+    logger.info(f"Registro de IDs externos podado hasta {cutoff}")
+
+def drop_empty_partitions(cutoff, dry_run=False):
+    """Elimina las particiones mensuales vacías que terminan antes de `cutoff`"""
+    if dry_run:
+        return
+    response = supabase.rpc("drop_empty_message_partitions", {"p_before": cutoff}).execute()
+    logger.info(f"Particiones vacías eliminadas: {response.data}")
+
+def main():
+    """Función principal del script"""
+    parser = argparse.ArgumentParser(description="Mantenimiento y archivado de mensajes")
+    parser.add_argument("--age-days", type=int, default=MESSAGE_ARCHIVE_AGE_DAYS)
+    parser.add_argument("--archive-dir", default=MESSAGE_ARCHIVE_DIR)
+    parser.add_argument("--partitions-ahead", type=int, default=MESSAGE_PARTITIONS_AHEAD)
+    parser.add_argument("--dry-run", action="store_true", help="Contar los mensajes sin archivarlos ni borrarlos")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = (now - datetime.timedelta(days=args.age_days)).isoformat()
+    archive_path = os.path.join(args.archive_dir, f"messages-{now.strftime('%Y%m%dT%H%M%SZ')}.jsonl.gz")
+
+    if not args.dry_run:
+        create_partitions(args.partitions_ahead)
+
+    archived = archive_messages(cutoff, archive_path, dry_run=args.dry_run)
+    if archived and not args.dry_run:
+        logger.info(f"{archived} mensajes archivados en {archive_path}")
+    elif args.dry_run:
+        logger.info(f"Modo de prueba: al menos {archived} mensajes por archivar")
+
+    prune_external_ids(cutoff, dry_run=args.dry_run)
+    drop_empty_partitions(cutoff, dry_run=args.dry_run)
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"Proceso completado en {elapsed_time:.2f} segundos")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Benchmark de planes de consulta para los índices del esquema de Supabase.
+
+Crea el esquema (supabase_schema.sql) en un Postgres local, carga datos
+sintéticos (por defecto 100k usuarios y 10M mensajes) y, para cada consulta
+frecuente de db_operations, verifica con EXPLAIN que no haya recorridos
+secuenciales sobre la tabla consultada y que el p95 de latencia quede dentro de
+su presupuesto.
+
+Uso:
+    python benchmark_indexes.py --database-url postgresql://postgres@localhost/bench
+    python benchmark_indexes.py --users 1000 --messages 100000   # carga reducida
+    python benchmark_indexes.py --skip-load                       # reutilizar datos cargados
+    python benchmark_indexes.py --skip-load --apply-migrations    # datos con un esquema anterior
+
+Todo se crea en el esquema `index_benchmark` (se elimina y recrea al cargar).
+Requiere psycopg2. Termina con código 1 si alguna consulta no cumple.
+"""
+
+import os
+import re
+import sys
+import time
+import json
+import logging
+import argparse
+
+import psycopg2
+
+# Añadir el directorio padre al path para poder importar los módulos
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SCHEMA_FILE = os.path.join(parent_dir, "supabase_schema.sql")
+MIGRATIONS_DIR = os.path.join(parent_dir, "migrations")
+BENCHMARK_SCHEMA = "index_benchmark"
+
+# Consultas de db_operations: (nombre, tabla que no debe recorrerse completa, SQL, presupuesto p95 en ms)
+QUERIES = [
+    ("get_user_by_phone", "users",
+     "SELECT * FROM users WHERE phone = ANY(%(phones)s)", 2.0),
+    ("get_active_conversation", "conversations",
+     "SELECT * FROM conversations WHERE external_id = %(phone)s AND platform = 'whatsapp' AND status = 'active'", 2.0),
+    ("get_system_messages", "messages",
+     "SELECT role, content FROM messages WHERE conversation_id = %(conversation_id)s AND role = 'system' "
+     "ORDER BY created_at", 3.0),
+    ("get_recent_messages", "messages",
+     "SELECT role, content FROM messages WHERE conversation_id = %(conversation_id)s AND role <> 'system' "
+     "ORDER BY created_at DESC LIMIT 10", 5.0),
+    ("get_lead_qualification", "lead_qualification",
+     "SELECT * FROM lead_qualification WHERE user_id = %(user_id)s AND conversation_id = %(conversation_id)s", 2.0),
+    ("get_meeting_by_outlook_id", "meetings",
+     "SELECT * FROM meetings WHERE outlook_meeting_id = %(outlook_meeting_id)s", 2.0),
+    ("get_user_meetings", "meetings",
+     "SELECT * FROM meetings WHERE user_id = %(user_id)s ORDER BY start_time", 2.0),
+]
+
+# En Postgres local no existe el esquema auth de Supabase que usan las políticas RLS
+AUTH_SHIM = """
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE OR REPLACE FUNCTION auth.role() RETURNS TEXT LANGUAGE sql STABLE AS $$ SELECT 'service_role'::TEXT $$;
+"""
+
+def split_statements(sql):
+    """
+    Divide un archivo de migración en sentencias, sin cortar los cuerpos $$ de
+    funciones y bloques DO.
+    """
+    statements = []
+    current = []
+    in_dollar_quote = False
+    for line in sql.splitlines():
+        if not in_dollar_quote:
+            line = re.sub(r"--.*", "", line)
+        in_dollar_quote ^= line.count("$$") % 2 == 1
+        current.append(line)
+        if not in_dollar_quote and line.rstrip().endswith(";"):
+            statement = "\n".join(current).strip().rstrip(";").strip()
+            if statement:
+                statements.append(statement)
+            current = []
+    statement = "\n".join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+def apply_migrations(conn):
+    """Aplica las migraciones en orden, una sentencia por transacción (CONCURRENTLY)"""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if not name.endswith(".sql"):
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                statements = split_statements(f.read())
+            for statement in statements:
+                cur.execute(statement)
+            logger.info(f"Migración aplicada: {name} ({len(statements)} sentencias)")
+
+def load_data(conn, num_users, num_messages):
+    """
+    Crea el esquema y carga datos sintéticos generados en el servidor.
+
+    Cada usuario tiene una conversación activa, una calificación de lead y un
+    mensaje de sistema; el resto de mensajes se reparte entre las conversaciones
+    alternando usuario y asistente. Un 20% de los usuarios tiene una reunión.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+        cur.execute(AUTH_SHIM)
+        with open(SCHEMA_FILE, encoding="utf-8") as f:
+            cur.execute(f.read())
+        logger.info("Esquema creado")
+
+        started = time.time()
+        cur.execute("""
+            INSERT INTO users (phone, full_name)
+            SELECT '57300' || lpad(n::TEXT, 7, '0'), 'Usuario ' || n
+            FROM generate_series(1, %s) AS n
+        """, (num_users,))
+        cur.execute("""
+            CREATE TEMP TABLE benchmark_conversations AS
+            SELECT row_number() OVER (ORDER BY u.phone) - 1 AS n, u.id AS user_id, uuid_generate_v4() AS id, u.phone
+            FROM users u
+        """)
+        cur.execute("ALTER TABLE benchmark_conversations ADD PRIMARY KEY (n)")
+        cur.execute("""
+            INSERT INTO conversations (id, user_id, platform, external_id, status)
+            SELECT id, user_id, 'whatsapp', phone, 'active' FROM benchmark_conversations
+        """)
+        cur.execute("""
+            INSERT INTO lead_qualification (user_id, conversation_id)
+            SELECT user_id, id FROM benchmark_conversations
+        """)
+        cur.execute("""
+            INSERT INTO meetings (user_id, lead_qualification_id, outlook_meeting_id, subject, start_time, end_time)
+            SELECT lq.user_id, lq.id, 'outlook-' || c.n, 'Reunión', NOW() + c.n * INTERVAL '1 minute',
+                   NOW() + c.n * INTERVAL '1 minute' + INTERVAL '30 minutes'
+            FROM benchmark_conversations c
+            JOIN lead_qualification lq ON lq.conversation_id = c.id
+            WHERE c.n % 5 = 0
+        """)
+        logger.info(f"Usuarios, conversaciones y reuniones cargados en {time.time() - started:.1f}s")
+
+        started = time.time()
+        cur.execute("""
+            INSERT INTO messages (conversation_id, role, content, created_at)
+            SELECT id, 'system', 'Iniciando conversación con un potencial cliente.', NOW() - INTERVAL '30 days'
+            FROM benchmark_conversations
+        """)
+        # Inserción por lotes para no generar una sola transacción enorme
+        batch_size = 1000000
+        remaining = max(num_messages - num_users, 0)
+        offset = 0
+        while offset < remaining:
+            size = min(batch_size, remaining - offset)
+            cur.execute("""
+                INSERT INTO messages (conversation_id, role, content, external_id, created_at)
+                SELECT c.id,
+                       CASE WHEN g %% 2 = 0 THEN 'user' ELSE 'assistant' END,
+                       'Mensaje sintético ' || g,
+                       CASE WHEN g %% 2 = 0 THEN 'wamid.' || g END,
+                       NOW() - INTERVAL '30 days' + g * INTERVAL '1 millisecond'
+                FROM generate_series(%s, %s) AS g
+                JOIN benchmark_conversations c ON c.n = g %% %s
+            """, (offset, offset + size - 1, num_users))
+            offset += size
+            logger.info(f"Mensajes cargados: {offset + num_users}/{num_messages}")
+        logger.info(f"Mensajes cargados en {time.time() - started:.1f}s")
+
+        cur.execute("ANALYZE")
+
+def sample_params(cur, count):
+    """Toma parámetros reales de la base para ejecutar cada consulta"""
+    cur.execute("""
+        SELECT u.id, u.phone, c.id, m.outlook_meeting_id
+        FROM users u
+        JOIN conversations c ON c.user_id = u.id
+        LEFT JOIN meetings m ON m.user_id = u.id
+        ORDER BY random()
+        LIMIT %s
+    """, (count,))
+    params = []
+    for user_id, phone, conversation_id, outlook_meeting_id in cur.fetchall():
+        params.append({
+            "user_id": user_id,
+            "phone": phone,
+            "phones": [phone, phone[2:], "+" + phone],
+            "conversation_id": conversation_id,
+            "outlook_meeting_id": outlook_meeting_id or "outlook-0"
+        })
+    return params
+
+def plan_nodes(plan):
+    """Recorre los nodos de un plan de EXPLAIN (FORMAT JSON)"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def check_query(cur, name, table, sql, budget_ms, params, iterations):
+    """
+    Verifica el plan y la latencia de una consulta.
+
+    Returns:
+        Diccionario con el resultado {name, indexes, seq_scan, p50_ms, p95_ms, budget_ms, ok}
+    """
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params[0])
+    explain = cur.fetchone()[0]
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+    nodes = list(plan_nodes(explain[0]["Plan"]))
+    # Las tablas particionadas (messages) se recorren a través de sus particiones messages_*
+    seq_scan = any(
+        node["Node Type"] == "Seq Scan"
+        and (node.get("Relation Name") == table or (node.get("Relation Name") or "").startswith(table + "_"))
+        for node in nodes
+    )
+    indexes = sorted({node["Index Name"] for node in nodes if node.get("Index Name")})
+
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        cur.execute(sql, params[i % len(params)])
+        cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+
+    return {
+        "name": name,
+        "indexes": indexes,
+        "seq_scan": seq_scan,
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "budget_ms": budget_ms,
+        "ok": not seq_scan and p95 <= budget_ms
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de índices del esquema de Supabase")
+    parser.add_argument("--database-url", default=os.getenv("BENCHMARK_DATABASE_URL", "postgresql://postgres@localhost:5432/postgres"))
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=10000000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiplica los presupuestos de latencia")
+    parser.add_argument("--skip-load", action="store_true", help="Reutilizar los datos ya cargados")
+    parser.add_argument("--apply-migrations", action="store_true",
+                        help="Aplicar migrations/ antes de medir (el esquema recién creado ya las incluye)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url, options=f"-c search_path={BENCHMARK_SCHEMA},public")
+    try:
+        if not args.skip_load:
+            load_data(conn, args.users, args.messages)
+        if args.apply_migrations:
+            apply_migrations(conn)
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+            params = sample_params(cur, min(args.iterations, args.users))
+            results = [
+                check_query(cur, name, table, sql, budget_ms * args.budget_scale, params, args.iterations)
+                for name, table, sql, budget_ms in QUERIES
+            ]
+    finally:
+        conn.close()
+
+    for result in results:
+        status = "OK" if result["ok"] else "FALLA"
+        logger.info(
+            f"[{status}] {result['name']}: p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+            f"(presupuesto {result['budget_ms']}ms) índices={result['indexes']}"
+            + (" RECORRIDO SECUENCIAL" if result["seq_scan"] else "")
+        )
+
+    failed = [result["name"] for result in results if not result["ok"]]
+    if failed:
+        logger.error(f"Consultas fuera de presupuesto o sin índice: {', '.join(failed)}")
+        return 1
+    logger.info("Todas las consultas usan índices y cumplen su presupuesto")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -50,18 +50,25 @@ logger.info(f"SUPABASE_SERVICE_ROLE_KEY: {'Configurado' if supabase_key else 'No
 # Importar después de ajustar el path y cargar variables de entorno
 from supabase_client import get_supabase_client
 from utils.phone_utils import normalize_phone_number, find_duplicate_phone_formats
+from db_operations import iterate_pages, get_users_page, get_conversation_messages_page
+
+# Usuarios por página al recorrer la tabla
+USERS_PAGE_SIZE = int(os.getenv("FIX_DUPLICATES_PAGE_SIZE", 500))
 
 # Obtener cliente de Supabase
 supabase = get_supabase_client()
 
 def get_all_users():
-    """Obtiene todos los usuarios de la base de datos"""
-    response = supabase.table("users").select("*").execute()
-    return response.data
+    """Recorre todos los usuarios de la base de datos, página a página"""
+    return iterate_pages(get_users_page, page_size=USERS_PAGE_SIZE)
 
 def find_duplicate_users(users):
     """
     Identifica usuarios duplicados basados en números de teléfono normalizados.
+    De cada usuario solo se conservan el ID, el teléfono y la fecha de creación.
+    
+    Args:
+        users: Iterable de usuarios (puede ser un generador)
     
     Returns:
         Lista de grupos de usuarios duplicados, donde cada grupo es una lista de usuarios
@@ -84,7 +91,11 @@ def find_duplicate_users(users):
         if normalized_phone not in normalized_groups:
             normalized_groups[normalized_phone] = []
         
-        normalized_groups[normalized_phone].append(user)
+        normalized_groups[normalized_phone].append({
+            "id": user["id"],
+            "phone": phone,
+            "created_at": user.get("created_at")
+        })
     
     # Filtrar solo los grupos con más de un usuario (duplicados)
     duplicate_groups = [group for group in normalized_groups.values() if len(group) > 1]
@@ -97,9 +108,8 @@ def get_user_conversations(user_id):
     return response.data
 
 def get_conversation_messages(conversation_id):
-    """Obtiene todos los mensajes de una conversación"""
-    response = supabase.table("messages").select("*").eq("conversation_id", conversation_id).execute()
-    return response.data
+    """Recorre todos los mensajes de una conversación, página a página"""
+    return iterate_pages(get_conversation_messages_page, conversation_id)
 
 def update_conversation_user(conversation_id, new_user_id):
     """Actualiza el usuario de una conversación"""
@@ -178,12 +188,16 @@ def main():
     start_time = time.time()
     logger.info("Iniciando corrección de usuarios duplicados")
     
-    # Obtener todos los usuarios
-    users = get_all_users()
-    logger.info(f"Total de usuarios: {len(users)}")
+    # Recorrer todos los usuarios y encontrar los duplicados
+    user_count = 0
+    def counted_users():
+        nonlocal user_count
+        for user in get_all_users():
+            user_count += 1
+            yield user
     
-    # Encontrar usuarios duplicados
-    duplicate_groups = find_duplicate_users(users)
+    duplicate_groups = find_duplicate_users(counted_users())
+    logger.info(f"Total de usuarios: {user_count}")
     logger.info(f"Grupos de usuarios duplicados encontrados: {len(duplicate_groups)}")
     
     # Procesar cada grupo de duplicados
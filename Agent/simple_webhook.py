@@ -1,60 +1,137 @@
 from flask import Flask, request, jsonify
-import requests
-import json
 import hmac
 import hashlib
 import os
 import time
 from dotenv import load_dotenv
 import logging
-from concurrent.futures import ThreadPoolExecutor
 
 # Importar el agente de main.py
 from main import create_lead_qualification_agent
 # Importar operaciones de base de datos
 from db_operations import (
-    get_or_create_user,
-    get_or_create_conversation,
     add_message,
-    get_conversation_history
+    ingest_inbound_message,
+    merge_consecutive_user_messages,
+    context_cache
 )
+# Importar el cliente compartido de WhatsApp y la cola de salida
+from whatsapp_client import get_whatsapp_client
+from outbound_queue import get_outbound_sender
+# Importar el resumen acumulado de conversaciones
+from conversation_summary import get_conversation_summarizer, history_since_summary, with_summary
+# Importar la instrumentación de consultas por turno
+from supabase_instrumentation import db_turn
+# Importar la invalidación de cachés entre procesos
+from cache_invalidation import start_cache_invalidation, get_cache_invalidation_stats
+# Importar el modo degradado (Supabase no disponible)
+from degraded_mode import DegradedMode, DEFERRED, DEGRADED_ACK_MESSAGE
+# Importar el journal local de mensajes entrantes
+from inbound_journal import open_inbound_journal
+# Importar el pool de procesos del agente
+from worker_pool import AgentWorkerPool, is_agent_worker_process
 # Importar utilidades de normalización de teléfonos
 from utils.phone_utils import normalize_phone_number
+# Importar el despachador de colas por remitente
+from utils.dispatcher import SenderDispatcher
+# Importar el agrupador de ráfagas de mensajes
+from utils.coalescer import MessageCoalescer
+# Importar la caché TTL y el registro de métricas
+from utils.ttl_cache import TTLCache
+from utils import metrics
+# Importar el pipeline de logging (cola + hilo de fondo, payloads muestreados)
+from utils.logging_setup import configure_logging, get_logging_stats, log_payload
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()  # Asegurar que los logs se envíen a stdout para Render
-    ]
-)
+# Configurar logging (niveles por módulo con LOG_LEVELS, p. ej. "db_operations=DEBUG")
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Configurar logging para módulos importantes
-logging.getLogger('main').setLevel(logging.INFO)
-logging.getLogger('db_operations').setLevel(logging.INFO)
-
 # Cargar variables de entorno
 load_dotenv()
 
 # Configuración de WhatsApp
-WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
-WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_WEBHOOK_TOKEN = os.getenv("WHATSAPP_WEBHOOK_TOKEN")
 WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
 
-# Configuración de timeouts (60 segundos)
-REQUEST_TIMEOUT = 60
+# Configuración del despachador de mensajes entrantes
+WEBHOOK_WORKER_SHARDS = int(os.getenv("WEBHOOK_WORKER_SHARDS", 10))
+WEBHOOK_QUEUE_MAXSIZE = int(os.getenv("WEBHOOK_QUEUE_MAXSIZE", 100))
+
+# Ventana (en segundos) para agrupar ráfagas de mensajes de un mismo remitente (0 = desactivado)
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", 2.0))
+WEBHOOK_COALESCE_MAX_WAIT = float(os.getenv("WEBHOOK_COALESCE_MAX_WAIT", 6.0))
+
+# IDs de mensajes ya recibidos: WhatsApp reintenta entregas y no deben procesarse dos veces
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 86400))
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", 100000))
+
+# Archivo del journal local de mensajes entrantes (vacío = desactivado)
+INBOUND_JOURNAL_PATH = os.getenv("INBOUND_JOURNAL_PATH", "inbound_journal.db")
+
+# Dónde se ejecutan los turnos del agente: "thread" (hilos de este proceso) o
+# "process" (pool de procesos, cada uno con su propia instancia del agente)
+AGENT_EXECUTION_MODE = os.getenv("AGENT_EXECUTION_MODE", "thread").lower()
+AGENT_WORKER_PROCESSES = int(os.getenv("AGENT_WORKER_PROCESSES", os.cpu_count() or 2))
+
+# En modo "process" este proceso solo valida, registra y encola los mensajes
+INGRESS_ONLY = AGENT_EXECUTION_MODE == "process" and not is_agent_worker_process()
 
 # Inicializar Flask
 app = Flask(__name__)
 
-# Inicializar el agente
-lead_agent = create_lead_qualification_agent()
+# Inicializar el agente (el proceso de entrada en modo "process" no lo necesita)
+lead_agent = None if INGRESS_ONLY else create_lead_qualification_agent()
+
+# Inicializar el despachador: cada remitente tiene su cola FIFO en un shard fijo,
+# así sus mensajes se procesan en orden y remitentes distintos en paralelo
+dispatcher = SenderDispatcher(
+    num_shards=WEBHOOK_WORKER_SHARDS,
+    max_queue_size=WEBHOOK_QUEUE_MAXSIZE,
+    name="webhook"
+)
+
+# Inicializar el agrupador: los mensajes que un remitente envía en ráfaga se
+# combinan en un solo turno del agente antes de pasar al despachador
+# (si la cola de destino está llena el lote se reintenta y, si no cabe, se descarta
+# dejando sus entradas del journal pendientes)
+coalescer = MessageCoalescer(
+    flush_callback=lambda sender_key, items: dispatch_message_batch(sender_key, items),
+    window=WEBHOOK_COALESCE_WINDOW,
+    max_wait=WEBHOOK_COALESCE_MAX_WAIT,
+    has_capacity=lambda sender_key: dispatch_has_capacity(sender_key),
+    on_drop=lambda sender_key, items: drop_message_batch(sender_key, items)
+)
+
+# Cliente de WhatsApp con pool de conexiones keep-alive
+whatsapp_client = get_whatsapp_client()
+
+# Cola de salida: las respuestas se entregan en segundo plano con límite de velocidad y reintentos
+outbound_sender = get_outbound_sender()
+
+# Mantener la caché de contexto coherente con las escrituras de otros procesos
+start_cache_invalidation(context_cache)
+
+# Conjunto de IDs de mensajes ya vistos (TTL + LRU) para descartar entregas repetidas
+seen_message_ids = TTLCache(maxsize=WEBHOOK_DEDUP_MAX_ENTRIES, ttl=WEBHOOK_DEDUP_TTL)
+
+# Journal en disco: los mensajes se registran antes de responder 200 a WhatsApp
+# y se reprocesan al arrancar si el proceso murió antes de terminarlos
+# (en los procesos del pool el journal lo gestiona el proceso de entrada)
+inbound_journal = None if is_agent_worker_process() else open_inbound_journal(INBOUND_JOURNAL_PATH)
+
+# Pool de procesos del agente: el webhook enruta cada ráfaga al proceso de su remitente
+worker_pool = AgentWorkerPool(
+    num_workers=AGENT_WORKER_PROCESSES,
+    module_name=__name__ if __name__ != "__main__" else "simple_webhook",
+    on_batch_done=lambda items: finish_journal_entries(items)
+) if INGRESS_ONLY else None
 
-# Inicializar ThreadPoolExecutor para manejar múltiples conversaciones
-executor = ThreadPoolExecutor(max_workers=10)
+# Modo degradado: si Supabase no responde, las ráfagas se difieren con un acuse de
+# recibo inmediato y se reprocesan cuando el circuito de Supabase se recupera
+degraded_mode = DegradedMode(
+    resubmit=lambda sender_key, items: dispatch_message_batch(sender_key, items),
+    acknowledge=lambda sender: outbound_sender.enqueue(sender, "text", DEGRADED_ACK_MESSAGE)
+)
 
 # ---- CLIENTE DE WHATSAPP ----
 
@@ -72,232 +149,121 @@ def send_whatsapp_message(to, message_type, content, caption=None):
         Respuesta de la API
     """
     start_time = time.time()
-    logger.info(f"Enviando mensaje a {to} (tipo: {message_type})")
-    
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    # Construir payload según el tipo de mensaje
-    payload = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": to
-    }
-    
-    if message_type == "text":
-        payload["type"] = "text"
-        payload["text"] = {"body": content}
+    logger.debug("Enviando mensaje a %s (tipo: %s)", to, message_type)
     
-    elif message_type == "image":
-        payload["type"] = "image"
-        payload["image"] = {"link": content}
-        if caption:
-            payload["image"]["caption"] = caption
+    result = whatsapp_client.send_message(to, message_type, content, caption)
     
-    elif message_type == "audio":
-        payload["type"] = "audio"
-        payload["audio"] = {"link": content}
-    
-    elif message_type == "video":
-        payload["type"] = "video"
-        payload["video"] = {"link": content}
-        if caption:
-            payload["video"]["caption"] = caption
-    
-    # Enviar solicitud a la API con timeout
-    try:
-        response = requests.post(
-            url, 
-            headers=headers, 
-            json=payload,
-            timeout=REQUEST_TIMEOUT
-        )
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"Respuesta recibida en {elapsed_time:.2f}s (status: {response.status_code})")
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Error al enviar mensaje: {response.status_code} - {response.text}")
-            return None
-    except requests.exceptions.Timeout:
-        logger.error(f"Timeout al enviar mensaje a {to} después de {REQUEST_TIMEOUT}s")
-        return None
-    except Exception as e:
-        logger.error(f"Error al enviar mensaje: {str(e)}")
-        return None
+    elapsed_time = time.time() - start_time
+    logger.info(f"Respuesta recibida en {elapsed_time:.2f}s (enviado: {result is not None})")
+    return result
 
 def mark_message_as_read(message_id):
     """Marca un mensaje como leído"""
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "status": "read",
-        "message_id": message_id
-    }
-    
-    try:
-        response = requests.post(
-            url, 
-            headers=headers, 
-            json=payload,
-            timeout=REQUEST_TIMEOUT
-        )
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Error al marcar mensaje como leído: {str(e)}")
-        return False
+    return whatsapp_client.mark_message_as_read(message_id)
 
 def get_media_url(media_id):
-    """Obtiene la URL de un archivo multimedia"""
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{media_id}"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"
-    }
-    
-    try:
-        response = requests.get(
-            url, 
-            headers=headers,
-            timeout=REQUEST_TIMEOUT
-        )
-        
-        if response.status_code == 200:
-            media_data = response.json()
-            media_url = media_data.get("url")
-            
-            if media_url:
-                media_response = requests.get(
-                    media_url,
-                    headers={"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"},
-                    timeout=REQUEST_TIMEOUT
-                )
-                if media_response.status_code == 200:
-                    return media_response.content
-        
-        return None
-    except Exception as e:
-        logger.error(f"Error al obtener URL de multimedia: {str(e)}")
-        return None
+    """Obtiene el contenido de un archivo multimedia"""
+    return whatsapp_client.get_media_content(media_id)
 
 # ---- PROCESAMIENTO DE MENSAJES ----
 
 def process_incoming_message(sender, message_type, content, message_id=None):
     """
-    Procesa los mensajes entrantes usando el agente de calificación de leads.
+    Procesa un mensaje entrante usando el agente de calificación de leads.
+    """
+    return process_incoming_messages(sender, [{
+        "type": message_type,
+        "content": content,
+        "message_id": message_id
+    }])
+
+@db_turn("whatsapp")
+def process_incoming_messages(sender, incoming_messages):
+    """
+    Procesa una ráfaga de mensajes entrantes de un mismo remitente como un solo turno del agente.
+    
+    Cada mensaje se guarda individualmente en la base de datos, pero el agente se
+    invoca una sola vez con los mensajes consecutivos del usuario combinados.
+    
+    Args:
+        sender: Número de teléfono del remitente
+        incoming_messages: Lista de mensajes {type, content, message_id} en orden de llegada
     """
     start_time = time.time()
-    logger.info(f"Procesando mensaje de {sender} (tipo: {message_type})")
-    logger.info(f"Contenido del mensaje: '{content}'")
+    logger.info(f"Procesando {len(incoming_messages)} mensaje(s) de {sender}")
+    content = "\n".join(str(item.get("content") or "") for item in incoming_messages)
+    logger.debug("Contenido del mensaje: '%s'", content)
     
     try:
-        # Marcar mensaje como leído si tenemos el ID
-        if message_id:
-            logger.info(f"Marcando mensaje como leído: {message_id}")
-            mark_message_as_read(message_id)
-        
         # Normalizar el número de teléfono del remitente
         normalized_sender = normalize_phone_number(sender)
         if normalized_sender and normalized_sender != sender:
-            logger.info(f"Número de teléfono normalizado: {sender} -> {normalized_sender}")
+            logger.debug("Número de teléfono normalizado: %s -> %s", sender, normalized_sender)
             sender = normalized_sender
         
-        # Obtener o crear usuario
-        try:
-            user = get_or_create_user(phone=sender)
-            logger.info(f"Usuario obtenido/creado: {user.get('id')}")
-        except Exception as user_error:
-            logger.error(f"Error al obtener/crear usuario: {str(user_error)}")
-            raise
+        # Preparar el contenido de cada mensaje según su tipo
+        media_type_names = {
+            "image": "imagen",
+            "audio": "audio",
+            "video": "video"
+        }
+        prepared_messages = []
+        for item in incoming_messages:
+            message_type = item.get("type", "text")
+            message_content = item.get("content")
+            if message_type != "text":
+                # Para mensajes multimedia, informamos al agente del tipo de contenido
+                message_content = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
+            logger.debug("Contenido del mensaje preparado: '%s'", message_content)
+            prepared_messages.append({
+                "content": message_content,
+                "message_type": message_type,
+                "external_id": item.get("message_id")
+            })
         
-        # Obtener o crear conversación
+        # Registrar usuario, conversación y mensajes y obtener el historial en un solo viaje a la BD
         try:
-            conversation = get_or_create_conversation(user_id=user["id"], external_id=sender, platform="whatsapp")
-            logger.info(f"Conversación obtenida/creada: {conversation.get('id')}")
-        except Exception as conv_error:
-            logger.error(f"Error al obtener/crear conversación: {str(conv_error)}")
+            ingest_result = ingest_inbound_message(sender, prepared_messages, platform="whatsapp")
+        except Exception as ingest_error:
+            logger.error(f"Error al registrar los mensajes entrantes: {str(ingest_error)}")
+            # Con Supabase caído o lento: acuse de recibo y reproceso al recuperarse
+            if degraded_mode.defer(sender, sender, incoming_messages, ingest_error):
+                return DEFERRED
             raise
         
-        # Preparar el contenido del mensaje según el tipo
-        message_content = content
-        if message_type != "text":
-            # Para mensajes multimedia, informamos al agente del tipo de contenido
-            media_type_names = {
-                "image": "imagen",
-                "audio": "audio",
-                "video": "video"
-            }
-            message_content = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
+        conversation = ingest_result["conversation"]
+        logger.debug("Conversación obtenida/creada: %s", conversation.get('id'))
+        if ingest_result.get("is_new_conversation"):
+            logger.info("Iniciando nueva conversación con mensajes de sistema y bienvenida")
         
-        logger.info(f"Contenido del mensaje preparado: '{message_content}'")
+        for external_id in ingest_result.get("duplicates") or []:
+            # Entrega repetida que no estaba en la caché de este proceso (p. ej. tras un reinicio)
+            metrics.increment("webhook.duplicates.database")
+            logger.info(f"Mensaje duplicado descartado por la BD: {external_id}")
         
-        # Agregar mensaje del usuario a la base de datos
-        try:
-            user_message = add_message(
-                conversation_id=conversation["id"],
-                role="user",
-                content=message_content,
-                message_type=message_type,
-                external_id=message_id
-            )
-            logger.info(f"Mensaje del usuario añadido a la BD: {user_message.get('id')}")
-        except Exception as msg_error:
-            logger.error(f"Error al añadir mensaje del usuario: {str(msg_error)}")
-            raise
+        stored_messages = ingest_result.get("stored") or []
+        if not stored_messages:
+            logger.info("Todos los mensajes eran duplicados; no se invoca al agente")
+            return True
         
-        # Obtener historial de mensajes para el agente
-        try:
-            messages_history = get_conversation_history(conversation["id"])
-            logger.info(f"Historial de mensajes obtenido: {len(messages_history)} mensajes")
-            
-            # Imprimir los últimos mensajes para depuración
-            for i, msg in enumerate(messages_history[-5:] if len(messages_history) > 5 else messages_history):
-                logger.info(f"Mensaje {i+1}: {msg['role']} - '{msg['content']}'")
-        except Exception as hist_error:
-            logger.error(f"Error al obtener historial de mensajes: {str(hist_error)}")
-            raise
+        # Marcar como leídos los mensajes que quedaron registrados
+        for stored_message in stored_messages:
+            if stored_message.get("external_id"):
+                logger.debug("Marcando mensaje como leído: %s", stored_message["external_id"])
+                mark_message_as_read(stored_message["external_id"])
         
-        # Si es una nueva conversación, agregar mensaje de sistema
-        if len(messages_history) <= 1:  # Solo hay el mensaje que acabamos de añadir
-            logger.info("Iniciando nueva conversación con mensajes de sistema y bienvenida")
-            try:
-                # Agregar mensaje de sistema
-                system_message = add_message(
-                    conversation_id=conversation["id"],
-                    role="system",
-                    content="Iniciando conversación con un potencial cliente."
-                )
-                logger.info(f"Mensaje de sistema añadido: {system_message.get('id')}")
-                
-                # Agregar mensaje de bienvenida
-                welcome_message = add_message(
-                    conversation_id=conversation["id"],
-                    role="assistant",
-                    content="¡Hola! Soy el asistente virtual de nuestra empresa de desarrollo de software. ¿En qué puedo ayudarte hoy?"
-                )
-                logger.info(f"Mensaje de bienvenida añadido: {welcome_message.get('id')}")
-                
-                # Actualizar historial
-                messages_history = get_conversation_history(conversation["id"])
-                logger.info(f"Historial actualizado: {len(messages_history)} mensajes")
-            except Exception as init_error:
-                logger.error(f"Error al inicializar conversación: {str(init_error)}")
-                raise
+        messages_history = ingest_result["history"]
+        logger.debug("Historial de mensajes obtenido: %d mensajes", len(messages_history))
+        
+        # Imprimir los últimos mensajes para depuración
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, msg in enumerate(messages_history[-5:]):
+                logger.debug("Mensaje %d: %s - '%s'", i + 1, msg['role'], msg['content'])
+        
+        # Añadir el resumen de los mensajes anteriores (con todos los mensajes que aún no
+        # cubre) y combinar los mensajes consecutivos del usuario en un solo turno
+        messages_history = with_summary(history_since_summary(messages_history, conversation), conversation)
+        messages_history = merge_consecutive_user_messages(messages_history)
         
         # Configuración para la ejecución del agente
         config = {
@@ -308,12 +274,12 @@ def process_incoming_message(sender, message_type, content, message_id=None):
         
         # Invocar al agente con el historial de mensajes
         try:
-            logger.info("Invocando al agente con el historial de mensajes")
+            logger.debug("Invocando al agente con el historial de mensajes")
             response = lead_agent.invoke(
                 {"messages": messages_history},
                 config
             )
-            logger.info("Agente invocado exitosamente")
+            logger.debug("Agente invocado exitosamente")
         except Exception as agent_error:
             logger.error(f"Error al invocar al agente: {str(agent_error)}")
             import traceback
@@ -333,31 +299,38 @@ def process_incoming_message(sender, message_type, content, message_id=None):
                 # Fallback
                 agent_response = str(assistant_message)
             
-            logger.info(f"Respuesta del agente obtenida: '{agent_response[:100]}...'")
+            logger.debug("Respuesta del agente obtenida: '%s...'", agent_response[:100])
         except Exception as resp_error:
             logger.error(f"Error al obtener respuesta del agente: {str(resp_error)}")
             raise
         
-        # Enviar la respuesta al usuario
-        try:
-            send_result = send_whatsapp_message(sender, "text", agent_response)
-            logger.info(f"Respuesta enviada al usuario: {send_result is not None}")
-        except Exception as send_error:
-            logger.error(f"Error al enviar respuesta al usuario: {str(send_error)}")
-            # No lanzamos excepción aquí para poder guardar la respuesta en la BD
-        
-        # Guardar respuesta del asistente en la base de datos
+        # Guardar respuesta del asistente en la base de datos (pendiente de entrega)
+        assistant_db_message = {}
         try:
             assistant_db_message = add_message(
                 conversation_id=conversation["id"],
                 role="assistant",
                 content=agent_response,
-                message_type="text"
+                message_type="text",
+                delivery_status="queued"
             )
-            logger.info(f"Respuesta del asistente guardada en BD: {assistant_db_message.get('id')}")
+            logger.debug("Respuesta del asistente guardada en BD: %s", assistant_db_message.get('id'))
         except Exception as save_error:
             logger.error(f"Error al guardar respuesta del asistente: {str(save_error)}")
-            # No lanzamos excepción aquí para poder retornar éxito parcial
+            # No lanzamos excepción aquí para poder enviar la respuesta de todas formas
+        
+        # Encolar la respuesta: la cola de salida la entrega con reintentos y
+        # registra el resultado en la fila del mensaje
+        queued = outbound_sender.enqueue(
+            sender,
+            "text",
+            agent_response,
+            db_message_id=assistant_db_message.get("id")
+        )
+        logger.debug("Respuesta encolada para el usuario: %s", queued)
+        
+        # Mensajes entrantes y respuesta: el resumen se actualiza cada K mensajes en segundo plano
+        get_conversation_summarizer().record_messages(conversation, len(stored_messages) + 1)
         
         elapsed_time = time.time() - start_time
         logger.info(f"Mensaje procesado en {elapsed_time:.2f}s")
@@ -376,13 +349,13 @@ def process_incoming_message(sender, message_type, content, message_id=None):
             # Si el mensaje contiene "cancel" y la traza contiene "exitosamente", 
             # probablemente la reunión se canceló correctamente pero hubo un error posterior
             success_message = "La reunión ha sido cancelada exitosamente."
-            send_whatsapp_message(sender, "text", success_message)
+            outbound_sender.enqueue(sender, "text", success_message)
             logger.info("Se detectó una cancelación exitosa a pesar del error. Enviando mensaje de éxito.")
             return True
         else:
             # Enviar mensaje de error genérico para otros casos
             error_message = "Lo siento, estamos experimentando dificultades técnicas. Por favor, intenta nuevamente más tarde."
-            send_whatsapp_message(sender, "text", error_message)
+            outbound_sender.enqueue(sender, "text", error_message)
             return False
 
 # ---- RUTAS DEL WEBHOOK ----
@@ -408,9 +381,8 @@ def receive_webhook():
     """
     Recibe notificaciones de mensajes y eventos de WhatsApp.
     """
-    # Log completo de headers para diagnóstico
-    headers_dict = dict(request.headers)
-    logger.info(f"Headers recibidos: {json.dumps(headers_dict)}")
+    # Headers para diagnóstico (todos en DEBUG, una muestra en INFO)
+    log_payload(logger, "Headers recibidos", dict(request.headers))
     
     # Verificar firma X-Hub-Signature-256
     signature = request.headers.get('X-Hub-Signature-256', '')
@@ -429,59 +401,233 @@ def receive_webhook():
     
     # Procesar datos del webhook
     data = request.json
-    # Log completo del payload para diagnóstico
-    logger.info(f"Webhook recibido COMPLETO: {json.dumps(data, indent=2)}")
+    # Payload para diagnóstico (todos en DEBUG, una muestra en INFO)
+    log_payload(logger, "Webhook recibido", data)
     
     # Verificar si es un mensaje entrante
+    accepted = True
     if data.get('object') == 'whatsapp_business_account':
         for entry in data.get('entry', []):
             for change in entry.get('changes', []):
                 if change.get('field') == 'messages':
-                    # Procesar mensajes en un hilo separado para no bloquear la respuesta
-                    executor.submit(process_webhook_messages, change.get('value', {}))
+                    # Encolar los mensajes en la cola de su remitente para no bloquear la respuesta
+                    if not process_webhook_messages(change.get('value', {})):
+                        accepted = False
+    
+    if not accepted:
+        # Las colas están llenas: WhatsApp reintentará la entrega más tarde
+        return "Queue full", 503
     
     # Responder rápidamente para cumplir con el requisito de WhatsApp
     return "OK", 200
 
 def process_webhook_messages(message_data):
     """
-    Procesa los mensajes recibidos en el webhook.
-    """
-    logger.info(f"Procesando datos de webhook: {json.dumps(message_data, indent=2)}")
+    Encola los mensajes recibidos en el webhook en la cola de su remitente.
     
+    Returns:
+        True si todos los mensajes fueron encolados, False si alguna cola estaba llena
+    """
     # Verificar si hay mensajes
     messages = message_data.get('messages', [])
     if not messages:
         logger.warning("No se encontraron mensajes en los datos del webhook")
-        return
+        return True
     
-    logger.info(f"Número de mensajes a procesar: {len(messages)}")
+    logger.debug("Número de mensajes a procesar: %d", len(messages))
     
+    pending = []
     for message in messages:
-        message_type = message.get('type')
         sender = message.get('from')
         message_id = message.get('id')
         
-        logger.info(f"Procesando mensaje: ID={message_id}, Tipo={message_type}, Remitente={sender}")
+        # Descartar entregas repetidas antes de hacer cualquier trabajo
+        if message_id and not seen_message_ids.add(message_id):
+            metrics.increment("webhook.duplicates.memory")
+            logger.info(f"Mensaje duplicado descartado: {message_id}")
+            continue
         
-        if message_type == 'text':
-            text = message.get('text', {}).get('body', '')
-            logger.info(f"Contenido del mensaje de texto: {text}")
-            process_incoming_message(sender, 'text', text, message_id)
+        incoming_message = build_incoming_message(message)
+        if not incoming_message:
+            continue
         
-        elif message_type in ["image", "audio", "video"]:
-            media_id = message.get(message_type, {}).get('id')
-            logger.info(f"Contenido multimedia recibido: Tipo={message_type}, Media ID={media_id}")
-            # Para mensajes multimedia, informamos al agente del tipo de contenido
-            media_type_names = {
-                "image": "imagen",
-                "audio": "audio",
-                "video": "video"
-            }
-            media_message = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
-            process_incoming_message(sender, 'text', media_message, message_id)
-        else:
-            logger.warning(f"Tipo de mensaje no soportado: {message_type}")
+        # Usar el número normalizado como clave para que todas las variantes
+        # del mismo teléfono caigan en la misma ráfaga y en la misma cola
+        sender_key = normalize_phone_number(sender) or sender
+        pending.append((sender_key, incoming_message))
+    
+    # Registrar en disco todos los mensajes del payload en un solo commit
+    journal_messages(pending)
+    
+    accepted = True
+    for sender_key, incoming_message in pending:
+        if not coalescer.add(sender_key, incoming_message):
+            message_id = incoming_message.get("message_id")
+            logger.error(f"No se pudo encolar el mensaje {message_id} de {incoming_message.get('sender')}")
+            # Olvidar el ID para que el reintento de WhatsApp sí se procese
+            if message_id:
+                seen_message_ids.delete(message_id)
+            finish_journal_entries([incoming_message])
+            accepted = False
+    
+    return accepted
+
+def journal_messages(pending):
+    """
+    Registra los mensajes en el journal local y les asigna su `journal_id`.
+    
+    Args:
+        pending: Lista de tuplas (sender_key, mensaje preparado)
+    """
+    if not inbound_journal or not pending:
+        return
+    try:
+        entry_ids = inbound_journal.append_many([
+            {"sender": sender_key, "payload": incoming_message}
+            for sender_key, incoming_message in pending
+        ])
+    except Exception as e:
+        # Sin journal el mensaje se procesa igual, solo pierde la protección ante caídas
+        logger.error(f"No se pudo registrar el payload en el journal: {str(e)}")
+        return
+    for (sender_key, incoming_message), entry_id in zip(pending, entry_ids):
+        incoming_message["journal_id"] = entry_id
+
+def build_incoming_message(message):
+    """
+    Convierte un mensaje del webhook al formato {sender, type, content, message_id}.
+    
+    Returns:
+        Mensaje preparado o None si el tipo no está soportado
+    """
+    message_type = message.get('type')
+    sender = message.get('from')
+    message_id = message.get('id')
+    
+    logger.debug("Procesando mensaje: ID=%s, Tipo=%s, Remitente=%s", message_id, message_type, sender)
+    
+    if message_type == 'text':
+        text = message.get('text', {}).get('body', '')
+        logger.debug("Contenido del mensaje de texto: %s", text)
+        return {"sender": sender, "type": "text", "content": text, "message_id": message_id}
+    
+    elif message_type in ["image", "audio", "video"]:
+        media_id = message.get(message_type, {}).get('id')
+        logger.debug("Contenido multimedia recibido: Tipo=%s, Media ID=%s", message_type, media_id)
+        # Para mensajes multimedia, informamos al agente del tipo de contenido
+        media_type_names = {
+            "image": "imagen",
+            "audio": "audio",
+            "video": "video"
+        }
+        media_message = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
+        return {"sender": sender, "type": "text", "content": media_message, "message_id": message_id}
+    
+    logger.warning(f"Tipo de mensaje no soportado: {message_type}")
+    return None
+
+def dispatch_message_batch(sender_key, incoming_messages):
+    """
+    Encola una ráfaga de mensajes de un remitente en su shard del despachador
+    (o en su proceso del pool en modo "process").
+    
+    Returns:
+        True si la ráfaga fue encolada, False si la cola estaba llena
+    """
+    sender = incoming_messages[0].get("sender") or sender_key
+    if worker_pool:
+        return worker_pool.submit(sender_key, sender, incoming_messages)
+    return dispatcher.submit(sender_key, process_message_batch, sender, incoming_messages)
+
+def dispatch_has_capacity(sender_key):
+    """Indica si la cola del remitente (shard o proceso del pool) admite otra ráfaga"""
+    if worker_pool:
+        return worker_pool.has_capacity(sender_key)
+    return dispatcher.has_capacity(sender_key)
+
+def drop_message_batch(sender_key, incoming_messages):
+    """
+    Descarta una ráfaga que no se pudo encolar: olvida sus IDs para que un reintento
+    de WhatsApp sí se procese y deja sus entradas del journal pendientes, así el
+    próximo arranque las reprocesa.
+    """
+    metrics.increment("webhook.batches.dropped")
+    for incoming_message in incoming_messages:
+        if incoming_message.get("message_id"):
+            seen_message_ids.delete(incoming_message["message_id"])
+
+def process_message_batch(sender, incoming_messages):
+    """
+    Procesa una ráfaga y marca sus entradas del journal como terminadas
+    (salvo si quedó diferida por el modo degradado).
+    """
+    deferred = False
+    try:
+        result = process_incoming_messages(sender, incoming_messages)
+        deferred = result == DEFERRED
+        return result
+    finally:
+        if not deferred:
+            finish_journal_entries(incoming_messages)
+
+def finish_journal_entries(incoming_messages):
+    """Marca como terminadas las entradas del journal de una ráfaga"""
+    if inbound_journal:
+        inbound_journal.mark_done([item.get("journal_id") for item in incoming_messages])
+
+def replay_inbound_journal():
+    """
+    Reencola los mensajes del journal que quedaron sin procesar en una ejecución anterior.
+    
+    Returns:
+        Número de mensajes reencolados
+    """
+    if not inbound_journal:
+        return 0
+    try:
+        entries = inbound_journal.claim_orphaned()
+    except Exception as e:
+        logger.error(f"No se pudo leer el journal de entrada: {str(e)}")
+        return 0
+    
+    replayed = 0
+    for entry in entries:
+        incoming_message = entry["payload"]
+        incoming_message["journal_id"] = entry["id"]
+        if incoming_message.get("message_id"):
+            seen_message_ids.add(incoming_message["message_id"])
+        # Si la cola está llena la entrada queda pendiente para el próximo arranque
+        if coalescer.add(entry["sender"], incoming_message):
+            replayed += 1
+    
+    if entries:
+        metrics.increment("webhook.journal.replayed", replayed)
+        logger.warning(f"Reprocesando {replayed} de {len(entries)} mensaje(s) pendientes del journal")
+    return replayed
+
+# ---- MÉTRICAS ----
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Retorna las estadísticas del despachador, del agrupador de ráfagas, del cliente
+    de WhatsApp, de la cola de salida, del journal de entrada, del pool de procesos,
+    de la caché de contexto, del modo degradado, de la cola de logs y las métricas del proceso.
+    """
+    return jsonify({
+        "dispatcher": dispatcher.get_stats(),
+        "coalescer": coalescer.get_stats(),
+        "whatsapp_client": whatsapp_client.get_stats(),
+        "outbound": outbound_sender.get_stats(),
+        "inbound_journal": inbound_journal.get_stats() if inbound_journal else None,
+        "worker_pool": worker_pool.get_stats() if worker_pool else None,
+        "context_cache": context_cache.get_stats(),
+        "conversation_summary": get_conversation_summarizer().get_stats(),
+        "cache_invalidation": get_cache_invalidation_stats(),
+        "degraded_mode": degraded_mode.get_stats(),
+        "logging": get_logging_stats(),
+        "metrics": metrics.snapshot()
+    }), 200
 
 # ---- SERVIDOR PARA DESARROLLO LOCAL ----
 
@@ -489,6 +635,9 @@ def process_webhook_messages(message_data):
 def index():
     return "WhatsApp Webhook está funcionando. Usa /webhook para recibir mensajes."
 
+# Reprocesar los mensajes que quedaron pendientes antes del último reinicio
+replay_inbound_journal()
+
 # Punto de entrada para Vercel
 handler = app
 
@@ -0,0 +1,532 @@
+"""
+Backend SQLite (modo WAL) para db_operations.
+
+Con DB_BACKEND=sqlite, supabase_client retorna un cliente con la misma API de
+tablas que supabase-py (local_query.py) cuyas consultas se traducen a SQL y se
+ejecutan en un archivo SQLite local. Sirve para despliegues de un solo nodo y
+para benchmarks: las lecturas no salen del proceso.
+
+El esquema replica supabase_schema.sql (restricciones UNIQUE, claves foráneas,
+valores por defecto e índices). Diferencias:
+
+- No hay particiones de messages: la unicidad de external_id se mantiene igual
+  que en Postgres, con un trigger que registra cada ID en message_external_ids.
+- No hay funciones RPC, así que db_operations usa sus consultas individuales
+  (p. ej. el fallback de ingest_inbound_message).
+- No hay pg_notify: cada escritura confirmada publica sus filas en el bus de
+  invalidación local (ver local_query.publish_row_changes).
+- Las fechas se guardan como texto ISO 8601 UTC con microsegundos (ver
+  local_query.normalize_timestamp), que ordena cronológicamente.
+
+Cada hilo usa su propia conexión; las escrituras son transacciones
+BEGIN IMMEDIATE, así que varios procesos pueden compartir el archivo.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+from local_query import (
+    BooleanGroup, LocalQuery, get_table_schema, new_row, normalize_row,
+    publish_row_changes, query_error, unique_violation
+)
+from postgrest.exceptions import APIError
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Operación de los eventos de cambio de filas de cada escritura. RETURNING no distingue
+# en un upsert la fila insertada de la actualizada; la invalidación de cachés solo usa el ID.
+ROW_CHANGE_OPERATIONS = {"insert": "INSERT", "upsert": "UPDATE", "update": "UPDATE", "delete": "DELETE"}
+
+# Modo de sincronización de SQLite: NORMAL sobrevive a la caída del proceso,
+# FULL también a un corte de energía (a costa de un fsync por commit)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+# Milisegundos que una escritura espera a que otro proceso libere el archivo
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
+
+# Hora actual con el mismo formato que local_query.utc_now
+_NOW = "(strftime('%Y-%m-%dT%H:%M:%f', 'now') || '000+00:00')"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    phone TEXT UNIQUE,
+    email TEXT UNIQUE,
+    full_name TEXT NOT NULL,
+    company TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    user_id TEXT REFERENCES users(id),
+    platform TEXT NOT NULL,
+    external_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active',
+    summary TEXT,
+    summary_until TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW},
+    UNIQUE(platform, external_id)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT REFERENCES conversations(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message_type TEXT NOT NULL DEFAULT 'text',
+    media_url TEXT,
+    external_id TEXT,
+    delivery_status TEXT,
+    delivery_error TEXT,
+    created_at TEXT NOT NULL DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS message_external_ids (
+    external_id TEXT PRIMARY KEY,
+    message_id TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS lead_qualification (
+    id TEXT PRIMARY KEY,
+    user_id TEXT REFERENCES users(id),
+    conversation_id TEXT REFERENCES conversations(id),
+    consent BOOLEAN DEFAULT 0,
+    current_step TEXT DEFAULT 'start',
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW},
+    UNIQUE(user_id, conversation_id)
+);
+
+CREATE TABLE IF NOT EXISTS bant_data (
+    id TEXT PRIMARY KEY,
+    lead_qualification_id TEXT UNIQUE REFERENCES lead_qualification(id) ON DELETE CASCADE,
+    budget TEXT,
+    authority TEXT,
+    need TEXT,
+    timeline TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS requirements (
+    id TEXT PRIMARY KEY,
+    lead_qualification_id TEXT UNIQUE REFERENCES lead_qualification(id) ON DELETE CASCADE,
+    app_type TEXT,
+    deadline TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS features (
+    id TEXT PRIMARY KEY,
+    requirement_id TEXT REFERENCES requirements(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    description TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    UNIQUE(requirement_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS integrations (
+    id TEXT PRIMARY KEY,
+    requirement_id TEXT REFERENCES requirements(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    description TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    UNIQUE(requirement_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS meetings (
+    id TEXT PRIMARY KEY,
+    user_id TEXT REFERENCES users(id),
+    lead_qualification_id TEXT REFERENCES lead_qualification(id),
+    outlook_meeting_id TEXT,
+    subject TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'scheduled',
+    online_meeting_url TEXT,
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+-- Registra el ID externo de cada mensaje nuevo; un duplicado falla con UNIQUE
+-- y deshace el INSERT en messages, como register_message_external_id en Postgres
+CREATE TRIGGER IF NOT EXISTS messages_register_external_id
+AFTER INSERT ON messages
+WHEN NEW.external_id IS NOT NULL
+BEGIN
+    INSERT INTO message_external_ids (external_id, message_id, created_at)
+    VALUES (NEW.external_id, NEW.id, NEW.created_at);
+END;
+
+-- ID externo asignado o cambiado después (p. ej. el wamid de un mensaje saliente):
+-- se libera el anterior y se registra el nuevo
+CREATE TRIGGER IF NOT EXISTS messages_update_external_id
+AFTER UPDATE OF external_id ON messages
+WHEN NEW.external_id IS NOT OLD.external_id
+BEGIN
+    DELETE FROM message_external_ids WHERE external_id = OLD.external_id;
+    INSERT INTO message_external_ids (external_id, message_id, created_at)
+    SELECT NEW.external_id, NEW.id, NEW.created_at
+    WHERE NEW.external_id IS NOT NULL;
+END;
+
+-- Índices de supabase_schema.sql
+CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations(user_id);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created_at ON messages(conversation_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_system ON messages(conversation_id, created_at) WHERE role = 'system';
+CREATE INDEX IF NOT EXISTS idx_lead_qualification_conversation_id ON lead_qualification(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_features_requirement_id ON features(requirement_id);
+CREATE INDEX IF NOT EXISTS idx_integrations_requirement_id ON integrations(requirement_id);
+CREATE INDEX IF NOT EXISTS idx_meetings_user_start_time ON meetings(user_id, start_time);
+CREATE INDEX IF NOT EXISTS idx_meetings_outlook_meeting_id ON meetings(outlook_meeting_id) WHERE outlook_meeting_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_meetings_lead_qualification_id ON meetings(lead_qualification_id);
+CREATE INDEX IF NOT EXISTS idx_meetings_user_created_at_id ON meetings(user_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_message_external_ids_created_at ON message_external_ids(created_at);
+"""
+
+_COMPARISON_OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _glob_pattern(pattern: str) -> str:
+    """Convierte un patrón LIKE de PostgREST (% o * y _) a GLOB (sensible a mayúsculas)"""
+    translated = []
+    for char in pattern:
+        if char in ("%", "*"):
+            translated.append("*")
+        elif char == "_":
+            translated.append("?")
+        elif char in ("?", "["):
+            translated.append(f"[{char}]")
+        else:
+            translated.append(char)
+    return "".join(translated)
+
+
+class SQLiteDatabase:
+    """
+    Base de datos SQLite que ejecuta las consultas de local_query.py.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Ruta del archivo SQLite (se crea con el esquema si no existe)
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        # Columnas por tabla y las booleanas (SQLite las guarda como 0/1)
+        self._columns: Dict[str, set] = {}
+        self._booleans: Dict[str, set] = {}
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        for table in tables:
+            info = connection.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+            self._columns[table] = {column[1] for column in info}
+            self._booleans[table] = {column[1] for column in info if column[2].upper() == "BOOLEAN"}
+        logger.info(f"Base de datos SQLite abierta en {path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexión del hilo actual"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def table(self, table_name: str) -> LocalQuery:
+        """Inicia una consulta sobre una tabla (misma API que supabase.table)"""
+        return LocalQuery(self, table_name)
+
+    def close(self):
+        """Cierra las conexiones de todos los hilos"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    # ---- TRADUCCIÓN A SQL ----
+
+    def _column(self, table: str, column: str) -> str:
+        """Valida una columna (los nombres no pueden ir como parámetros) y la cita"""
+        if column not in self._columns.get(table, ()):
+            raise query_error(f'column {table}.{column} does not exist', code="42703")
+        return _quote(column)
+
+    def _value(self, table: str, column: str, value):
+        """Adapta un valor de filtro al tipo guardado en SQLite"""
+        if column in self._booleans.get(table, ()) and isinstance(value, str):
+            return 1 if value.strip().lower() in ("true", "t", "1") else 0
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def _condition(self, table: str, node, params: List) -> str:
+        """Traduce una condición o un grupo (or_/and) a SQL con parámetros"""
+        if isinstance(node, BooleanGroup):
+            joiner = " OR " if node.operator == "or" else " AND "
+            parts = [self._condition(table, item, params) for item in node.items]
+            sql = "(" + joiner.join(parts) + ")" if parts else ("0" if node.operator == "or" else "1")
+            return f"NOT {sql}" if node.negated else sql
+
+        column = self._column(table, node.column)
+        operator, value = node.operator, node.value
+        if operator in _COMPARISON_OPERATORS:
+            params.append(self._value(table, node.column, value))
+            sql = f"{column} {_COMPARISON_OPERATORS[operator]} ?"
+        elif operator == "in":
+            values = [self._value(table, node.column, item) for item in value]
+            params.extend(values)
+            sql = f"{column} IN ({', '.join('?' for _ in values)})" if values else "0"
+        elif operator == "is":
+            if value is None:
+                sql = f"{column} IS NULL"
+            else:
+                params.append(self._value(table, node.column, value))
+                sql = f"{column} IS ?"
+        elif operator == "like":
+            params.append(_glob_pattern(str(value)))
+            sql = f"{column} GLOB ?"
+        elif operator == "ilike":
+            params.append(str(value).replace("*", "%"))
+            sql = f"{column} LIKE ?"
+        else:
+            raise query_error(f"Operador no soportado: {operator}")
+        if node.negated:
+            # Como en SQL, la negación de una comparación con NULL sigue siendo falsa
+            return f"({column} IS NOT NULL AND NOT ({sql}))" if operator != "is" else f"NOT ({sql})"
+        return sql
+
+    def _where(self, query: LocalQuery, params: List) -> str:
+        if not query.conditions:
+            return ""
+        parts = [self._condition(query.table_name, condition, params) for condition in query.conditions]
+        return " WHERE " + " AND ".join(parts)
+
+    def _order_by(self, query: LocalQuery) -> str:
+        if not query.orders:
+            return ""
+        parts = []
+        for column, desc, nullsfirst in query.orders:
+            nulls_first = desc if nullsfirst is None else nullsfirst
+            parts.append(
+                f"{self._column(query.table_name, column)} {'DESC' if desc else 'ASC'} "
+                f"NULLS {'FIRST' if nulls_first else 'LAST'}"
+            )
+        return " ORDER BY " + ", ".join(parts)
+
+    def _rows(self, table: str, cursor) -> List[Dict]:
+        """Convierte las filas de SQLite a diccionarios (booleanas como bool)"""
+        booleans = self._booleans.get(table, ())
+        rows = []
+        for record in cursor.fetchall():
+            row = dict(record)
+            for column in booleans:
+                if row.get(column) is not None:
+                    row[column] = bool(row[column])
+            rows.append(row)
+        return rows
+
+    # ---- EJECUCIÓN ----
+
+    def execute(self, query: LocalQuery):
+        """Ejecuta una consulta construida con LocalQuery"""
+        if query.table_name not in self._columns:
+            raise query_error(f'relation "public.{query.table_name}" does not exist', code="42P01")
+        connection = self._connection()
+        if query.operation == "select":
+            return self._select(connection, query)
+
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if query.operation == "insert":
+                    rows = self._insert(connection, query)
+                elif query.operation == "upsert":
+                    rows = self._upsert(connection, query)
+                elif query.operation == "update":
+                    rows = self._update(connection, query)
+                elif query.operation == "delete":
+                    rows = self._delete(connection, query)
+                else:
+                    raise query_error(f"Operación no soportada: {query.operation}")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        except sqlite3.IntegrityError as e:
+            raise self._integrity_error(query.table_name, e) from e
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                # Mismo código que lock_not_available en Postgres
+                raise query_error(f"La base de datos SQLite está bloqueada: {str(e)}", code="55P03") from e
+            raise
+        # Tras el COMMIT, como pg_notify
+        operation = ROW_CHANGE_OPERATIONS[query.operation]
+        primary_key = get_table_schema(query.table_name).primary_key
+        publish_row_changes(query.table_name, [(operation, row.get(primary_key)) for row in rows])
+        return query.respond(query.sort(rows) if query.orders else rows)
+
+    def _select(self, connection, query: LocalQuery):
+        table = query.table_name
+        params: List = []
+        where = self._where(query, params)
+        if query.columns is not None:
+            columns = ", ".join(self._column(table, column) for column in query.columns)
+        else:
+            columns = "*"
+        sql = f"SELECT {columns} FROM {_quote(table)}{where}{self._order_by(query)}"
+        page_params = list(params)
+        if query.row_limit is not None or query.row_offset:
+            sql += " LIMIT ? OFFSET ?"
+            page_params += [query.row_limit if query.row_limit is not None else -1, query.row_offset]
+        rows = self._rows(table, connection.execute(sql, page_params))
+
+        total = None
+        if query.count:
+            total = connection.execute(f"SELECT COUNT(*) FROM {_quote(table)}{where}", params).fetchone()[0]
+        return query.respond(rows, total)
+
+    def _payload_rows(self, query: LocalQuery) -> List[Dict]:
+        payload = query.payload
+        if isinstance(payload, dict):
+            return [payload]
+        if isinstance(payload, list) and all(isinstance(row, dict) for row in payload):
+            return payload
+        raise query_error(f"Datos inválidos para {query.operation} en '{query.table_name}'")
+
+    def _insert_sql(self, table: str, row: Dict):
+        columns = [self._column(table, column) for column in row]
+        params = [self._value(table, column, value) for column, value in row.items()]
+        sql = (f"INSERT INTO {_quote(table)} ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        return sql, params
+
+    def _insert(self, connection, query: LocalQuery) -> List[Dict]:
+        table = query.table_name
+        schema = get_table_schema(table)
+        rows = []
+        for values in self._payload_rows(query):
+            sql, params = self._insert_sql(table, new_row(schema, values))
+            rows.extend(self._rows(table, connection.execute(sql + " RETURNING *", params)))
+        return rows
+
+    def _upsert(self, connection, query: LocalQuery) -> List[Dict]:
+        table = query.table_name
+        schema = get_table_schema(table)
+        conflict = query.on_conflict or [schema.primary_key]
+        target = ", ".join(self._column(table, column) for column in conflict)
+        rows = []
+        for values in self._payload_rows(query):
+            sql, params = self._insert_sql(table, new_row(schema, values))
+            if query.ignore_duplicates:
+                action = "DO NOTHING"
+            else:
+                # ON CONFLICT DO UPDATE: solo cambian las columnas enviadas
+                changed = [column for column in normalize_row(schema, values) if column != schema.primary_key]
+                assignments = ", ".join(
+                    f"{self._column(table, column)} = excluded.{_quote(column)}" for column in changed or conflict
+                )
+                action = f"DO UPDATE SET {assignments}"
+            sql += f" ON CONFLICT ({target}) {action} RETURNING *"
+            try:
+                rows.extend(self._rows(table, connection.execute(sql, params)))
+            except sqlite3.OperationalError as e:
+                if "ON CONFLICT clause does not match" in str(e):
+                    raise query_error(
+                        "there is no unique or exclusion constraint matching the ON CONFLICT specification",
+                        code="42P10"
+                    ) from e
+                raise
+        return rows
+
+    def _update(self, connection, query: LocalQuery) -> List[Dict]:
+        if not isinstance(query.payload, dict) or not query.payload:
+            raise query_error("update espera un diccionario con las columnas a cambiar")
+        table = query.table_name
+        changes = normalize_row(get_table_schema(table), query.payload)
+        assignments = ", ".join(f"{self._column(table, column)} = ?" for column in changes)
+        params = [self._value(table, column, value) for column, value in changes.items()]
+        where = self._where(query, params)
+        sql = f"UPDATE {_quote(table)} SET {assignments}{where} RETURNING *"
+        return self._rows(table, connection.execute(sql, params))
+
+    def _delete(self, connection, query: LocalQuery) -> List[Dict]:
+        table = query.table_name
+        params: List = []
+        where = self._where(query, params)
+        return self._rows(table, connection.execute(f"DELETE FROM {_quote(table)}{where} RETURNING *", params))
+
+    def _integrity_error(self, table: str, error: sqlite3.IntegrityError) -> APIError:
+        """Traduce un error de integridad de SQLite al código de Postgres correspondiente"""
+        message = str(error)
+        if message.startswith("UNIQUE constraint failed"):
+            # "UNIQUE constraint failed: users.phone" o "...: conversations.platform, conversations.external_id"
+            targets = [item.strip() for item in message.split(":", 1)[1].split(",")]
+            constraint_table = targets[0].split(".")[0] if targets else table
+            columns = [target.split(".", 1)[-1] for target in targets]
+            return unique_violation(constraint_table, columns)
+        if message.startswith("NOT NULL constraint failed"):
+            return query_error(message, code="23502")
+        if message.startswith("FOREIGN KEY constraint failed"):
+            return query_error(message, code="23503")
+        return query_error(message, code="23000")
+
+    def get_stats(self):
+        """Retorna la ruta del archivo y el número de filas por tabla"""
+        connection = self._connection()
+        rows = {
+            table: connection.execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+            for table in sorted(self._columns)
+        }
+        return {"path": self.path, "rows": rows}
+
+
+# Base de datos compartida por los clientes del proceso, por ruta
+_sqlite_databases: Dict[str, SQLiteDatabase] = {}
+_sqlite_databases_lock = threading.Lock()
+
+
+def get_sqlite_database(path: str) -> SQLiteDatabase:
+    """Retorna la base de datos SQLite del proceso para una ruta (la abre si hace falta)"""
+    key = os.path.abspath(path)
+    database = _sqlite_databases.get(key)
+    if database is None:
+        with _sqlite_databases_lock:
+            database = _sqlite_databases.get(key)
+            if database is None:
+                database = SQLiteDatabase(path)
+                _sqlite_databases[key] = database
+    return database
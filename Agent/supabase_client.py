@@ -1,9 +1,18 @@
 import os
+import asyncio
 import logging
-from supabase import create_client, Client
+from supabase import create_client, acreate_client, Client
+from supabase.lib.client_options import SyncClientOptions, AsyncClientOptions
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
 import httpx
 import sys
+from utils.logging_setup import configure_logging
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from supabase_instrumentation import instrument
+from local_query import LocalClient, AsyncLocalClient, AsyncLocalQuery, LocalResponse
+from memory_db import get_memory_database
+from sqlite_db import get_sqlite_database
 
 # Cargar variables de entorno desde múltiples ubicaciones
 # Primero intentar cargar desde el directorio actual
@@ -16,10 +25,7 @@ parent_dir = os.path.dirname(script_dir)
 load_dotenv(os.path.join(parent_dir, '.env'))
 
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Configuración de Supabase
@@ -31,265 +37,188 @@ logger = logging.getLogger(__name__)
 logger.info(f"NEXT_PUBLIC_SUPABASE_URL: {'Configurado' if SUPABASE_URL else 'No configurado'}")
 logger.info(f"SUPABASE_SERVICE_ROLE_KEY: {'Configurado' if SUPABASE_KEY else 'No configurado'}")
 
-# Configuración de timeout (60 segundos)
-REQUEST_TIMEOUT = 60
+# Backend de almacenamiento de db_operations: "supabase" (por defecto; sin credenciales
+# usa el cliente mock en memoria), "sqlite" (archivo local en modo WAL, ver sqlite_db.py)
+# o "memory" (base de datos en memoria del proceso, ver memory_db.py)
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").lower()
+SQLITE_DATABASE_PATH = os.getenv("SQLITE_DATABASE_PATH", "agent.db")
+
+# Timeout de cada consulta a PostgREST (por defecto la librería espera 120 segundos)
+REQUEST_TIMEOUT = float(os.getenv("SUPABASE_REQUEST_TIMEOUT", 15))
+
+# Circuit breaker de las consultas: con Supabase caído o lento las llamadas fallan
+# de inmediato en lugar de esperar el timeout (ver utils/circuit_breaker.py)
+SUPABASE_BREAKER_ENABLED = os.getenv("SUPABASE_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+SUPABASE_BREAKER_WINDOW = float(os.getenv("SUPABASE_BREAKER_WINDOW", 30))
+SUPABASE_BREAKER_MIN_CALLS = int(os.getenv("SUPABASE_BREAKER_MIN_CALLS", 10))
+SUPABASE_BREAKER_FAILURE_RATE = float(os.getenv("SUPABASE_BREAKER_FAILURE_RATE", 0.5))
+SUPABASE_BREAKER_SLOW_CALL = float(os.getenv("SUPABASE_BREAKER_SLOW_CALL", 5))
+SUPABASE_BREAKER_SLOW_RATE = float(os.getenv("SUPABASE_BREAKER_SLOW_RATE", 0.8))
+SUPABASE_BREAKER_OPEN_SECONDS = float(os.getenv("SUPABASE_BREAKER_OPEN_SECONDS", 15))
+
+# Códigos de error que indican que la base de datos no está disponible (no un error
+# de la consulta): conexión (08), recursos (53), cancelación/timeout (57), sistema (58)
+# y los errores de conexión y de pool de PostgREST
+_UNAVAILABLE_SQLSTATE_CLASSES = ("08", "53", "57", "58")
+_UNAVAILABLE_POSTGREST_CODES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003")
+
+def is_database_unavailable(error: Exception) -> bool:
+    """
+    Indica si un error se debe a que Supabase no responde (red, timeout, 5xx,
+    circuito abierto) y no a la consulta en sí (p. ej. una violación de UNIQUE).
+    """
+    if isinstance(error, (CircuitOpenError, httpx.TransportError)):
+        return True
+    if isinstance(error, APIError):
+        code = str(error.code or "")
+        return (
+            code.startswith(_UNAVAILABLE_SQLSTATE_CLASSES)
+            or code in _UNAVAILABLE_POSTGREST_CODES
+            or (len(code) == 3 and code.startswith("5"))
+        )
+    return False
+
+def _log_breaker_transition(old_state, new_state):
+    if new_state == "open":
+        logger.error(f"Circuito de Supabase abierto ({old_state} -> {new_state}): las consultas fallarán de inmediato")
+    else:
+        logger.warning(f"Circuito de Supabase: {old_state} -> {new_state}")
+
+# Compartido por el cliente síncrono y el asíncrono
+supabase_breaker = CircuitBreaker(
+    name="supabase",
+    window=SUPABASE_BREAKER_WINDOW,
+    min_calls=SUPABASE_BREAKER_MIN_CALLS,
+    failure_rate=SUPABASE_BREAKER_FAILURE_RATE,
+    slow_call_duration=SUPABASE_BREAKER_SLOW_CALL,
+    slow_call_rate=SUPABASE_BREAKER_SLOW_RATE,
+    open_duration=SUPABASE_BREAKER_OPEN_SECONDS,
+    on_state_change=_log_breaker_transition
+) if SUPABASE_BREAKER_ENABLED else None
+
+def get_supabase_breaker():
+    """Retorna el circuit breaker de Supabase (None si está desactivado)"""
+    return supabase_breaker
+
+def _instrument(client):
+    return instrument(client, breaker=supabase_breaker, is_failure=is_database_unavailable)
+
+def _instrument_local(client):
+    """
+    Instrumenta un cliente que ejecuta las consultas en el proceso (memoria o SQLite).
+    Sin circuit breaker: no hay red que pueda caerse y su lock añadiría contención
+    a cada consulta.
+    """
+    return instrument(client)
+
+def is_remote_backend() -> bool:
+    """Indica si las consultas van por red a Supabase y no a un backend del proceso"""
+    return DB_BACKEND == "supabase" and bool(SUPABASE_URL and SUPABASE_KEY)
 
 # Variable global para el cliente de Supabase
 supabase = None
 
+# Clientes del backend local (DB_BACKEND distinto de "supabase")
+_local_clients = {}
+
+def _get_local_client(asynchronous=False):
+    """Retorna el cliente del backend local configurado en DB_BACKEND"""
+    client = _local_clients.get(asynchronous)
+    if client is None:
+        if DB_BACKEND == "sqlite":
+            database = get_sqlite_database(SQLITE_DATABASE_PATH)
+            client_class = AsyncLocalClient if asynchronous else LocalClient
+            client = _instrument_local(client_class(database))
+        else:
+            if DB_BACKEND != "memory":
+                logger.warning(f"DB_BACKEND '{DB_BACKEND}' no reconocido; usando la base de datos en memoria")
+            client = _instrument_local(MockAsyncSupabaseClient() if asynchronous else MockSupabaseClient())
+        _local_clients[asynchronous] = client
+        logger.info(f"Usando el backend de base de datos '{DB_BACKEND}'")
+    return client
+
 def get_supabase_client():
     """Retorna el cliente de Supabase con timeout configurado"""
     global supabase
     
+    if DB_BACKEND != "supabase":
+        return _get_local_client()
+    
     # Inicializar el cliente solo si no existe y las variables de entorno están configuradas
     if supabase is None and SUPABASE_URL and SUPABASE_KEY:
         try:
             # Crear cliente Supabase con timeout configurado
             # Nota: No usamos http_client ya que no es compatible con la versión actual
-            supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            supabase = _instrument(create_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=SyncClientOptions(postgrest_client_timeout=REQUEST_TIMEOUT)
+            ))
             logger.info("Cliente Supabase inicializado")
         except Exception as e:
             logger.error(f"Error al inicializar el cliente de Supabase: {str(e)}")
             # Retornar un objeto mock si hay error
-            return MockSupabaseClient()
+            return _instrument_local(MockSupabaseClient())
     
     # Si las variables de entorno no están configuradas, retornar un objeto mock
     if not SUPABASE_URL or not SUPABASE_KEY:
         logger.warning("Variables de entorno de Supabase no configuradas. Usando cliente mock.")
-        return MockSupabaseClient()
+        return _instrument_local(MockSupabaseClient())
     
     return supabase
 
-# Clase mock para cuando Supabase no está disponible
-class MockSupabaseClient:
-    """Cliente mock de Supabase para cuando no está disponible"""
-    
-    def table(self, table_name):
-        table = MockTable()
-        table.table_name = table_name
-        return table
+# Cliente asíncrono compartido y el bucle de eventos al que pertenece
+async_supabase = None
+_async_supabase_loop = None
 
-class MockTable:
-    """Tabla mock para cuando Supabase no está disponible"""
-    
-    def __init__(self):
-        self.table_name = None
-        self.filters = {}
-        self.selected_fields = ["*"]
-        self.order_field = None
-        self.order_ascending = True
-    
-    def select(self, *args):
-        self.selected_fields = args if args else ["*"]
-        return self
-    
-    def insert(self, data):
-        # Simular inserción retornando el mismo dato con un ID
-        if isinstance(data, dict):
-            # Generar un ID único para el nuevo registro
-            data_id = "mock-id-" + str(hash(str(data)) % 10000)
-            data["id"] = data_id
-            # Añadir timestamps
-            if "created_at" not in data:
-                data["created_at"] = "2025-05-09T20:00:00.000Z"
-            if "updated_at" not in data:
-                data["updated_at"] = "2025-05-09T20:00:00.000Z"
-            
-            # Guardar el mensaje real para usarlo en las consultas posteriores
-            if self.table_name == "messages" and "content" in data:
-                # Almacenar el mensaje en una variable de clase para que esté disponible en futuras consultas
-                if not hasattr(MockTable, "_stored_messages"):
-                    MockTable._stored_messages = []
-                
-                # Añadir el mensaje a la lista de mensajes almacenados
-                MockTable._stored_messages.append(data)
-                
-                # Limitar la lista a los últimos 20 mensajes para evitar que crezca demasiado
-                if len(MockTable._stored_messages) > 20:
-                    MockTable._stored_messages = MockTable._stored_messages[-20:]
-                
-                logger.info(f"[MOCK] Mensaje almacenado: {data['role']} - '{data['content']}'")
-            
-            logger.info(f"[MOCK] Insertando datos en tabla '{self.table_name}': {data}")
-        return self
-    
-    def update(self, data):
-        # Simular actualización retornando el mismo dato
-        if isinstance(data, dict):
-            # Actualizar timestamp
-            if "updated_at" not in data:
-                data["updated_at"] = "2025-05-09T20:00:00.000Z"
-            logger.info(f"[MOCK] Actualizando datos en tabla '{self.table_name}': {data}")
-        return self
+async def get_async_supabase_client():
+    """
+    Retorna el cliente asíncrono de Supabase compartido por el bucle de eventos actual.
+    Si el bucle cambia (p. ej. varios asyncio.run en un script) se crea uno nuevo,
+    porque sus conexiones HTTP pertenecen al bucle en que se abrieron.
+    """
+    global async_supabase, _async_supabase_loop
     
-    def delete(self):
-        # Simular eliminación
-        return self
+    if DB_BACKEND != "supabase":
+        return _get_local_client(asynchronous=True)
     
-    def eq(self, field, value):
-        self.filters[field] = value
-        return self
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        return _instrument_local(MockAsyncSupabaseClient())
     
-    def order(self, field, options=None):
-        self.order_field = field
-        if options and isinstance(options, dict):
-            self.order_ascending = options.get("ascending", True)
-        return self
+    loop = asyncio.get_running_loop()
+    if async_supabase is None or _async_supabase_loop is not loop:
+        try:
+            client = await acreate_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=AsyncClientOptions(postgrest_client_timeout=REQUEST_TIMEOUT)
+            )
+        except Exception as e:
+            logger.error(f"Error al inicializar el cliente asíncrono de Supabase: {str(e)}")
+            return _instrument_local(MockAsyncSupabaseClient())
+        # Si otra corrutina lo creó mientras esperábamos, conservar el suyo
+        if async_supabase is None or _async_supabase_loop is not loop:
+            async_supabase = _instrument(client)
+            _async_supabase_loop = loop
+            logger.info("Cliente asíncrono de Supabase inicializado")
+    return async_supabase
+
+# Cliente mock para cuando Supabase no está disponible: ejecuta las consultas sobre
+# una base de datos en memoria compartida por el proceso (memory_db.py)
+class MockSupabaseClient(LocalClient):
+    """Cliente mock de Supabase respaldado por la base de datos en memoria"""
     
-    def execute(self):
-        # Generar datos mock según la tabla y filtros
-        mock_data = self._generate_mock_data()
-        logger.info(f"[MOCK] Ejecutando consulta en tabla '{self.table_name}' con filtros {self.filters}")
-        return MockResponse(mock_data)
+    def __init__(self, database=None):
+        super().__init__(database if database is not None else get_memory_database())
     
-    def _generate_mock_data(self):
-        """Genera datos mock según la tabla y filtros aplicados"""
-        # Datos base para diferentes tablas
-        mock_data = {
-            "users": {
-                "id": "mock-user-id",
-                "created_at": "2025-05-09T20:00:00.000Z",
-                "updated_at": "2025-05-09T20:00:00.000Z",
-                "phone": "573153041548",  # Usar un número real para pruebas
-                "email": "mock-email@example.com",
-                "full_name": "Usuario Mock",
-                "company": "Empresa Mock"
-            },
-            "conversations": {
-                "id": "mock-conversation-id",
-                "created_at": "2025-05-09T20:00:00.000Z",
-                "updated_at": "2025-05-09T20:00:00.000Z",
-                "user_id": "mock-user-id",
-                "external_id": "573153041548",  # Usar un número real para pruebas
-                "platform": "whatsapp",
-                "status": "active"
-            }
-        }
-        
-        # Para la tabla de mensajes, generamos una lista de mensajes para simular una conversación
-        if self.table_name == "messages":
-            # Si hay un filtro de conversation_id, usamos ese ID
-            conversation_id = self.filters.get("conversation_id", "mock-conversation-id")
-            
-            # Verificar si estamos buscando un mensaje específico o todos los mensajes de una conversación
-            if "id" in self.filters:
-                # Si buscamos un mensaje específico, devolvemos solo ese mensaje
-                return [{
-                    "id": self.filters["id"],
-                    "created_at": "2025-05-09T20:00:00.000Z",
-                    "updated_at": "2025-05-09T20:00:00.000Z",
-                    "conversation_id": conversation_id,
-                    "role": "user",
-                    "content": "Mensaje específico",
-                    "message_type": "text",
-                    "media_url": None,
-                    "external_id": "mock-external-id-specific"
-                }]
-            else:
-                # Si buscamos todos los mensajes de una conversación, usamos los mensajes almacenados si existen
-                if hasattr(MockTable, "_stored_messages") and MockTable._stored_messages:
-                    # Usar los mensajes almacenados, pero asegurarnos de que tengan el conversation_id correcto
-                    stored_messages = []
-                    for msg in MockTable._stored_messages:
-                        msg_copy = msg.copy()
-                        msg_copy["conversation_id"] = conversation_id
-                        stored_messages.append(msg_copy)
-                    
-                    # Asegurar que haya un mensaje de sistema al inicio
-                    has_system_message = any(msg["role"] == "system" for msg in stored_messages)
-                    if not has_system_message:
-                        stored_messages.insert(0, {
-                            "id": "mock-message-system",
-                            "created_at": "2025-05-09T20:00:00.000Z",
-                            "updated_at": "2025-05-09T20:00:00.000Z",
-                            "conversation_id": conversation_id,
-                            "role": "system",
-                            "content": "Iniciando conversación con un potencial cliente.",
-                            "message_type": "text",
-                            "media_url": None,
-                            "external_id": None
-                        })
-                    
-                    logger.info(f"[MOCK] Retornando {len(stored_messages)} mensajes almacenados")
-                    return stored_messages
-                else:
-                    # Si no hay mensajes almacenados, usar datos predefinidos
-                    logger.info("[MOCK] No hay mensajes almacenados, usando datos predefinidos")
-                    return [
-                        {
-                            "id": "mock-message-system",
-                            "created_at": "2025-05-09T20:00:00.000Z",
-                            "updated_at": "2025-05-09T20:00:00.000Z",
-                            "conversation_id": conversation_id,
-                            "role": "system",
-                            "content": "Iniciando conversación con un potencial cliente.",
-                            "message_type": "text",
-                            "media_url": None,
-                            "external_id": None
-                        },
-                        {
-                            "id": "mock-message-assistant-1",
-                            "created_at": "2025-05-09T20:01:00.000Z",
-                            "updated_at": "2025-05-09T20:01:00.000Z",
-                            "conversation_id": conversation_id,
-                            "role": "assistant",
-                            "content": "¡Hola! Soy el asistente virtual de nuestra empresa de desarrollo de software. ¿En qué puedo ayudarte hoy?",
-                            "message_type": "text",
-                            "media_url": None,
-                            "external_id": None
-                        },
-                        {
-                            "id": "mock-message-user-1",
-                            "created_at": "2025-05-09T20:02:00.000Z",
-                            "updated_at": "2025-05-09T20:02:00.000Z",
-                            "conversation_id": conversation_id,
-                            "role": "user",
-                            "content": "Hola",
-                            "message_type": "text",
-                            "media_url": None,
-                            "external_id": "mock-external-id-1"
-                        }
-                    ]
-        
-        # Usar datos por defecto si no hay tabla específica
-        default_data = {
-            "id": "mock-id-12345",
-            "created_at": "2025-05-09T20:00:00.000Z",
-            "updated_at": "2025-05-09T20:00:00.000Z"
-        }
-        
-        # Seleccionar datos según la tabla
-        data = mock_data.get(self.table_name, default_data)
-        
-        # Aplicar filtros si existen
-        if self.filters:
-            # En un caso real, filtrarías los datos aquí
-            # Para el mock, simplemente aseguramos que los datos tengan los campos filtrados
-            for field, value in self.filters.items():
-                data[field] = value
-        
-        return [data]
+    @property
+    def database(self):
+        return self.backend
 
-class MockResponse:
-    """Respuesta mock para cuando Supabase no está disponible"""
+class MockAsyncSupabaseClient(MockSupabaseClient):
+    """Cliente mock asíncrono: mismas consultas, con execute() como corrutina"""
     
-    def __init__(self, data=None):
-        # Usar datos proporcionados o datos por defecto
-        self.data = data if data is not None else [{
-            "id": "mock-id-12345",
-            "created_at": "2025-05-09T20:00:00.000Z",
-            "updated_at": "2025-05-09T20:00:00.000Z",
-            "phone": "mock-phone",
-            "email": "mock-email@example.com",
-            "full_name": "Usuario Mock",
-            "company": "Empresa Mock",
-            "external_id": "mock-external-id",
-            "platform": "whatsapp",
-            "status": "active",
-            "user_id": "mock-user-id",
-            "conversation_id": "mock-conversation-id",
-            "role": "user",
-            "content": "Mensaje mock",
-            "message_type": "text",
-            "media_url": None
-        }]
+    query_class = AsyncLocalQuery
+
+# Respuesta de las consultas del cliente mock (data y count, como postgrest-py)
+MockResponse = LocalResponse
@@ -0,0 +1,466 @@
+"""
+Instrumentación de las consultas a Supabase por turno.
+
+`instrument(client)` envuelve el cliente (síncrono o asíncrono, real o mock) y
+registra de cada consulta la tabla, la operación, los filtros, la latencia y el
+número de filas. Las consultas se agrupan por turno: `db_turn` marca un turno
+(un lote de mensajes de WhatsApp, desde la ingesta hasta las herramientas del
+agente) y al terminar publica en el log y en `utils.metrics` los totales del
+turno. Las consultas idénticas repetidas dentro de un turno se marcan como
+patrón N+1.
+
+El turno actual viaja en una variable de contexto, así que lo heredan las
+corrutinas lanzadas con `asyncio.gather` y los hilos de LangGraph (que copian el
+contexto); las tareas de segundo plano quedan fuera del turno.
+
+En pruebas y scripts, `query_budget` exige un máximo de consultas por escenario:
+
+    with query_budget(6, "mensaje de un usuario nuevo"):
+        process_incoming_messages(sender, messages)
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils import metrics
+from utils.circuit_breaker import CircuitOpenError
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Activar la instrumentación del cliente (true/false)
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "true").lower() in ("1", "true", "yes")
+
+# Repeticiones de una misma consulta en un turno a partir de las cuales se marca como N+1
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", 2))
+
+# Consultas por turno a partir de las cuales se registra una advertencia (0 = sin límite)
+DB_TURN_QUERY_BUDGET = int(os.getenv("DB_TURN_QUERY_BUDGET", 0))
+
+# Longitud máxima con la que se registra el valor de un filtro
+MAX_FILTER_VALUE_CHARS = 80
+
+# Métodos que definen la operación de la consulta
+OPERATIONS = ("select", "insert", "upsert", "update", "delete")
+
+# Turno en curso del contexto actual
+_current_turn = contextvars.ContextVar("db_turn", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Se lanza cuando un escenario supera su presupuesto de consultas"""
+    pass
+
+
+class QueryRecord:
+    """Una consulta ejecutada: tabla, operación, filtros, latencia y filas"""
+
+    __slots__ = ("table", "operation", "filters", "latency", "rows", "error", "payload")
+
+    def __init__(self, table, operation, filters, latency, rows, error=None, payload=None):
+        self.table = table
+        self.operation = operation
+        self.filters = filters
+        self.latency = latency
+        self.rows = rows
+        self.error = error
+        # Huella de los datos escritos (insert, upsert, update); no se registra el contenido
+        self.payload = payload
+
+    @property
+    def key(self):
+        """Identidad de la consulta para detectar repeticiones"""
+        return (self.table, self.operation, self.filters, self.payload)
+
+    def describe(self) -> str:
+        """Descripción legible de la consulta"""
+        filters = ".".join(self.filters)
+        return f"{self.operation} {self.table}" + (f" .{filters}" if filters else "")
+
+    def to_dict(self) -> Dict:
+        return {
+            "table": self.table,
+            "operation": self.operation,
+            "filters": list(self.filters),
+            "latency_ms": round(self.latency * 1000, 2),
+            "rows": self.rows,
+            "error": self.error
+        }
+
+
+class TurnRecorder:
+    """Consultas registradas durante un turno"""
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Nombre del turno (aparece en el log)
+        """
+        self.name = name
+        self.records: List[QueryRecord] = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add(self, record: QueryRecord):
+        with self._lock:
+            self.records.append(record)
+
+    @property
+    def query_count(self) -> int:
+        return len(self.records)
+
+    def repeated_queries(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> List[Dict]:
+        """
+        Retorna las consultas idénticas que se repitieron al menos `threshold` veces.
+
+        Returns:
+            Lista de {query, count} ordenada por repeticiones
+        """
+        with self._lock:
+            records = list(self.records)
+        counts = Counter(record.key for record in records)
+        examples = {}
+        for record in records:
+            examples.setdefault(record.key, record)
+        return [
+            {"query": examples[key].describe(), "count": count}
+            for key, count in counts.most_common()
+            if count >= max(threshold, 2)
+        ]
+
+    def summary(self) -> Dict:
+        """
+        Retorna los totales del turno: consultas, latencia acumulada, filas,
+        errores, consultas por tabla y operación y patrones N+1.
+        """
+        with self._lock:
+            records = list(self.records)
+        by_table = Counter(f"{record.operation} {record.table}" for record in records)
+        return {
+            "turn": self.name,
+            "queries": len(records),
+            "db_time_ms": round(sum(record.latency for record in records) * 1000, 2),
+            "turn_time_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "rows": sum(record.rows for record in records),
+            "errors": sum(1 for record in records if record.error),
+            "by_table": dict(by_table),
+            "n_plus_one": self.repeated_queries()
+        }
+
+
+def current_turn() -> Optional[TurnRecorder]:
+    """Retorna el turno en curso o None"""
+    return _current_turn.get()
+
+
+class _TurnScope:
+    """Context manager (síncrono y asíncrono) que registra las consultas de un turno"""
+
+    def __init__(self, name):
+        self.name = name
+        self.recorder = None
+        self._token = None
+
+    def __enter__(self) -> TurnRecorder:
+        self.recorder = TurnRecorder(self.name)
+        self._token = _current_turn.set(self.recorder)
+        return self.recorder
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_turn.reset(self._token)
+        _publish_turn(self.recorder)
+        return False
+
+    async def __aenter__(self) -> TurnRecorder:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def _clone(self):
+        """Nuevo scope con la misma configuración (uno por llamada al decorar)"""
+        return _TurnScope(self.name)
+
+    def __call__(self, function):
+        """Permite usar el scope como decorador de funciones y corrutinas"""
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                async with self._clone():
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self._clone():
+                return function(*args, **kwargs)
+        return wrapper
+
+
+def db_turn(name: str = "turn") -> _TurnScope:
+    """
+    Marca un turno: registra sus consultas y al terminar publica los totales.
+    Sirve como context manager (`with` / `async with`) y como decorador.
+
+    Args:
+        name: Nombre del turno (aparece en el log)
+    """
+    return _TurnScope(name)
+
+
+def _publish_turn(recorder: TurnRecorder):
+    """Publica en el log y en las métricas los totales de un turno"""
+    summary = recorder.summary()
+    metrics.increment("db.turns")
+    metrics.observe("db.turn.queries", summary["queries"])
+    metrics.observe("db.turn.db_time_ms", summary["db_time_ms"])
+    metrics.observe("db.turn.rows", summary["rows"])
+
+    logger.info(
+        "Turno '%s': %d consultas, %.1f ms en BD, %d filas, %d errores",
+        summary["turn"], summary["queries"], summary["db_time_ms"], summary["rows"], summary["errors"]
+    )
+    logger.debug("Consultas del turno '%s': %s", summary["turn"], summary["by_table"])
+
+    for repeated in summary["n_plus_one"]:
+        metrics.increment("db.turn.n_plus_one")
+        logger.warning(
+            "Posible N+1 en el turno '%s': %s repetida %d veces",
+            summary["turn"], repeated["query"], repeated["count"]
+        )
+
+    if DB_TURN_QUERY_BUDGET and summary["queries"] > DB_TURN_QUERY_BUDGET:
+        metrics.increment("db.turn.over_budget")
+        logger.warning(
+            "El turno '%s' hizo %d consultas (presupuesto: %d)",
+            summary["turn"], summary["queries"], DB_TURN_QUERY_BUDGET
+        )
+
+
+class _QueryBudget(_TurnScope):
+    """Turno que falla si supera un número máximo de consultas (modo de prueba)"""
+
+    def __init__(self, max_queries, scenario):
+        super().__init__(scenario)
+        self.max_queries = max_queries
+
+    def _clone(self):
+        return _QueryBudget(self.max_queries, self.name)
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if exc_type is None and self.recorder.query_count > self.max_queries:
+            queries = "\n".join(f"  {record.describe()}" for record in self.recorder.records)
+            raise QueryBudgetExceeded(
+                f"El escenario '{self.name}' hizo {self.recorder.query_count} consultas "
+                f"(máximo {self.max_queries}):\n{queries}"
+            )
+        return False
+
+
+def query_budget(max_queries: int, scenario: str = "escenario") -> _QueryBudget:
+    """
+    Exige que el bloque no haga más de `max_queries` consultas (pensado para pruebas).
+    Sirve como context manager (`with` / `async with`) y como decorador.
+
+    Args:
+        max_queries: Máximo de consultas permitidas
+        scenario: Nombre del escenario (aparece en el error)
+
+    Raises:
+        QueryBudgetExceeded: Al salir del bloque, si se superó el presupuesto
+    """
+    return _QueryBudget(max_queries, scenario)
+
+
+# ----- PROXY DEL CLIENTE -----
+
+def _format_value(value) -> str:
+    """Representación corta del valor de un filtro"""
+    text = repr(list(value)) if isinstance(value, (tuple, set)) else repr(value)
+    if len(text) > MAX_FILTER_VALUE_CHARS:
+        text = text[:MAX_FILTER_VALUE_CHARS - 3] + "..."
+    return text
+
+
+def _row_count(response) -> int:
+    """Número de filas de una respuesta de PostgREST"""
+    data = getattr(response, "data", None)
+    if isinstance(data, list):
+        return len(data)
+    return 1 if data else 0
+
+
+class InstrumentedQuery:
+    """
+    Envuelve un constructor de consultas de postgrest y registra su ejecución.
+    Cada método encadenado se delega al constructor original.
+    """
+
+    def __init__(self, client, builder, table, operation=None, filters=()):
+        self._client = client
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+        self._filters = list(filters)
+        self._payload = None
+
+    def _track(self, name, args, kwargs):
+        if name in OPERATIONS and self._operation is None:
+            self._operation = name
+            if name == "select" and args:
+                self._filters.append(f"select({', '.join(str(arg) for arg in args)})")
+            elif name != "select" and args:
+                self._payload = hash(repr(args[0]))
+            return
+        if name in OPERATIONS:
+            return
+        values = [_format_value(arg) for arg in args]
+        values += [f"{key}={_format_value(value)}" for key, value in kwargs.items()]
+        self._filters.append(f"{name}({', '.join(values)})")
+
+    def __getattr__(self, name):
+        attribute = getattr(self._builder, name)
+        if not callable(attribute):
+            # Propiedades que retornan un constructor (p. ej. `.not_`)
+            if hasattr(attribute, "execute"):
+                self._filters.append(name)
+                self._builder = attribute
+                return self
+            return attribute
+
+        def method(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if hasattr(result, "execute"):
+                self._track(name, args, kwargs)
+                self._builder = result
+                return self
+            return result
+        return method
+
+    def _record(self, started, response=None, error=None):
+        latency = time.perf_counter() - started
+        breaker = self._client.breaker
+        if breaker is not None and not isinstance(error, CircuitOpenError):
+            is_failure = self._client.is_failure
+            if error is not None and (is_failure is None or is_failure(error)):
+                breaker.record_failure(latency)
+            else:
+                breaker.record_success(latency)
+        if not self._client.record_queries:
+            return
+
+        record = QueryRecord(
+            table=self._table,
+            operation=self._operation or "select",
+            filters=tuple(self._filters),
+            latency=latency,
+            rows=_row_count(response) if response is not None else 0,
+            error=type(error).__name__ if error else None,
+            payload=self._payload
+        )
+        metrics.increment(f"db.queries.{record.table}.{record.operation}")
+        metrics.observe("db.query.latency_ms", record.latency * 1000)
+        if isinstance(error, CircuitOpenError):
+            metrics.increment("db.query.circuit_open")
+        elif error:
+            metrics.increment("db.query.errors")
+        recorder = _current_turn.get()
+        if recorder is not None:
+            recorder.add(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Consulta %s: %.1f ms, %d filas", record.describe(), record.latency * 1000, record.rows)
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            if self._client.breaker is not None:
+                # Con el circuito abierto la consulta falla sin esperar a Supabase
+                self._client.breaker.before_call()
+            result = self._builder.execute(*args, **kwargs)
+        except Exception as e:
+            self._record(started, error=e)
+            raise
+        if inspect.isawaitable(result):
+            return self._execute_async(result, started)
+        self._record(started, response=result)
+        return result
+
+    async def _execute_async(self, awaitable, started):
+        try:
+            response = await awaitable
+        except Exception as e:
+            self._record(started, error=e)
+            raise
+        self._record(started, response=response)
+        return response
+
+
+class InstrumentedClient:
+    """
+    Envuelve un cliente de Supabase para instrumentar `table`, `from_` y `rpc`
+    y, si se indica, proteger las consultas con un circuit breaker.
+    """
+
+    def __init__(self, client, breaker=None, is_failure=None, record_queries=True):
+        """
+        Args:
+            client: Cliente original
+            breaker: CircuitBreaker que decide si se intenta cada consulta (opcional)
+            is_failure: Decide qué excepciones cuentan como fallo para el breaker
+            record_queries: Registrar las consultas en turnos y métricas
+        """
+        self._client = client
+        self.breaker = breaker
+        self.is_failure = is_failure
+        self.record_queries = record_queries
+
+    @property
+    def wrapped(self):
+        """Cliente original"""
+        return self._client
+
+    def table(self, table_name):
+        return InstrumentedQuery(self, self._client.table(table_name), table_name)
+
+    def from_(self, table_name):
+        return InstrumentedQuery(self, self._client.from_(table_name), table_name)
+
+    def _rpc(self, fn, params=None, *args, **kwargs):
+        params = params or {}
+        builder = self._client.rpc(fn, params, *args, **kwargs)
+        values = ", ".join(f"{key}={_format_value(value)}" for key, value in sorted(params.items()))
+        return InstrumentedQuery(self, builder, f"rpc:{fn}", "rpc", [f"params({values})"])
+
+    def __getattr__(self, name):
+        # `rpc` solo existe si el cliente original lo tiene (el mock no), para que
+        # `hasattr(client, "rpc")` siga distinguiendo ambos casos
+        if name == "rpc" and hasattr(self._client, "rpc"):
+            return self._rpc
+        return getattr(self._client, name)
+
+
+def instrument(client, breaker=None, is_failure=None):
+    """
+    Envuelve un cliente de Supabase con la instrumentación y el circuit breaker.
+
+    Args:
+        client: Cliente síncrono o asíncrono de Supabase (o el cliente mock)
+        breaker: CircuitBreaker de las consultas (opcional)
+        is_failure: Decide qué excepciones cuentan como fallo para el breaker
+
+    Returns:
+        Cliente envuelto, o el mismo cliente si no hay instrumentación ni breaker
+    """
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    if not DB_INSTRUMENTATION and breaker is None:
+        return client
+    return InstrumentedClient(client, breaker=breaker, is_failure=is_failure, record_queries=DB_INSTRUMENTATION)
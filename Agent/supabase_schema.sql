@@ -19,21 +19,41 @@ CREATE TABLE conversations (
     platform VARCHAR NOT NULL,
     external_id VARCHAR NOT NULL,
     status VARCHAR NOT NULL DEFAULT 'active',
+    summary TEXT, -- Resumen acumulado de los mensajes anteriores al historial reciente
+    summary_until TIMESTAMP WITH TIME ZONE, -- created_at del último mensaje incluido en el resumen
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     UNIQUE(platform, external_id)
 );
 
--- Tabla de mensajes
+-- Tabla de mensajes, particionada por mes de created_at (ver create_message_partitions).
+-- En una tabla particionada las restricciones UNIQUE deben incluir created_at, así que
+-- la unicidad de external_id se lleva en message_external_ids.
 CREATE TABLE messages (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     conversation_id UUID REFERENCES conversations(id) ON DELETE CASCADE,
     role VARCHAR NOT NULL,
     content TEXT NOT NULL,
     message_type VARCHAR NOT NULL DEFAULT 'text',
     media_url VARCHAR,
-    external_id VARCHAR,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    external_id VARCHAR, -- ID del mensaje de WhatsApp; único a través de message_external_ids
+    delivery_status VARCHAR, -- Estado de entrega de los mensajes salientes (queued, sent, failed)
+    delivery_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Recibe las filas de meses sin partición propia (no debería crecer si el
+-- mantenimiento crea las particiones con anticipación)
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+-- Registro de IDs externos de mensajes: evita procesar dos veces una entrega repetida
+-- de WhatsApp. Se mantiene con un trigger, así que un INSERT duplicado en messages
+-- falla con unique_violation como con la restricción UNIQUE original.
+CREATE TABLE message_external_ids (
+    external_id VARCHAR PRIMARY KEY,
+    message_id UUID NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
 -- Tabla de calificación de leads
@@ -44,13 +64,14 @@ CREATE TABLE lead_qualification (
     consent BOOLEAN DEFAULT FALSE,
     current_step VARCHAR DEFAULT 'start',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(user_id, conversation_id)
 );
 
 -- Tabla de datos BANT
 CREATE TABLE bant_data (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-    lead_qualification_id UUID REFERENCES lead_qualification(id) ON DELETE CASCADE,
+    lead_qualification_id UUID UNIQUE REFERENCES lead_qualification(id) ON DELETE CASCADE,
     budget TEXT,
     authority TEXT,
     need TEXT,
@@ -62,7 +83,7 @@ CREATE TABLE bant_data (
 -- Tabla de requerimientos
 CREATE TABLE requirements (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-    lead_qualification_id UUID REFERENCES lead_qualification(id) ON DELETE CASCADE,
+    lead_qualification_id UUID UNIQUE REFERENCES lead_qualification(id) ON DELETE CASCADE,
     app_type VARCHAR,
     deadline VARCHAR,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -75,7 +96,8 @@ CREATE TABLE features (
     requirement_id UUID REFERENCES requirements(id) ON DELETE CASCADE,
     name VARCHAR NOT NULL,
     description TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(requirement_id, name) -- permite insertar en lote ignorando nombres repetidos
 );
 
 -- Tabla de integraciones
@@ -84,7 +106,8 @@ CREATE TABLE integrations (
     requirement_id UUID REFERENCES requirements(id) ON DELETE CASCADE,
     name VARCHAR NOT NULL,
     description TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE(requirement_id, name) -- permite insertar en lote ignorando nombres repetidos
 );
 
 -- Tabla de reuniones
@@ -104,15 +127,26 @@ CREATE TABLE meetings (
 
 -- Índices para mejorar el rendimiento
 CREATE INDEX idx_conversations_user_id ON conversations(user_id);
-CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
-CREATE INDEX idx_lead_qualification_user_id ON lead_qualification(user_id);
+-- Historial: mensajes más recientes de una conversación (orden descendente con límite);
+-- también cubre las búsquedas solo por conversation_id
+CREATE INDEX idx_messages_conversation_created_at ON messages(conversation_id, created_at DESC);
+-- Mensajes de sistema de una conversación
+CREATE INDEX idx_messages_conversation_system ON messages(conversation_id, created_at) WHERE role = 'system';
 CREATE INDEX idx_lead_qualification_conversation_id ON lead_qualification(conversation_id);
-CREATE INDEX idx_bant_data_lead_qualification_id ON bant_data(lead_qualification_id);
-CREATE INDEX idx_requirements_lead_qualification_id ON requirements(lead_qualification_id);
+-- lead_qualification(user_id), bant_data y requirements(lead_qualification_id) ya quedan
+-- indexados por sus restricciones UNIQUE
 CREATE INDEX idx_features_requirement_id ON features(requirement_id);
 CREATE INDEX idx_integrations_requirement_id ON integrations(requirement_id);
-CREATE INDEX idx_meetings_user_id ON meetings(user_id);
+-- Reuniones de un usuario ordenadas por fecha y búsqueda por ID de Outlook
+CREATE INDEX idx_meetings_user_start_time ON meetings(user_id, start_time);
+CREATE INDEX idx_meetings_outlook_meeting_id ON meetings(outlook_meeting_id) WHERE outlook_meeting_id IS NOT NULL;
 CREATE INDEX idx_meetings_lead_qualification_id ON meetings(lead_qualification_id);
+-- Paginación por cursor (created_at, id) de reuniones y usuarios (los mensajes usan
+-- idx_messages_conversation_created_at)
+CREATE INDEX idx_meetings_user_created_at_id ON meetings(user_id, created_at, id);
+CREATE INDEX idx_users_created_at_id ON users(created_at, id);
+-- Poda del registro de IDs externos por antigüedad (scripts/archive_messages.py)
+CREATE INDEX idx_message_external_ids_created_at ON message_external_ids(created_at);
 
 -- Habilitar RLS en todas las tablas
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
@@ -124,6 +158,7 @@ ALTER TABLE requirements ENABLE ROW LEVEL SECURITY;
 ALTER TABLE features ENABLE ROW LEVEL SECURITY;
 ALTER TABLE integrations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE meetings ENABLE ROW LEVEL SECURITY;
+ALTER TABLE message_external_ids ENABLE ROW LEVEL SECURITY;
 
 -- Crear políticas para el acceso a los datos
 -- Estas políticas permiten acceso completo usando la clave de servicio
@@ -163,3 +198,257 @@ CREATE POLICY "Acceso completo con clave de servicio" ON integrations
 -- Política para reuniones
 CREATE POLICY "Acceso completo con clave de servicio" ON meetings
     USING (auth.role() = 'service_role');
+
+-- Política para el registro de IDs externos de mensajes
+CREATE POLICY "Acceso completo con clave de servicio" ON message_external_ids
+    USING (auth.role() = 'service_role');
+
+-- Función para registrar mensajes entrantes en un solo viaje a la base de datos.
+-- En una transacción: resuelve el usuario (teléfono normalizado o sus formatos
+-- alternativos), obtiene o reactiva la conversación, siembra los mensajes de
+-- sistema y bienvenida si la conversación es nueva, guarda los mensajes
+-- (descartando entregas repetidas por external_id) y retorna el historial recortado.
+CREATE OR REPLACE FUNCTION ingest_inbound_message(
+    p_phone VARCHAR,
+    p_phone_candidates VARCHAR[],
+    p_messages JSONB,
+    p_platform VARCHAR DEFAULT 'whatsapp',
+    p_max_messages INTEGER DEFAULT 10,
+    p_system_message TEXT DEFAULT 'Iniciando conversación con un potencial cliente.',
+    p_welcome_message TEXT DEFAULT '¡Hola! Soy el asistente virtual de nuestra empresa de desarrollo de software. ¿En qué puedo ayudarte hoy?'
+) RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_user users%ROWTYPE;
+    v_conversation conversations%ROWTYPE;
+    v_is_new BOOLEAN;
+    v_message JSONB;
+    v_message_id UUID;
+    v_stored JSONB := '[]'::JSONB;
+    v_duplicates JSONB := '[]'::JSONB;
+    v_history JSONB := '[]'::JSONB;
+BEGIN
+    -- Serializar las ingestas concurrentes de un mismo teléfono
+    PERFORM pg_advisory_xact_lock(hashtext(p_phone));
+
+    -- Usuario: preferir el formato normalizado y luego los alternativos, en orden
+    SELECT * INTO v_user
+    FROM users
+    WHERE phone = ANY(p_phone_candidates)
+    ORDER BY array_position(p_phone_candidates, phone)
+    LIMIT 1;
+
+    IF NOT FOUND THEN
+        INSERT INTO users (phone, full_name)
+        VALUES (p_phone, 'Usuario ' || p_phone)
+        ON CONFLICT (phone) DO UPDATE SET phone = EXCLUDED.phone
+        RETURNING * INTO v_user;
+    END IF;
+
+    -- Conversación activa (UNIQUE(platform, external_id): una cerrada se reactiva)
+    SELECT * INTO v_conversation
+    FROM conversations
+    WHERE external_id = p_phone AND platform = p_platform AND status = 'active';
+
+    IF NOT FOUND THEN
+        INSERT INTO conversations (user_id, external_id, platform, status)
+        VALUES (v_user.id, p_phone, p_platform, 'active')
+        ON CONFLICT (platform, external_id) DO UPDATE SET status = 'active', updated_at = NOW()
+        RETURNING * INTO v_conversation;
+    END IF;
+
+    -- clock_timestamp() (y no NOW(), fijo en la transacción) conserva el orden de inserción
+    v_is_new := NOT EXISTS (SELECT 1 FROM messages WHERE conversation_id = v_conversation.id);
+    IF v_is_new THEN
+        INSERT INTO messages (conversation_id, role, content, created_at)
+        VALUES (v_conversation.id, 'system', p_system_message, clock_timestamp());
+        INSERT INTO messages (conversation_id, role, content, created_at)
+        VALUES (v_conversation.id, 'assistant', p_welcome_message, clock_timestamp());
+    END IF;
+
+    FOR v_message IN SELECT * FROM jsonb_array_elements(COALESCE(p_messages, '[]'::JSONB)) LOOP
+        -- El trigger de message_external_ids lanza unique_violation si es una entrega repetida
+        BEGIN
+            INSERT INTO messages (conversation_id, role, content, message_type, external_id, created_at)
+            VALUES (
+                v_conversation.id,
+                'user',
+                v_message->>'content',
+                COALESCE(v_message->>'message_type', 'text'),
+                v_message->>'external_id',
+                clock_timestamp()
+            )
+            RETURNING id INTO v_message_id;
+
+            v_stored := v_stored || jsonb_build_array(
+                jsonb_build_object('id', v_message_id, 'external_id', v_message->>'external_id')
+            );
+        EXCEPTION WHEN unique_violation THEN
+            v_duplicates := v_duplicates || jsonb_build_array(v_message->>'external_id');
+        END;
+    END LOOP;
+
+    -- Historial: mensajes de sistema y los últimos p_max_messages mensajes no-sistema
+    IF jsonb_array_length(v_stored) > 0 THEN
+        SELECT COALESCE(
+            jsonb_agg(jsonb_build_object('role', h.role, 'content', h.content)
+                      ORDER BY (h.role <> 'system'), h.created_at),
+            '[]'::JSONB
+        )
+        INTO v_history
+        FROM (
+            (SELECT role, content, created_at FROM messages
+             WHERE conversation_id = v_conversation.id AND role = 'system')
+            UNION ALL
+            (SELECT role, content, created_at FROM messages
+             WHERE conversation_id = v_conversation.id AND role <> 'system'
+             ORDER BY created_at DESC
+             LIMIT p_max_messages)
+        ) h;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'user', to_jsonb(v_user),
+        'conversation', to_jsonb(v_conversation),
+        'is_new_conversation', v_is_new,
+        'stored', v_stored,
+        'duplicates', v_duplicates,
+        'history', v_history
+    );
+END;
+$$;
+
+-- Mantiene message_external_ids: registra el ID externo de cada mensaje nuevo (o el
+-- asignado al enviar un mensaje saliente) y falla con unique_violation si ya existe.
+CREATE OR REPLACE FUNCTION register_message_external_id() RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.external_id IS NOT DISTINCT FROM OLD.external_id THEN
+            RETURN NEW;
+        END IF;
+        IF OLD.external_id IS NOT NULL THEN
+            DELETE FROM message_external_ids WHERE external_id = OLD.external_id;
+        END IF;
+    END IF;
+
+    IF NEW.external_id IS NOT NULL THEN
+        INSERT INTO message_external_ids (external_id, message_id, created_at)
+        VALUES (NEW.external_id, NEW.id, NEW.created_at);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER messages_register_external_id
+    BEFORE INSERT OR UPDATE OF external_id ON messages
+    FOR EACH ROW EXECUTE FUNCTION register_message_external_id();
+
+-- Crea las particiones mensuales de messages desde el mes de p_from hasta
+-- p_months_ahead meses después del actual. Se ejecuta periódicamente
+-- (scripts/archive_messages.py o pg_cron) para que messages_default quede vacía.
+-- Retorna el número de particiones creadas.
+CREATE OR REPLACE FUNCTION create_message_partitions(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_from TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+) RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', LEAST(p_from, NOW()))::DATE;
+    v_last DATE := (date_trunc('month', NOW()) + make_interval(months => p_months_ahead))::DATE;
+    v_name TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= v_last LOOP
+        v_name := 'messages_' || to_char(v_month, 'YYYY_MM');
+        IF to_regclass(v_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                v_name, v_month, (v_month + INTERVAL '1 month')::DATE
+            );
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Elimina las particiones mensuales vacías (ya archivadas) que terminan antes de p_before.
+-- Retorna el número de particiones eliminadas.
+CREATE OR REPLACE FUNCTION drop_empty_message_partitions(p_before TIMESTAMP WITH TIME ZONE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_partition RECORD;
+    v_is_empty BOOLEAN;
+    v_dropped INTEGER := 0;
+BEGIN
+    FOR v_partition IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages' AND child.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+    LOOP
+        IF to_date(substr(v_partition.relname, 10), 'YYYY_MM') + INTERVAL '1 month' > p_before THEN
+            CONTINUE;
+        END IF;
+        EXECUTE format('SELECT NOT EXISTS (SELECT 1 FROM %I)', v_partition.relname) INTO v_is_empty;
+        IF v_is_empty THEN
+            EXECUTE format('DROP TABLE %I', v_partition.relname);
+            v_dropped := v_dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN v_dropped;
+END;
+$$;
+
+-- Invalidación de cachés entre procesos (ver cache_invalidation.py): cada cambio de
+-- fila de las tablas cacheadas se publica en el canal cache_invalidation con
+-- {table, op, id}. pg_notify se entrega al confirmar la transacción.
+CREATE OR REPLACE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_id UUID;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        v_id := OLD.id;
+    ELSE
+        v_id := NEW.id;
+    END IF;
+    PERFORM pg_notify(
+        'cache_invalidation',
+        json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', v_id)::TEXT
+    );
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER users_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER conversations_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON conversations
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER lead_qualification_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON lead_qualification
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+CREATE OR REPLACE TRIGGER meetings_notify_cache_invalidation
+    AFTER INSERT OR UPDATE OR DELETE ON meetings
+    FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation();
+
+-- Particiones del mes actual y los tres siguientes
+SELECT create_message_partitions(3);
@@ -0,0 +1,330 @@
+"""
+Pruebas de la semántica de Postgres de los backends locales (memoria y SQLite).
+
+Se ejecutan con `python -m pytest tests` desde el directorio Agent.
+"""
+
+import os
+import sys
+
+import pytest
+from postgrest.exceptions import APIError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_operations
+from cache_invalidation import LocalBroker, start_cache_invalidation, stop_cache_invalidation
+from db_operations import _keyset_page, _keyset_query
+from local_query import LocalClient
+from memory_db import InMemoryDatabase
+from sqlite_db import SQLiteDatabase
+from supabase_instrumentation import QueryBudgetExceeded, instrument, query_budget
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def client(request, tmp_path):
+    """Cliente local sobre una base de datos vacía de cada backend"""
+    if request.param == "memory":
+        yield LocalClient(InMemoryDatabase())
+        return
+    database = SQLiteDatabase(str(tmp_path / "agent.db"))
+    yield LocalClient(database)
+    database.close()
+
+
+@pytest.fixture
+def db(client, monkeypatch):
+    """db_operations sobre el cliente local instrumentado, con la caché de contexto vacía"""
+    monkeypatch.setattr(db_operations, "supabase", instrument(client))
+    db_operations.context_cache.clear()
+    yield db_operations
+    db_operations.context_cache.clear()
+
+
+def _user(client, phone="573001112233"):
+    return client.table("users").insert({"phone": phone, "full_name": "Usuario"}).execute().data[0]
+
+
+def _conversation(client):
+    user = _user(client)
+    return client.table("conversations").insert(
+        {"user_id": user["id"], "platform": "whatsapp", "external_id": user["phone"]}
+    ).execute().data[0]
+
+
+def _lead_qualification(client):
+    conversation = _conversation(client)
+    return client.table("lead_qualification").insert(
+        {"user_id": conversation["user_id"], "conversation_id": conversation["id"]}
+    ).execute().data[0]
+
+
+def _requirement(client):
+    qualification = _lead_qualification(client)
+    return client.table("requirements").insert({"lead_qualification_id": qualification["id"]}).execute().data[0]
+
+
+def _names(client, requirement_id):
+    rows = client.table("features").select("name").eq("requirement_id", requirement_id).order("name").execute().data
+    return [row["name"] for row in rows]
+
+
+# ----- UNIQUE -----
+
+def test_unique_violation_rolls_back_multi_row_insert(client):
+    _user(client)
+
+    with pytest.raises(APIError) as error:
+        client.table("users").insert([
+            {"phone": "573009998877", "full_name": "Otro"},
+            {"phone": "573001112233", "full_name": "Repetido"},
+        ]).execute()
+
+    assert error.value.code == "23505"
+    phones = [row["phone"] for row in client.table("users").select("phone").execute().data]
+    assert phones == ["573001112233"]
+
+
+def test_unique_violation_within_the_same_insert(client):
+    requirement_id = _requirement(client)["id"]
+
+    with pytest.raises(APIError) as error:
+        client.table("features").insert([
+            {"requirement_id": requirement_id, "name": "Pagos"},
+            {"requirement_id": requirement_id, "name": "Pagos"},
+        ]).execute()
+
+    assert error.value.code == "23505"
+    assert _names(client, requirement_id) == []
+
+
+def test_null_values_do_not_conflict(client):
+    conversation_id = _conversation(client)["id"]
+    client.table("messages").insert([
+        {"conversation_id": conversation_id, "role": "user", "content": "a", "external_id": None},
+        {"conversation_id": conversation_id, "role": "user", "content": "b", "external_id": None},
+    ]).execute()
+
+    rows = client.table("messages").select("id").eq("conversation_id", conversation_id).execute().data
+    assert len(rows) == 2
+
+
+# ----- UPSERT -----
+
+def test_upsert_ignore_duplicates_keeps_existing_rows(client):
+    requirement_id = _requirement(client)["id"]
+    client.table("features").insert(
+        {"requirement_id": requirement_id, "name": "Pagos", "description": "original"}
+    ).execute()
+
+    response = client.table("features").upsert(
+        [
+            {"requirement_id": requirement_id, "name": "Pagos", "description": "nueva"},
+            {"requirement_id": requirement_id, "name": "Chat", "description": None},
+        ],
+        on_conflict="requirement_id,name",
+        ignore_duplicates=True
+    ).execute()
+
+    assert [row["name"] for row in response.data] == ["Chat"]
+    assert _names(client, requirement_id) == ["Chat", "Pagos"]
+    existing = client.table("features").select("description").eq("name", "Pagos").execute().data
+    assert existing == [{"description": "original"}]
+
+
+def test_upsert_merges_the_sent_columns(client):
+    qualification_id = _lead_qualification(client)["id"]
+    first = client.table("requirements").upsert(
+        {"lead_qualification_id": qualification_id, "app_type": "web", "deadline": "2025"},
+        on_conflict="lead_qualification_id"
+    ).execute().data[0]
+
+    second = client.table("requirements").upsert(
+        {"lead_qualification_id": qualification_id, "app_type": "móvil"},
+        on_conflict="lead_qualification_id"
+    ).execute().data[0]
+
+    assert second["id"] == first["id"]
+    assert second["app_type"] == "móvil"
+    assert second["deadline"] == "2025"
+
+
+def test_upsert_without_matching_constraint(client):
+    with pytest.raises(APIError) as error:
+        client.table("features").upsert(
+            {"requirement_id": _requirement(client)["id"], "name": "Pagos"}, on_conflict="name"
+        ).execute()
+
+    assert error.value.code == "42P10"
+
+
+# ----- PAGINACIÓN POR CURSOR (or_) -----
+
+def test_keyset_pages_cover_rows_with_equal_created_at(client):
+    # Varias filas con el mismo created_at: el desempate por id no debe perder ni repetir filas
+    conversation_id = _conversation(client)["id"]
+    timestamps = ["2025-01-01T00:00:00+00:00"] * 3 + ["2025-01-01T00:00:01+00:00"] * 2
+    client.table("messages").insert([
+        {"conversation_id": conversation_id, "role": "user", "content": f"m{i}", "created_at": created_at}
+        for i, created_at in enumerate(timestamps)
+    ]).execute()
+    expected = client.table("messages").select("id").eq("conversation_id", conversation_id) \
+        .order("created_at").order("id").execute().data
+
+    seen, cursor = [], None
+    while True:
+        query = client.table("messages").select("id, created_at").eq("conversation_id", conversation_id)
+        page = _keyset_page(_keyset_query(query, cursor, 2).execute().data, 2)
+        seen.extend(row["id"] for row in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen == [row["id"] for row in expected]
+
+
+def test_or_filter_with_nested_and(client):
+    conversation_id = _conversation(client)["id"]
+    client.table("messages").insert([
+        {"conversation_id": conversation_id, "role": "user", "content": "a"},
+        {"conversation_id": conversation_id, "role": "assistant", "content": "b"},
+        {"conversation_id": conversation_id, "role": "assistant", "content": "c"},
+    ]).execute()
+
+    rows = client.table("messages").select("content") \
+        .or_("role.eq.user,and(role.eq.assistant,content.eq.c)") \
+        .order("content").execute().data
+
+    assert [row["content"] for row in rows] == ["a", "c"]
+
+
+# ----- IDS EXTERNOS DE MENSAJES -----
+
+def test_external_id_assigned_after_insert_is_unique(client):
+    conversation_id = _conversation(client)["id"]
+    sent = client.table("messages").insert(
+        {"conversation_id": conversation_id, "role": "assistant", "content": "a", "external_id": "wamid.1"}
+    ).execute().data[0]
+    pending = client.table("messages").insert(
+        {"conversation_id": conversation_id, "role": "assistant", "content": "b"}
+    ).execute().data[0]
+
+    with pytest.raises(APIError) as error:
+        client.table("messages").update({"external_id": "wamid.1"}).eq("id", pending["id"]).execute()
+    assert error.value.code == "23505"
+
+    # Al cambiar el ID del primero, el anterior queda libre para el segundo
+    client.table("messages").update({"external_id": "wamid.2"}).eq("id", sent["id"]).execute()
+    client.table("messages").update({"external_id": "wamid.1"}).eq("id", pending["id"]).execute()
+
+    with pytest.raises(APIError) as error:
+        client.table("messages").insert(
+            {"conversation_id": conversation_id, "role": "user", "content": "c", "external_id": "wamid.2"}
+        ).execute()
+    assert error.value.code == "23505"
+
+
+# ----- INGESTA DE MENSAJES -----
+
+def test_ingest_after_closing_the_conversation_reactivates_it(db):
+    first = db.ingest_inbound_message("573001112233", [{"content": "hola", "external_id": "wamid.1"}])
+    assert first["is_new_conversation"]
+    db.close_conversation(first["conversation"]["id"])
+
+    second = db.ingest_inbound_message("573001112233", [{"content": "sigo aquí", "external_id": "wamid.2"}])
+    third = db.ingest_inbound_message("573001112233", [{"content": "¿hola?", "external_id": "wamid.3"}])
+
+    assert second["conversation"]["id"] == first["conversation"]["id"]
+    assert second["conversation"]["status"] == "active"
+    assert not second["is_new_conversation"]
+    assert [row["external_id"] for row in third["stored"]] == ["wamid.3"]
+    contents = [row["content"] for row in db.get_conversation_messages(first["conversation"]["id"])]
+    assert contents.count(db.WELCOME_MESSAGE) == 1
+    assert contents[-3:] == ["hola", "sigo aquí", "¿hola?"]
+
+
+# ----- OBTENER O CREAR -----
+
+def test_get_or_create_requirements_keeps_existing_values(db):
+    qualification_id = _lead_qualification(db.supabase)["id"]
+    first = db.get_or_create_requirements(qualification_id, app_type="web", deadline="2025")
+
+    second = db.get_or_create_requirements(qualification_id, app_type="móvil", deadline=None)
+
+    assert second["id"] == first["id"]
+    assert (second["app_type"], second["deadline"]) == ("web", "2025")
+
+
+def test_get_or_create_conversation_only_writes_to_reactivate(db):
+    user_id = _user(db.supabase)["id"]
+    conversation = db.get_or_create_conversation(user_id, "573001112233")
+
+    db.context_cache.clear()
+    again = db.get_or_create_conversation(user_id, "573001112233")
+    assert again["updated_at"] == conversation["updated_at"]
+
+    db.close_conversation(conversation["id"])
+    reopened = db.get_or_create_conversation(user_id, "573001112233")
+    assert reopened["id"] == conversation["id"]
+    assert reopened["status"] == "active"
+
+
+# ----- INVALIDACIÓN DE CACHÉS -----
+
+def test_write_evicts_cached_context_row(db):
+    broker = LocalBroker()
+    start_cache_invalidation(db.context_cache, bus=broker)
+    try:
+        user_id = _user(db.supabase)["id"]
+        conversation = db.get_or_create_conversation(user_id, "573001112233")
+        assert db.context_cache.get("573001112233", "conversation") is not None
+
+        # Escritura de otro proceso, sin pasar por db_operations
+        db.supabase.table("conversations").update({"status": "closed"}).eq("id", conversation["id"]).execute()
+
+        assert db.context_cache.get("573001112233", "conversation") is None
+        assert db.get_active_conversation("573001112233") is None
+        assert broker.published >= 1
+    finally:
+        stop_cache_invalidation()
+
+
+# ----- PRESUPUESTO DE CONSULTAS -----
+# Una regresión que añada consultas por mensaje (p. ej. un N+1) hace fallar estas pruebas
+
+def test_query_budget_of_message_ingestion(db):
+    with query_budget(11, "primer mensaje de un usuario nuevo"):
+        db.ingest_inbound_message("573001112233", [{"content": "hola", "external_id": "wamid.1"}])
+
+    with query_budget(4, "mensaje siguiente con el contexto en caché"):
+        db.ingest_inbound_message("573001112233", [{"content": "sigo", "external_id": "wamid.2"}])
+
+    db.context_cache.clear()
+    with query_budget(6, "mensaje siguiente sin caché"):
+        db.ingest_inbound_message("573001112233", [{"content": "uno", "external_id": "wamid.3"}])
+
+    # Cada mensaje de una ráfaga es un insert propio (una entrega repetida solo descarta la suya)
+    with query_budget(5, "ráfaga de dos mensajes"):
+        db.ingest_inbound_message("573001112233", [
+            {"content": "dos", "external_id": "wamid.4"},
+            {"content": "tres", "external_id": "wamid.5"},
+        ])
+
+
+def test_query_budget_of_turn_context(db):
+    first = db.ingest_inbound_message("573001112233", [{"content": "hola", "external_id": "wamid.1"}])
+    db.create_lead_qualification(first["user"]["id"], first["conversation"]["id"])
+    db.context_cache.clear()
+
+    with query_budget(3, "contexto del turno sin caché"):
+        context = db.resolve_turn_context("573001112233")
+    assert context["lead_qualification"] is not None
+
+    with query_budget(0, "contexto del turno en caché"):
+        db.resolve_turn_context("573001112233")
+
+
+def test_query_budget_fails_when_exceeded(db):
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(0, "sin consultas"):
+            db.get_user_by_id("00000000-0000-0000-0000-000000000000")
@@ -0,0 +1,229 @@
+"""
+Circuit breaker con ventanas móviles de errores y de latencia.
+
+Estados:
+    closed:    las llamadas pasan; se registran resultado y latencia en una ventana
+               de `window` segundos. Si en la ventana hay al menos `min_calls`
+               llamadas y la tasa de errores o de llamadas lentas supera su umbral,
+               el circuito se abre.
+    open:      las llamadas fallan de inmediato con CircuitOpenError durante
+               `open_duration` segundos.
+    half_open: se dejan pasar hasta `half_open_max_calls` llamadas de prueba; si
+               tienen éxito el circuito se cierra y si alguna falla se vuelve a abrir.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Se lanza cuando el circuito está abierto y la llamada no se intenta"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuito '{name}' abierto; reintentar en {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker seguro entre hilos.
+    """
+
+    def __init__(self, name="circuit", window=30.0, min_calls=10, failure_rate=0.5,
+                 slow_call_duration=5.0, slow_call_rate=0.8, open_duration=15.0,
+                 half_open_max_calls=1, on_state_change: Optional[Callable[[str, str], None]] = None):
+        """
+        Args:
+            name: Nombre del circuito (aparece en errores y estadísticas)
+            window: Segundos de la ventana móvil de resultados
+            min_calls: Llamadas mínimas en la ventana para evaluar las tasas
+            failure_rate: Tasa de errores (0-1) a partir de la cual se abre
+            slow_call_duration: Segundos a partir de los cuales una llamada es lenta
+            slow_call_rate: Tasa de llamadas lentas (0-1) a partir de la cual se abre
+            open_duration: Segundos que el circuito permanece abierto antes de probar
+            half_open_max_calls: Llamadas de prueba simultáneas en estado semiabierto
+            on_state_change: Función (estado_anterior, estado_nuevo) llamada en cada transición
+        """
+        self.name = name
+        self.window = window
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.on_state_change = on_state_change
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        # Resultados recientes: (instante, fallida, lenta), con los fallos y las
+        # llamadas lentas de la ventana contados aparte para evaluarla en O(1)
+        self._calls = deque()
+        self._window_failures = 0
+        self._window_slow_calls = 0
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    # ---- ESTADO ----
+
+    def _transition(self, new_state):
+        """Cambia de estado (con el lock tomado) y retorna la transición a notificar"""
+        old_state = self._state
+        if old_state == new_state:
+            return None
+        self._state = new_state
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        if new_state in (OPEN, CLOSED):
+            self._calls.clear()
+            self._window_failures = 0
+            self._window_slow_calls = 0
+        self._half_open_calls = 0
+        return (old_state, new_state)
+
+    def _notify(self, transition):
+        if transition and self.on_state_change:
+            try:
+                self.on_state_change(*transition)
+            except Exception:
+                pass
+
+    def _current_state(self, now):
+        """Estado efectivo: un circuito abierto pasa a semiabierto al cumplirse su tiempo"""
+        if self._state == OPEN and now - self._opened_at >= self.open_duration:
+            return self._transition(HALF_OPEN)
+        return None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            transition = self._current_state(time.monotonic())
+            state = self._state
+        self._notify(transition)
+        return state
+
+    def retry_after(self) -> float:
+        """Segundos que faltan para volver a probar (0 si no está abierto)"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_duration - (time.monotonic() - self._opened_at))
+
+    # ---- LLAMADAS ----
+
+    def allow_request(self) -> bool:
+        """
+        Indica si una llamada puede intentarse (en semiabierto, reserva una prueba).
+        Cada llamada permitida debe informar su resultado con record_success o record_failure.
+        """
+        with self._lock:
+            transition = self._current_state(time.monotonic())
+            if self._state == CLOSED:
+                allowed = True
+            elif self._state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                allowed = True
+            else:
+                self._stats["rejected"] += 1
+                allowed = False
+        self._notify(transition)
+        return allowed
+
+    def before_call(self):
+        """
+        Igual que allow_request, pero lanza CircuitOpenError si la llamada no se permite.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+    def record_success(self, duration: float = 0.0):
+        """Registra una llamada exitosa y su duración en segundos"""
+        self._record(False, duration)
+
+    def record_failure(self, duration: float = 0.0):
+        """Registra una llamada fallida y su duración en segundos"""
+        self._record(True, duration)
+
+    def _record(self, failed, duration):
+        now = time.monotonic()
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += int(failed)
+            self._stats["slow_calls"] += int(slow)
+
+            if self._state == HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+                transition = self._transition(OPEN if failed or slow else CLOSED)
+            elif self._state == CLOSED:
+                self._calls.append((now, failed, slow))
+                self._window_failures += int(failed)
+                self._window_slow_calls += int(slow)
+                transition = self._transition(OPEN) if self._should_open(now) else None
+            else:
+                # Resultado de una llamada que empezó antes de abrirse el circuito
+                transition = None
+        self._notify(transition)
+
+    def _should_open(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, failed, slow = self._calls.popleft()
+            self._window_failures -= int(failed)
+            self._window_slow_calls -= int(slow)
+        total = len(self._calls)
+        if total < self.min_calls:
+            return False
+        return (self._window_failures / total >= self.failure_rate
+                or self._window_slow_calls / total >= self.slow_call_rate)
+
+    def call(self, function, *args, is_failure: Optional[Callable[[Exception], bool]] = None, **kwargs):
+        """
+        Ejecuta una función protegida por el circuito.
+
+        Args:
+            function: Función a ejecutar
+            is_failure: Decide si una excepción cuenta como fallo (por defecto todas)
+
+        Raises:
+            CircuitOpenError: Si el circuito no permite la llamada
+        """
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure(time.monotonic() - start)
+            else:
+                self.record_success(time.monotonic() - start)
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    def reset(self):
+        """Cierra el circuito y olvida la ventana"""
+        with self._lock:
+            transition = self._transition(CLOSED)
+        self._notify(transition)
+
+    def get_stats(self):
+        """
+        Retorna el estado, las llamadas, fallos, llamadas lentas y rechazadas y
+        las veces que se abrió el circuito.
+        """
+        state = self.state
+        with self._lock:
+            stats = dict(self._stats)
+            stats["window_calls"] = len(self._calls)
+        stats["state"] = state
+        stats["retry_after"] = round(self.retry_after(), 1)
+        return stats
@@ -0,0 +1,169 @@
+"""
+Agrupación (debounce) de mensajes que llegan en ráfaga desde un mismo remitente.
+
+Los mensajes de un remitente se acumulan mientras sigan llegando dentro de la
+ventana configurada; cuando la ventana expira sin mensajes nuevos (o se alcanza
+la espera máxima) se entregan todos juntos en un solo lote.
+
+Si la entrega falla (el callback retorna False o lanza una excepción, p. ej.
+porque la cola de destino está llena) el lote se reintenta con espera
+exponencial; agotados los reintentos se entrega a `on_drop` para que el
+llamador decida qué hacer con él.
+"""
+
+import logging
+import threading
+import time
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class MessageCoalescer:
+    """
+    Acumula elementos por clave y los entrega en lote tras una ventana de inactividad.
+    """
+
+    def __init__(self, flush_callback, window=2.0, max_wait=6.0, has_capacity=None, on_drop=None,
+                 retry_delay=0.5, max_retries=5):
+        """
+        Args:
+            flush_callback: Función flush_callback(key, items) que recibe cada lote; retorna False si no pudo
+            window: Segundos de inactividad que cierran la ráfaga (0 desactiva la agrupación)
+            max_wait: Segundos máximos que puede esperar el primer elemento de un lote
+            has_capacity: Función has_capacity(key) que indica si el destino admite otro lote
+            on_drop: Función on_drop(key, items) para los lotes que no se pudieron entregar
+            retry_delay: Segundos antes del primer reintento de un lote rechazado (se duplica en cada uno)
+            max_retries: Reintentos de un lote rechazado antes de entregarlo a on_drop
+        """
+        self.flush_callback = flush_callback
+        self.window = max(0.0, float(window))
+        self.max_wait = max(self.window, float(max_wait))
+        self.has_capacity = has_capacity
+        self.on_drop = on_drop
+        self.retry_delay = max(0.0, float(retry_delay))
+        self.max_retries = max(0, int(max_retries))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"items": 0, "batches": 0, "max_batch_size": 0, "retries": 0, "dropped": 0}
+
+    def add(self, key, item):
+        """
+        Añade un elemento a la ráfaga en curso de la clave.
+
+        Args:
+            key: Clave de agrupación (número de teléfono normalizado)
+            item: Elemento a acumular
+
+        Returns:
+            Resultado del flush_callback si la agrupación está desactivada; en otro caso
+            False si el destino no tiene capacidad para un lote nuevo y True si se acumuló
+        """
+        if self.window <= 0:
+            with self._lock:
+                self._stats["items"] += 1
+            self._record_batch(1)
+            return self.flush_callback(key, [item])
+
+        with self._lock:
+            now = time.monotonic()
+            pending = self._pending.get(key)
+            if pending is None:
+                # Un lote nuevo ocupará un lugar en la cola de destino al cerrarse
+                if self.has_capacity is not None and not self.has_capacity(key):
+                    return False
+                pending = {"items": [], "first_at": now, "timer": None, "attempts": 0, "recorded": False}
+                self._pending[key] = pending
+            else:
+                pending["timer"].cancel()
+
+            pending["items"].append(item)
+            self._stats["items"] += 1
+
+            # Reiniciar la ventana sin superar la espera máxima del primer elemento
+            delay = min(self.window, max(0.0, pending["first_at"] + self.max_wait - now))
+            self._schedule(key, pending, delay)
+
+        return True
+
+    def _schedule(self, key, pending, delay):
+        """Programa la entrega de un lote (con el lock tomado)"""
+        timer = threading.Timer(delay, self._flush, args=(key, pending))
+        timer.daemon = True
+        pending["timer"] = timer
+        timer.start()
+
+    def _flush(self, key, pending):
+        """Entrega el lote acumulado de una clave"""
+        with self._lock:
+            # Otro temporizador más reciente ya es dueño de este lote
+            if self._pending.get(key) is not pending or pending["timer"] is not threading.current_thread():
+                return
+            del self._pending[key]
+            items = pending["items"]
+            # Un lote se cuenta en su primera entrega (también si recibió un lote rechazado)
+            first_delivery = not pending["recorded"]
+            pending["recorded"] = True
+
+        self._record_batch(len(items), first_delivery)
+        if first_delivery and len(items) > 1:
+            logger.info(f"Ráfaga de {len(items)} mensajes agrupada para {key}")
+        try:
+            delivered = self.flush_callback(key, items) is not False
+        except Exception as e:
+            logger.error(f"Error al entregar lote agrupado de {key}: {str(e)}")
+            delivered = False
+        if not delivered:
+            self._retry(key, pending)
+
+    def _retry(self, key, pending):
+        """Vuelve a programar un lote rechazado o lo entrega a on_drop si agotó los reintentos"""
+        attempts = pending["attempts"] + 1
+        if attempts > self.max_retries:
+            with self._lock:
+                self._stats["dropped"] += 1
+            logger.error(f"Lote de {len(pending['items'])} mensaje(s) de {key} descartado tras {attempts - 1} reintentos")
+            if self.on_drop:
+                try:
+                    self.on_drop(key, pending["items"])
+                except Exception as e:
+                    logger.error(f"Error al descartar el lote de {key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._stats["retries"] += 1
+            current = self._pending.get(key)
+            if current is not None:
+                # Llegaron mensajes nuevos: el lote rechazado va delante en la ráfaga en curso
+                current["items"][:0] = pending["items"]
+                current["attempts"] = max(current["attempts"], attempts)
+                return
+            pending["attempts"] = attempts
+            self._pending[key] = pending
+            self._schedule(key, pending, self.retry_delay * (2 ** (attempts - 1)))
+        logger.warning(f"Cola llena para {key}: reintento {attempts} del lote agrupado")
+
+    def _record_batch(self, size, new_batch=True):
+        """
+        Actualiza las estadísticas de lotes (los elementos se cuentan al recibirlos).
+        Un reintento no es un lote nuevo, pero pudo crecer con mensajes nuevos.
+        """
+        with self._lock:
+            if new_batch:
+                self._stats["batches"] += 1
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], size)
+
+    def get_stats(self):
+        """
+        Retorna las estadísticas de agrupación.
+
+        Returns:
+            Diccionario con elementos recibidos, lotes entregados, reintentos, lotes
+            descartados y ráfagas pendientes
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_senders"] = len(self._pending)
+        stats["window_seconds"] = self.window
+        stats["avg_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
@@ -0,0 +1,146 @@
+"""
+Caché del contexto de una conversación (usuario, conversación activa y
+calificación de lead) indexada por número de teléfono normalizado.
+
+Las herramientas del agente resuelven siempre la misma cadena
+usuario -> conversación -> calificación; con esta caché la resuelven una vez por
+turno. Las entradas expiran por TTL, se desalojan por LRU y las funciones de
+escritura las actualizan o invalidan a través de los índices por ID.
+"""
+
+import threading
+from typing import Dict, Optional
+
+from utils.ttl_cache import TTLCache
+
+# Filas que componen el contexto de una conversación
+CONTEXT_FIELDS = ("user", "conversation", "lead_qualification")
+
+
+class ConversationContextCache:
+    """
+    Caché de filas de contexto por teléfono, con índices por ID para invalidar.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        """
+        Args:
+            maxsize: Número máximo de teléfonos en caché
+            ttl: Segundos de vida de cada entrada (0 = caché desactivada)
+        """
+        self.enabled = ttl > 0
+        self._entries = TTLCache(maxsize=maxsize, ttl=max(ttl, 0.001))
+        self._keys_by_id = {field: TTLCache(maxsize=maxsize, ttl=max(ttl, 0.001)) for field in CONTEXT_FIELDS}
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key, field) -> Optional[Dict]:
+        """
+        Retorna una fila del contexto de un teléfono.
+
+        Args:
+            key: Número de teléfono normalizado
+            field: "user", "conversation" o "lead_qualification"
+
+        Returns:
+            Copia de la fila o None si no está en caché
+        """
+        if not self.enabled or not key:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            row = entry.get(field) if entry else None
+            self._stats["hits" if row else "misses"] += 1
+            return dict(row) if row else None
+
+    def get_by_id(self, field, row_id) -> Optional[Dict]:
+        """Retorna una fila por su ID si pertenece a algún contexto en caché"""
+        if not self.enabled or not row_id:
+            return None
+        with self._lock:
+            key = self._keys_by_id[field].get(row_id)
+            if key is None:
+                self._stats["misses"] += 1
+                return None
+            return self.get(key, field)
+
+    def key_for(self, field, row_id):
+        """Retorna el teléfono del contexto que contiene una fila"""
+        if not self.enabled or not row_id:
+            return None
+        return self._keys_by_id[field].get(row_id)
+
+    def set(self, key, field, row: Optional[Dict]):
+        """
+        Guarda una fila en el contexto de un teléfono.
+
+        Args:
+            key: Número de teléfono normalizado
+            field: "user", "conversation" o "lead_qualification"
+            row: Fila a guardar (se ignora si está vacía)
+        """
+        if not self.enabled or not key or not row or not row.get("id"):
+            return
+        with self._lock:
+            entry = dict(self._entries.get(key) or {})
+            previous = entry.get(field)
+            if previous and previous.get("id") != row["id"]:
+                self._keys_by_id[field].delete(previous["id"])
+            entry[field] = dict(row)
+            self._entries.set(key, entry)
+            self._keys_by_id[field].set(row["id"], key)
+
+    def replace(self, field, row: Optional[Dict]):
+        """Actualiza una fila en el contexto que la contiene (write-through tras un UPDATE)"""
+        if not self.enabled or not row or not row.get("id"):
+            return
+        with self._lock:
+            key = self._keys_by_id[field].get(row["id"])
+            if key is not None:
+                self.set(key, field, row)
+
+    def discard(self, field, row_id):
+        """Elimina una fila del contexto que la contiene"""
+        if not self.enabled or not row_id:
+            return
+        with self._lock:
+            key = self._keys_by_id[field].get(row_id)
+            self._keys_by_id[field].delete(row_id)
+            if key is None:
+                return
+            entry = dict(self._entries.get(key) or {})
+            if entry.pop(field, None) is not None:
+                self._stats["invalidations"] += 1
+                self._entries.set(key, entry)
+
+    def invalidate(self, key):
+        """Elimina todo el contexto de un teléfono"""
+        if not self.enabled or not key:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            for field, row in entry.items():
+                self._keys_by_id[field].delete(row.get("id"))
+            self._entries.delete(key)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entries.clear()
+            for index in self._keys_by_id.values():
+                index.clear()
+
+    def get_stats(self):
+        """
+        Retorna aciertos, fallos, invalidaciones y número de teléfonos en caché.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["entries"] = len(self._entries)
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,148 @@
+"""
+Despachador de trabajo con colas FIFO por remitente.
+
+Cada remitente se asigna siempre al mismo shard (hash estable del número
+normalizado), de modo que sus mensajes se procesan en orden mientras que
+remitentes distintos se procesan en paralelo en otros shards.
+"""
+
+import hashlib
+import logging
+import queue
+import threading
+import time
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def stable_shard(key, num_shards):
+    """Retorna el shard asignado a una clave (hash estable entre procesos y reinicios)"""
+    digest = hashlib.md5(str(key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+class SenderDispatcher:
+    """
+    Reparte tareas entre shards con una cola FIFO acotada y un hilo por shard.
+    """
+
+    def __init__(self, num_shards=10, max_queue_size=100, name="dispatcher"):
+        """
+        Args:
+            num_shards: Número de shards (hilos de trabajo) independientes
+            max_queue_size: Tamaño máximo de la cola de cada shard
+            name: Nombre usado en los hilos y en los logs
+        """
+        self.num_shards = max(1, int(num_shards))
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.name = name
+        self._queues = [queue.Queue(maxsize=self.max_queue_size) for _ in range(self.num_shards)]
+        self._stats = [
+            {"processed": 0, "rejected": 0, "errors": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for _ in range(self.num_shards)
+        ]
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def shard_for(self, key):
+        """Retorna el índice de shard asignado a una clave (hash estable entre procesos)"""
+        return stable_shard(key, self.num_shards)
+
+    def start(self):
+        """Inicia los hilos de trabajo (idempotente)"""
+        with self._start_lock:
+            if self._started:
+                return
+            for index in range(self.num_shards):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(index,),
+                    name=f"{self.name}-shard-{index}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+            logger.info(f"{self.name}: {self.num_shards} shards iniciados (cola máxima {self.max_queue_size})")
+
+    def submit(self, key, fn, *args, timeout=None, **kwargs):
+        """
+        Encola una tarea en el shard correspondiente a la clave.
+
+        Args:
+            key: Clave de ordenamiento (número de teléfono normalizado)
+            fn: Función a ejecutar
+            timeout: Segundos a esperar si la cola está llena (None = no esperar)
+
+        Returns:
+            True si la tarea fue encolada, False si la cola del shard está llena
+        """
+        self.start()
+        index = self.shard_for(key)
+        try:
+            if timeout:
+                self._queues[index].put((time.monotonic(), fn, args, kwargs), timeout=timeout)
+            else:
+                self._queues[index].put_nowait((time.monotonic(), fn, args, kwargs))
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self._stats[index]["rejected"] += 1
+            logger.warning(f"{self.name}: cola del shard {index} llena, tarea rechazada")
+            return False
+
+    def has_capacity(self, key):
+        """Indica si la cola del shard de la clave admite otra tarea"""
+        return not self._queues[self.shard_for(key)].full()
+
+    def _worker(self, index):
+        """Bucle de trabajo de un shard"""
+        shard_queue = self._queues[index]
+        while True:
+            enqueued_at, fn, args, kwargs = shard_queue.get()
+            wait_time = time.monotonic() - enqueued_at
+            error = False
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                error = True
+                logger.error(f"{self.name}: error en tarea del shard {index}: {str(e)}")
+            finally:
+                with self._stats_lock:
+                    stats = self._stats[index]
+                    stats["processed"] += 1
+                    stats["total_wait"] += wait_time
+                    stats["max_wait"] = max(stats["max_wait"], wait_time)
+                    if error:
+                        stats["errors"] += 1
+                shard_queue.task_done()
+
+    def get_stats(self):
+        """
+        Retorna la profundidad de cola y los tiempos de espera de cada shard.
+
+        Returns:
+            Diccionario con las estadísticas por shard
+        """
+        shards = []
+        with self._stats_lock:
+            for index, stats in enumerate(self._stats):
+                processed = stats["processed"]
+                shards.append({
+                    "shard": index,
+                    "queue_depth": self._queues[index].qsize(),
+                    "processed": processed,
+                    "rejected": stats["rejected"],
+                    "errors": stats["errors"],
+                    "avg_wait_seconds": round(stats["total_wait"] / processed, 4) if processed else 0.0,
+                    "max_wait_seconds": round(stats["max_wait"], 4)
+                })
+        return {
+            "name": self.name,
+            "num_shards": self.num_shards,
+            "max_queue_size": self.max_queue_size,
+            "shards": shards
+        }
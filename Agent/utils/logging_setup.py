@@ -0,0 +1,179 @@
+"""
+Configuración centralizada de logging.
+
+Los registros se encolan en el hilo que los emite y un hilo de fondo los
+formatea y escribe, de modo que la E/S de logs no suma a la latencia de cada
+mensaje. Los campos estructurados se serializan de forma perezosa (solo si el
+registro llega a escribirse) y los payloads voluminosos se muestrean.
+
+Variables de entorno:
+    LOG_LEVEL: Nivel global (por defecto INFO)
+    LOG_LEVELS: Niveles por módulo, p. ej. "db_operations=DEBUG,utils.phone_utils=WARNING"
+    LOG_FORMAT: "text" (por defecto) o "json"
+    LOG_QUEUE_MAXSIZE: Registros en espera antes de empezar a descartar
+    LOG_PAYLOAD_SAMPLE_RATE: Fracción de payloads que se registran en INFO (en DEBUG se registran todos)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", 10000))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Atributos estándar de LogRecord (el resto son campos estructurados pasados en `extra`)
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_configured = False
+_configure_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+class LazyJSON:
+    """
+    Envoltorio que serializa un objeto a JSON solo cuando el registro se formatea.
+
+    Uso: logger.debug("Payload: %s", LazyJSON(data))
+    """
+
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value, indent=None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.value, ensure_ascii=False, indent=self.indent, default=str)
+        except Exception:
+            return repr(self.value)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo que emite y descarta si la cola está llena.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # La cola es local al proceso: el registro se pasa tal cual y el
+        # mensaje (con sus argumentos perezosos) se formatea en el hilo de fondo
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON, incluyendo los campos de `extra`"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _parse_module_levels(spec):
+    """Convierte "modulo=NIVEL,otro=NIVEL" en un diccionario {modulo: NIVEL}"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """
+    Instala el pipeline de logging del proceso (idempotente).
+
+    Sustituye los handlers del logger raíz por un handler de cola y arranca el
+    hilo que escribe en stdout (Render recoge los logs de stdout).
+    """
+    global _configured, _listener, _queue_handler
+    with _configure_lock:
+        if _configured:
+            return
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        for name, level in _parse_module_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _configured = True
+
+
+def should_sample(rate=None) -> bool:
+    """Indica si esta petición entra en la muestra (por defecto LOG_PAYLOAD_SAMPLE_RATE)"""
+    rate = LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_payload(logger, message, payload, sample_rate=None):
+    """
+    Registra un payload voluminoso: siempre en DEBUG y solo una muestra en INFO.
+
+    Args:
+        logger: Logger del módulo
+        message: Descripción del payload
+        payload: Objeto serializable a JSON (se serializa solo si se escribe)
+        sample_rate: Fracción de payloads a registrar en INFO
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", message, LazyJSON(payload))
+    elif logger.isEnabledFor(logging.INFO) and should_sample(sample_rate):
+        logger.info("%s (muestra): %s", message, LazyJSON(payload))
+
+
+def get_logging_stats():
+    """Retorna el tamaño de la cola de logs y los registros descartados"""
+    if not _queue_handler:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queue_depth": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped
+    }
@@ -0,0 +1,66 @@
+"""
+Registro de métricas en memoria (contadores y observaciones) del proceso.
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+
+
+def increment(name, value=1):
+    """
+    Incrementa un contador.
+
+    Args:
+        name: Nombre de la métrica
+        value: Cantidad a sumar
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """
+    Registra una observación (latencia, tamaño, etc.) y acumula conteo, suma y máximo.
+
+    Args:
+        name: Nombre de la métrica
+        value: Valor observado
+    """
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            stats = {"count": 0, "sum": 0.0, "max": value}
+            _observations[name] = stats
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["max"] = max(stats["max"], value)
+
+
+def snapshot():
+    """
+    Retorna una copia de todas las métricas.
+
+    Returns:
+        Diccionario con contadores y observaciones (con promedio calculado)
+    """
+    with _lock:
+        counters = dict(_counters)
+        observations = {
+            name: {
+                "count": stats["count"],
+                "avg": round(stats["sum"] / stats["count"], 4) if stats["count"] else 0.0,
+                "max": round(stats["max"], 4)
+            }
+            for name, stats in _observations.items()
+        }
+    return {"counters": counters, "observations": observations}
+
+
+def reset():
+    """Reinicia todas las métricas"""
+    with _lock:
+        _counters.clear()
+        _observations.clear()
@@ -47,7 +47,7 @@ def normalize_phone_number(phone_number):
     else:
         normalized = digits_only
     
-    logger.info(f"Número normalizado: {phone_number} -> {normalized}")
+    logger.debug("Número normalizado: %s -> %s", phone_number, normalized)
     return normalized
 
 def find_duplicate_phone_formats(phone_number):
@@ -0,0 +1,96 @@
+"""
+Caché en memoria con expiración por tiempo (TTL) y desalojo LRU.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Diccionario acotado y seguro entre hilos cuyas entradas expiran tras `ttl` segundos.
+    Cuando se supera `maxsize` se desaloja la entrada usada hace más tiempo.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        """
+        Args:
+            maxsize: Número máximo de entradas
+            ttl: Segundos de vida de cada entrada
+        """
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, expires_at, now):
+        return expires_at <= now
+
+    def get(self, key, default=None):
+        """Retorna el valor de una clave vigente o `default`"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if self._expired(expires_at, now):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Guarda un valor, renovando su expiración"""
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            self._evict(now)
+
+    def add(self, key, value=True):
+        """
+        Guarda un valor solo si la clave no existe (o expiró).
+
+        Returns:
+            True si la clave se añadió, False si ya estaba presente
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and not self._expired(entry[1], now):
+                self._data.move_to_end(key)
+                return False
+            self._data[key] = (value, now + self.ttl)
+            self._data.move_to_end(key)
+            self._evict(now)
+            return True
+
+    def delete(self, key):
+        """Elimina una clave si existe"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Elimina todas las entradas"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _evict(self, now):
+        """Desaloja entradas expiradas al inicio y las menos usadas si se excede el tamaño"""
+        while self._data:
+            oldest_key, (_, expires_at) = next(iter(self._data.items()))
+            if len(self._data) > self.maxsize or self._expired(expires_at, now):
+                del self._data[oldest_key]
+            else:
+                break
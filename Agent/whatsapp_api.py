@@ -1,8 +1,7 @@
 from flask import Flask, request, jsonify
-import requests
-import json
 import hmac
 import hashlib
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -13,24 +12,40 @@ from db_operations import (
     get_or_create_user,
     get_or_create_conversation,
     add_message,
-    get_conversation_history
+    get_conversation_history,
+    DuplicateMessageError
 )
+# Importar el cliente compartido de WhatsApp
+from whatsapp_client import get_whatsapp_client
+from utils.ttl_cache import TTLCache
+from utils import metrics
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Configurar logging
+logger = logging.getLogger(__name__)
+
 # Configuración de WhatsApp
-WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
-WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_WEBHOOK_TOKEN = os.getenv("WHATSAPP_WEBHOOK_TOKEN")
 WHATSAPP_APP_SECRET = os.getenv("WHATSAPP_APP_SECRET")
 
+# Deduplicación de entregas repetidas de WhatsApp (segundos y número máximo de IDs recordados)
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 86400))
+WEBHOOK_DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", 100000))
+
 # Inicializar Flask
 app = Flask(__name__)
 
 # Inicializar el agente
 lead_agent = create_lead_qualification_agent()
 
+# Cliente de WhatsApp con pool de conexiones keep-alive
+whatsapp_client = get_whatsapp_client()
+
+# Conjunto de IDs de mensajes ya vistos (TTL + LRU) para descartar entregas repetidas
+seen_message_ids = TTLCache(maxsize=WEBHOOK_DEDUP_MAX_ENTRIES, ttl=WEBHOOK_DEDUP_TTL)
+
 # ---- CLIENTE DE WHATSAPP ----
 
 def send_whatsapp_message(to, message_type, content, caption=None):
@@ -46,94 +61,15 @@ def send_whatsapp_message(to, message_type, content, caption=None):
     Returns:
         Respuesta de la API
     """
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    # Construir payload según el tipo de mensaje
-    payload = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": to
-    }
-    
-    if message_type == "text":
-        payload["type"] = "text"
-        payload["text"] = {"body": content}
-    
-    elif message_type == "image":
-        payload["type"] = "image"
-        payload["image"] = {"link": content}
-        if caption:
-            payload["image"]["caption"] = caption
-    
-    elif message_type == "audio":
-        payload["type"] = "audio"
-        payload["audio"] = {"link": content}
-    
-    elif message_type == "video":
-        payload["type"] = "video"
-        payload["video"] = {"link": content}
-        if caption:
-            payload["video"]["caption"] = caption
-    
-    # Enviar solicitud a la API
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: {response.status_code}")
-        print(f"Response: {response.text}")
-        return None
+    return whatsapp_client.send_message(to, message_type, content, caption)
 
 def mark_message_as_read(message_id):
     """Marca un mensaje como leído"""
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "status": "read",
-        "message_id": message_id
-    }
-    
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    return response.status_code == 200
+    return whatsapp_client.mark_message_as_read(message_id)
 
 def get_media_url(media_id):
-    """Obtiene la URL de un archivo multimedia"""
-    api_version = "v17.0"
-    url = f"https://graph.facebook.com/{api_version}/{media_id}"
-    
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        media_data = response.json()
-        media_url = media_data.get("url")
-        
-        if media_url:
-            media_response = requests.get(
-                media_url,
-                headers={"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"}
-            )
-            if media_response.status_code == 200:
-                return media_response.content
-    
-    return None
+    """Obtiene el contenido de un archivo multimedia"""
+    return whatsapp_client.get_media_content(media_id)
 
 # ---- PROCESAMIENTO DE MENSAJES ----
 
@@ -142,10 +78,6 @@ def process_incoming_message(sender, message_type, content, message_id=None):
     Procesa los mensajes entrantes usando el agente de calificación de leads.
     """
     try:
-        # Marcar mensaje como leído si tenemos el ID
-        if message_id:
-            mark_message_as_read(message_id)
-        
         # Obtener o crear usuario
         user = get_or_create_user(phone=sender)
         
@@ -163,14 +95,25 @@ def process_incoming_message(sender, message_type, content, message_id=None):
             }
             message_content = f"[El usuario ha enviado un archivo de tipo {media_type_names.get(message_type, 'multimedia')}]"
         
-        # Agregar mensaje del usuario a la base de datos
-        add_message(
-            conversation_id=conversation["id"],
-            role="user",
-            content=message_content,
-            message_type=message_type,
-            external_id=message_id
-        )
+        # Agregar mensaje del usuario a la base de datos (la unicidad de external_id
+        # descarta las entregas repetidas antes del aviso de lectura)
+        try:
+            add_message(
+                conversation_id=conversation["id"],
+                role="user",
+                content=message_content,
+                message_type=message_type,
+                external_id=message_id
+            )
+        except DuplicateMessageError:
+            # Entrega repetida que no estaba en memoria (p. ej. tras un reinicio): ya fue procesada
+            metrics.increment("webhook.duplicates.database")
+            logger.info(f"Mensaje duplicado descartado: {message_id}")
+            return True
+        
+        # Marcar mensaje como leído si tenemos el ID
+        if message_id:
+            mark_message_as_read(message_id)
         
         # Obtener historial de mensajes para el agente
         messages_history = get_conversation_history(conversation["id"])
@@ -233,7 +176,7 @@ def process_incoming_message(sender, message_type, content, message_id=None):
         return True
     
     except Exception as e:
-        print(f"Error al procesar mensaje: {str(e)}")
+        logger.error(f"Error al procesar mensaje: {str(e)}")
         # Enviar mensaje de error al usuario
         error_message = "Lo siento, estamos experimentando dificultades técnicas. Por favor, intenta nuevamente más tarde."
         send_whatsapp_message(sender, "text", error_message)
@@ -298,6 +241,12 @@ def process_webhook_messages(message_data):
         sender = message.get('from')
         message_id = message.get('id')
         
+        # Descartar entregas repetidas antes de marcar como leído o tocar la base de datos
+        if message_id and not seen_message_ids.add(message_id):
+            metrics.increment("webhook.duplicates.memory")
+            logger.info(f"Mensaje duplicado descartado: {message_id}")
+            continue
+        
         if message_type == 'text':
             text = message.get('text', {}).get('body', '')
             process_incoming_message(sender, 'text', text, message_id)
@@ -0,0 +1,392 @@
+"""
+Cliente compartido para la WhatsApp Cloud API (Graph).
+
+Mantiene un pool de conexiones keep-alive hacia graph.facebook.com (HTTP/2
+opcional), precalcula los encabezados de autenticación y las URLs, aplica un
+timeout distinto por operación y registra cuántas peticiones reutilizaron una
+conexión existente.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Configuración de WhatsApp
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
+WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v17.0")
+
+# Configuración del pool de conexiones
+WHATSAPP_HTTP2 = os.getenv("WHATSAPP_HTTP2", "false").lower() in ["1", "true", "yes"]
+WHATSAPP_MAX_CONNECTIONS = int(os.getenv("WHATSAPP_MAX_CONNECTIONS", 20))
+WHATSAPP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("WHATSAPP_MAX_KEEPALIVE_CONNECTIONS", 10))
+WHATSAPP_KEEPALIVE_EXPIRY = float(os.getenv("WHATSAPP_KEEPALIVE_EXPIRY", 60))
+
+# Timeouts por operación (segundos)
+WHATSAPP_CONNECT_TIMEOUT = float(os.getenv("WHATSAPP_CONNECT_TIMEOUT", 5))
+OPERATION_TIMEOUTS = {
+    "send_message": float(os.getenv("WHATSAPP_SEND_TIMEOUT", 15)),
+    "mark_as_read": float(os.getenv("WHATSAPP_READ_TIMEOUT", 5)),
+    "get_media": float(os.getenv("WHATSAPP_MEDIA_TIMEOUT", 60))
+}
+
+GRAPH_BASE_URL = "https://graph.facebook.com"
+
+
+def build_message_payload(to, message_type, content, caption=None):
+    """
+    Construye el payload de un mensaje saliente según su tipo.
+
+    Args:
+        to: Número de teléfono del destinatario
+        message_type: Tipo de mensaje (text, image, audio, video)
+        content: Contenido del mensaje (texto o URL)
+        caption: Pie de foto/video (opcional)
+
+    Returns:
+        Payload listo para enviar a la API
+    """
+    payload = {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": to
+    }
+
+    if message_type == "text":
+        payload["type"] = "text"
+        payload["text"] = {"body": content}
+
+    elif message_type in ["image", "audio", "video"]:
+        payload["type"] = message_type
+        payload[message_type] = {"link": content}
+        if caption and message_type in ["image", "video"]:
+            payload[message_type]["caption"] = caption
+
+    return payload
+
+
+def _http2_available(requested):
+    """Indica si se puede usar HTTP/2 (requiere el paquete h2)"""
+    if not requested:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("WHATSAPP_HTTP2 activado pero el paquete 'h2' no está instalado; usando HTTP/1.1")
+        return False
+
+
+class _PoolStats:
+    """Estadísticas de uso del pool: peticiones, conexiones nuevas y latencia por operación"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.errors = 0
+        self.operations = {}
+
+    def connection_opened(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def record(self, operation, elapsed, error=False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            stats = self.operations.setdefault(operation, {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["count"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if error:
+                stats["errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+                "errors": self.errors,
+                "operations": {
+                    name: {
+                        "count": stats["count"],
+                        "errors": stats["errors"],
+                        "avg_seconds": round(stats["total_time"] / stats["count"], 4) if stats["count"] else 0.0,
+                        "max_seconds": round(stats["max_time"], 4)
+                    }
+                    for name, stats in self.operations.items()
+                }
+            }
+
+
+class _BaseWhatsAppClient:
+    """Configuración compartida entre el cliente síncrono y el asíncrono"""
+
+    def __init__(self, phone_number_id=None, access_token=None, api_version=None, http2=None):
+        """
+        Args:
+            phone_number_id: ID del número de WhatsApp Business
+            access_token: Token de acceso de la Cloud API
+            api_version: Versión de la Graph API
+            http2: Usar HTTP/2 si está disponible (por defecto WHATSAPP_HTTP2)
+        """
+        self.phone_number_id = phone_number_id or WHATSAPP_PHONE_NUMBER_ID
+        self.access_token = access_token or WHATSAPP_ACCESS_TOKEN
+        self.api_version = api_version or WHATSAPP_API_VERSION
+        self.http2 = _http2_available(WHATSAPP_HTTP2 if http2 is None else http2)
+
+        # Encabezados y URLs precalculados
+        self.auth_headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.json_headers = {**self.auth_headers, "Content-Type": "application/json"}
+        self.messages_url = f"{GRAPH_BASE_URL}/{self.api_version}/{self.phone_number_id}/messages"
+        self.media_url_template = f"{GRAPH_BASE_URL}/{self.api_version}/{{media_id}}"
+
+        self.stats = _PoolStats()
+
+    def _client_options(self):
+        return {
+            "http2": self.http2,
+            "limits": httpx.Limits(
+                max_connections=WHATSAPP_MAX_CONNECTIONS,
+                max_keepalive_connections=WHATSAPP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=WHATSAPP_KEEPALIVE_EXPIRY
+            ),
+            "timeout": httpx.Timeout(OPERATION_TIMEOUTS["send_message"], connect=WHATSAPP_CONNECT_TIMEOUT)
+        }
+
+    def _timeout(self, operation):
+        return httpx.Timeout(OPERATION_TIMEOUTS[operation], connect=WHATSAPP_CONNECT_TIMEOUT)
+
+    def get_stats(self):
+        """
+        Retorna las estadísticas de reutilización del pool y de latencia por operación.
+        """
+        stats = self.stats.snapshot()
+        stats["http2"] = self.http2
+        return stats
+
+
+class WhatsAppClient(_BaseWhatsAppClient):
+    """
+    Cliente síncrono de la WhatsApp Cloud API con pool de conexiones compartido.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = httpx.Client(**self._client_options())
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats.connection_opened()
+
+    def _request(self, operation, method, url, **kwargs):
+        """Ejecuta una petición registrando latencia y uso del pool"""
+        start_time = time.monotonic()
+        try:
+            response = self._client.request(
+                method,
+                url,
+                timeout=self._timeout(operation),
+                extensions={"trace": self._trace},
+                **kwargs
+            )
+        except Exception:
+            self.stats.record(operation, time.monotonic() - start_time, error=True)
+            raise
+        self.stats.record(operation, time.monotonic() - start_time, error=response.status_code >= 400)
+        return response
+
+    def post_message(self, payload: Dict) -> httpx.Response:
+        """
+        Envía un payload al endpoint de mensajes y retorna la respuesta HTTP sin interpretar.
+
+        Raises:
+            httpx.HTTPError: Si hay un error de red o timeout
+        """
+        return self._request("send_message", "POST", self.messages_url, headers=self.json_headers, json=payload)
+
+    def send_message(self, to, message_type, content, caption=None) -> Optional[Dict]:
+        """
+        Envía un mensaje a WhatsApp.
+
+        Returns:
+            Respuesta de la API o None si hubo un error
+        """
+        try:
+            response = self.post_message(build_message_payload(to, message_type, content, caption))
+            if response.status_code == 200:
+                return response.json()
+            logger.error(f"Error al enviar mensaje: {response.status_code} - {response.text}")
+            return None
+        except httpx.TimeoutException:
+            logger.error(f"Timeout al enviar mensaje a {to} después de {OPERATION_TIMEOUTS['send_message']}s")
+            return None
+        except Exception as e:
+            logger.error(f"Error al enviar mensaje: {str(e)}")
+            return None
+
+    def mark_message_as_read(self, message_id) -> bool:
+        """Marca un mensaje como leído"""
+        payload = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        try:
+            response = self._request("mark_as_read", "POST", self.messages_url, headers=self.json_headers, json=payload)
+            return response.status_code == 200
+        except Exception as e:
+            logger.error(f"Error al marcar mensaje como leído: {str(e)}")
+            return False
+
+    def get_media_content(self, media_id) -> Optional[bytes]:
+        """Descarga el contenido de un archivo multimedia"""
+        try:
+            response = self._request("get_media", "GET", self.media_url_template.format(media_id=media_id), headers=self.auth_headers)
+            if response.status_code != 200:
+                return None
+
+            media_url = response.json().get("url")
+            if not media_url:
+                return None
+
+            media_response = self._request("get_media", "GET", media_url, headers=self.auth_headers)
+            if media_response.status_code == 200:
+                return media_response.content
+            return None
+        except Exception as e:
+            logger.error(f"Error al obtener URL de multimedia: {str(e)}")
+            return None
+
+    def close(self):
+        """Cierra las conexiones del pool"""
+        self._client.close()
+
+
+class AsyncWhatsAppClient(_BaseWhatsAppClient):
+    """
+    Cliente asíncrono de la WhatsApp Cloud API con pool de conexiones compartido.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = httpx.AsyncClient(**self._client_options())
+
+    async def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats.connection_opened()
+
+    async def _request(self, operation, method, url, **kwargs):
+        """Ejecuta una petición registrando latencia y uso del pool"""
+        start_time = time.monotonic()
+        try:
+            response = await self._client.request(
+                method,
+                url,
+                timeout=self._timeout(operation),
+                extensions={"trace": self._trace},
+                **kwargs
+            )
+        except Exception:
+            self.stats.record(operation, time.monotonic() - start_time, error=True)
+            raise
+        self.stats.record(operation, time.monotonic() - start_time, error=response.status_code >= 400)
+        return response
+
+    async def post_message(self, payload: Dict) -> httpx.Response:
+        """
+        Envía un payload al endpoint de mensajes y retorna la respuesta HTTP sin interpretar.
+
+        Raises:
+            httpx.HTTPError: Si hay un error de red o timeout
+        """
+        return await self._request("send_message", "POST", self.messages_url, headers=self.json_headers, json=payload)
+
+    async def send_message(self, to, message_type, content, caption=None) -> Optional[Dict]:
+        """
+        Envía un mensaje a WhatsApp.
+
+        Returns:
+            Respuesta de la API o None si hubo un error
+        """
+        try:
+            response = await self.post_message(build_message_payload(to, message_type, content, caption))
+            if response.status_code == 200:
+                return response.json()
+            logger.error(f"Error al enviar mensaje: {response.status_code} - {response.text}")
+            return None
+        except httpx.TimeoutException:
+            logger.error(f"Timeout al enviar mensaje a {to} después de {OPERATION_TIMEOUTS['send_message']}s")
+            return None
+        except Exception as e:
+            logger.error(f"Error al enviar mensaje: {str(e)}")
+            return None
+
+    async def mark_message_as_read(self, message_id) -> bool:
+        """Marca un mensaje como leído"""
+        payload = {
+            "messaging_product": "whatsapp",
+            "status": "read",
+            "message_id": message_id
+        }
+        try:
+            response = await self._request("mark_as_read", "POST", self.messages_url, headers=self.json_headers, json=payload)
+            return response.status_code == 200
+        except Exception as e:
+            logger.error(f"Error al marcar mensaje como leído: {str(e)}")
+            return False
+
+    async def get_media_content(self, media_id) -> Optional[bytes]:
+        """Descarga el contenido de un archivo multimedia"""
+        try:
+            response = await self._request("get_media", "GET", self.media_url_template.format(media_id=media_id), headers=self.auth_headers)
+            if response.status_code != 200:
+                return None
+
+            media_url = response.json().get("url")
+            if not media_url:
+                return None
+
+            media_response = await self._request("get_media", "GET", media_url, headers=self.auth_headers)
+            if media_response.status_code == 200:
+                return media_response.content
+            return None
+        except Exception as e:
+            logger.error(f"Error al obtener URL de multimedia: {str(e)}")
+            return None
+
+    async def aclose(self):
+        """Cierra las conexiones del pool"""
+        await self._client.aclose()
+
+
+# Cliente síncrono compartido por todo el proceso
+_whatsapp_client = None
+_whatsapp_client_lock = threading.Lock()
+
+
+def get_whatsapp_client() -> WhatsAppClient:
+    """Retorna el cliente síncrono compartido, creándolo la primera vez"""
+    global _whatsapp_client
+    if _whatsapp_client is None:
+        with _whatsapp_client_lock:
+            if _whatsapp_client is None:
+                _whatsapp_client = WhatsAppClient()
+                logger.info(f"Cliente de WhatsApp inicializado (HTTP/2: {_whatsapp_client.http2})")
+    return _whatsapp_client
@@ -0,0 +1,320 @@
+"""
+Pool de procesos para ejecutar los turnos del agente fuera del proceso del webhook.
+
+En modo multiproceso el proceso del webhook solo valida, registra en el journal
+y encola; cada proceso del pool tiene su propia instancia del agente, su propio
+GIL y su propio despachador por remitente. Cada remitente se enruta siempre al
+mismo proceso (hash estable), así sus mensajes se procesan en orden.
+
+Las colas son de `multiprocessing`, por lo que el pool escala con los núcleos de
+una máquina; repartir los procesos entre varias máquinas requiere sustituir las
+colas por un broker de red manteniendo el mismo enrutamiento por remitente.
+"""
+
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from degraded_mode import DEFERRED
+from utils.dispatcher import stable_shard
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tamaño máximo de la cola de cada proceso del pool
+AGENT_WORKER_QUEUE_MAXSIZE = int(os.getenv("AGENT_WORKER_QUEUE_MAXSIZE", 1000))
+
+# Veces que se reasigna una ráfaga cuyo proceso murió antes de descartarla
+AGENT_WORKER_MAX_ATTEMPTS = int(os.getenv("AGENT_WORKER_MAX_ATTEMPTS", 3))
+
+# Segundos entre revisiones del estado de los procesos
+AGENT_WORKER_MONITOR_INTERVAL = float(os.getenv("AGENT_WORKER_MONITOR_INTERVAL", 1.0))
+
+# Prefijo del nombre de los procesos del pool
+WORKER_PROCESS_PREFIX = "agent-worker"
+
+
+def is_agent_worker_process() -> bool:
+    """Indica si el proceso actual es un proceso del pool de agentes"""
+    return (
+        multiprocessing.parent_process() is not None
+        and multiprocessing.current_process().name.startswith(WORKER_PROCESS_PREFIX)
+    )
+
+
+def _import_handler_module(module_name):
+    """
+    Importa el módulo que procesa los mensajes en el proceso hijo.
+
+    Si el módulo es el script principal del padre (`python simple_webhook.py`),
+    `multiprocessing` ya lo cargó como `__mp_main__` y se reutiliza esa copia.
+    """
+    main_module = sys.modules.get("__mp_main__")
+    main_file = getattr(main_module, "__file__", None)
+    if main_file and os.path.splitext(os.path.basename(main_file))[0] == module_name:
+        sys.modules[module_name] = main_module
+        return main_module
+    return importlib.import_module(module_name)
+
+
+def _worker_main(index, num_workers, module_name, task_queue, result_queue):
+    """
+    Bucle principal de un proceso del pool.
+
+    Args:
+        index: Índice del proceso en el pool
+        num_workers: Número total de procesos (para repartir el throughput de WhatsApp)
+        module_name: Módulo con `process_incoming_messages`, `dispatcher` y `outbound_sender`
+        task_queue: Cola de ráfagas asignadas a este proceso
+        result_queue: Cola donde se informan las ráfagas iniciadas, terminadas y diferidas
+    """
+    module = _import_handler_module(module_name)
+
+    # El límite de WhatsApp es por número de teléfono: cada proceso usa su parte
+    outbound_sender = module.outbound_sender
+    outbound_sender.set_rate(outbound_sender.bucket.rate / num_workers, outbound_sender.bucket.capacity / num_workers)
+
+    def run_batch(batch_id, sender, incoming_messages):
+        result_queue.put((index, batch_id, "started"))
+        result = None
+        try:
+            result = module.process_incoming_messages(sender, incoming_messages)
+        finally:
+            # Una ráfaga diferida por el modo degradado solo existe en este proceso:
+            # el padre no debe dar por terminadas sus entradas del journal
+            result_queue.put((index, batch_id, "deferred" if result == DEFERRED else "done"))
+
+    logger.info(f"{WORKER_PROCESS_PREFIX}-{index} listo (pid {os.getpid()})")
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        batch_id, sender_key, sender, incoming_messages = task
+        # Esperar si el despachador local está lleno: la cola del proceso hace de backpressure
+        while not module.dispatcher.submit(sender_key, run_batch, batch_id, sender, incoming_messages, timeout=1.0):
+            pass
+
+
+class AgentWorkerPool:
+    """
+    Reparte ráfagas de mensajes entre procesos hijos, con afinidad por remitente.
+    """
+
+    def __init__(self, num_workers, module_name, on_batch_done: Optional[Callable[[List[Dict]], None]] = None,
+                 max_queue_size=None):
+        """
+        Args:
+            num_workers: Número de procesos del pool
+            module_name: Módulo que cada proceso importa para procesar los mensajes
+            on_batch_done: Función llamada en el proceso padre con los mensajes de cada ráfaga terminada
+            max_queue_size: Tamaño máximo de la cola de cada proceso
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.module_name = module_name
+        self.on_batch_done = on_batch_done
+        self.max_queue_size = max_queue_size or AGENT_WORKER_QUEUE_MAXSIZE
+        self._context = multiprocessing.get_context("spawn")
+        # SimpleQueue escribe de forma síncrona: el aviso "started" llega aunque el proceso muera después
+        self._result_queue = self._context.SimpleQueue()
+        self._task_queues = [None] * self.num_workers
+        self._processes = [None] * self.num_workers
+        self._inflight = [{} for _ in range(self.num_workers)]
+        # Ráfagas reasignadas que aún no caben en la cola del proceso: {batch_id: tarea}
+        self._requeue = [{} for _ in range(self.num_workers)]
+        self._stats = [
+            {"submitted": 0, "completed": 0, "deferred": 0, "rejected": 0, "restarts": 0, "abandoned": 0}
+            for _ in range(self.num_workers)
+        ]
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopping = False
+
+    def start(self):
+        """Inicia los procesos y los hilos de resultados y supervisión (idempotente)"""
+        with self._lock:
+            if self._started:
+                return
+            for index in range(self.num_workers):
+                self._spawn(index)
+            self._started = True
+        atexit.register(self.stop)
+        threading.Thread(target=self._collect_results, name="agent-pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="agent-pool-monitor", daemon=True).start()
+        logger.info(f"Pool de agentes iniciado con {self.num_workers} procesos")
+
+    def _spawn(self, index):
+        """Crea (o recrea) el proceso y la cola de un índice; requiere tener el lock"""
+        self._task_queues[index] = self._context.Queue(maxsize=self.max_queue_size)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.num_workers, self.module_name, self._task_queues[index], self._result_queue),
+            name=f"{WORKER_PROCESS_PREFIX}-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def submit(self, sender_key, sender, incoming_messages) -> bool:
+        """
+        Encola una ráfaga en el proceso asignado al remitente.
+
+        Args:
+            sender_key: Número normalizado (clave de enrutamiento)
+            sender: Número de teléfono tal como llegó en el webhook
+            incoming_messages: Mensajes de la ráfaga
+
+        Returns:
+            True si la ráfaga fue encolada, False si la cola del proceso estaba llena
+        """
+        self.start()
+        index = stable_shard(sender_key, self.num_workers)
+        task = (uuid.uuid4().hex, sender_key, sender, incoming_messages)
+        with self._lock:
+            try:
+                # Las ráfagas reasignadas van antes, para no adelantar mensajes del mismo remitente
+                if self._requeue[index]:
+                    raise queue.Full
+                self._task_queues[index].put_nowait(task)
+            except queue.Full:
+                self._stats[index]["rejected"] += 1
+                logger.warning(f"Cola del {WORKER_PROCESS_PREFIX}-{index} llena, ráfaga rechazada")
+                return False
+            # Ráfaga en curso: [tarea, intentos, iniciada]
+            self._inflight[index][task[0]] = [task, 0, False]
+            self._stats[index]["submitted"] += 1
+        return True
+
+    def has_capacity(self, sender_key) -> bool:
+        """Indica si la cola del proceso asignado al remitente admite otra ráfaga"""
+        self.start()
+        index = stable_shard(sender_key, self.num_workers)
+        task_queue = self._task_queues[index]
+        return task_queue is not None and not self._requeue[index] and not task_queue.full()
+
+    def _collect_results(self):
+        """Recibe los avisos de los procesos y notifica las ráfagas terminadas (no las diferidas)"""
+        while True:
+            index, batch_id, event = self._result_queue.get()
+            with self._lock:
+                if event == "started":
+                    entry = self._inflight[index].get(batch_id)
+                    if entry:
+                        entry[2] = True
+                    continue
+                entry = self._inflight[index].pop(batch_id, None)
+                if entry:
+                    self._stats[index]["completed" if event == "done" else "deferred"] += 1
+            # Las ráfagas diferidas conservan sus entradas del journal hasta reprocesarse
+            if entry and event == "done":
+                self._finish(entry[0])
+
+    def _finish(self, task):
+        """Notifica al proceso padre que una ráfaga ya no está en curso"""
+        if not self.on_batch_done:
+            return
+        try:
+            self.on_batch_done(task[3])
+        except Exception as e:
+            logger.error(f"Error al finalizar la ráfaga {task[0]}: {str(e)}")
+
+    def _monitor(self):
+        """Reinicia los procesos caídos y les reasigna sus ráfagas pendientes"""
+        while True:
+            time.sleep(AGENT_WORKER_MONITOR_INTERVAL)
+            abandoned = []
+            with self._lock:
+                if self._stopping:
+                    return
+                for index, process in enumerate(self._processes):
+                    if process.is_alive():
+                        continue
+                    inflight = self._inflight[index]
+                    logger.error(
+                        f"{WORKER_PROCESS_PREFIX}-{index} (pid {process.pid}) terminó con código {process.exitcode}; "
+                        f"reiniciando y reasignando {len(inflight)} ráfaga(s)"
+                    )
+                    # Cola nueva: la anterior puede haber quedado inconsistente al morir el proceso
+                    self._spawn(index)
+                    self._stats[index]["restarts"] += 1
+                    for batch_id, entry in list(inflight.items()):
+                        task, attempts, started = entry
+                        # Solo cuentan los intentos de las ráfagas que se estaban ejecutando
+                        if started:
+                            attempts += 1
+                        if attempts >= AGENT_WORKER_MAX_ATTEMPTS:
+                            # Probablemente es la ráfaga que tumba al proceso
+                            logger.error(f"Ráfaga {batch_id} de {task[2]} descartada tras {attempts} intentos")
+                            del inflight[batch_id]
+                            self._requeue[index].pop(batch_id, None)
+                            self._stats[index]["abandoned"] += 1
+                            abandoned.append(task)
+                            continue
+                        inflight[batch_id] = [task, attempts, False]
+                        # Los mensajes ya guardados se descartan por la unicidad de external_id
+                        self._requeue[index][batch_id] = task
+                pending = [
+                    (index, self._task_queues[index], list(requeue.items()))
+                    for index, requeue in enumerate(self._requeue) if requeue
+                ]
+            # Reencolar sin el lock (submit y _collect_results no esperan al monitor).
+            # Solo este hilo recrea las colas, así que la cola capturada sigue siendo la vigente.
+            for index, task_queue, tasks in pending:
+                queued = []
+                for batch_id, task in tasks:
+                    try:
+                        task_queue.put_nowait(task)
+                    except queue.Full:
+                        # Se reintenta en la siguiente revisión
+                        break
+                    queued.append(batch_id)
+                with self._lock:
+                    for batch_id in queued:
+                        self._requeue[index].pop(batch_id, None)
+                    remaining = len(self._requeue[index])
+                if remaining:
+                    logger.warning(
+                        f"Cola del {WORKER_PROCESS_PREFIX}-{index} llena, "
+                        f"{remaining} ráfaga(s) reasignada(s) en espera"
+                    )
+            for task in abandoned:
+                self._finish(task)
+
+    def stop(self):
+        """Detiene la supervisión y pide a los procesos que terminen"""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            for task_queue in self._task_queues:
+                if task_queue is None:
+                    continue
+                try:
+                    task_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def get_stats(self):
+        """
+        Retorna el estado, la cola y los contadores de cada proceso del pool.
+        """
+        workers = []
+        with self._lock:
+            for index, process in enumerate(self._processes):
+                stats = dict(self._stats[index])
+                stats.update({
+                    "worker": index,
+                    "pid": process.pid if process else None,
+                    "alive": bool(process and process.is_alive()),
+                    "inflight": len(self._inflight[index]),
+                    "requeue_pending": len(self._requeue[index])
+                })
+                workers.append(stats)
+        return {"num_workers": self.num_workers, "max_queue_size": self.max_queue_size, "workers": workers}